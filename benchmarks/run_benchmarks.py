@@ -0,0 +1,257 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+import numpy as np
+import pandas as pd
+
+import matplotlib.dates as mdates
+
+sys.path.append('data_processing')
+sys.path.append('integration_not_sorted')
+import lfe_func
+from lfe_func import create_mask, get_sav_data, get_catalogue, catalogue_polygons
+from join_lfes import LFE_joiner
+from add_ppos import get_ppo_phases
+from binned_stats import init_binned_stats, update_binned_stats, histogram_2d
+from integration_tools import create_sweeps, linear_segments, integrate
+
+from synthetic import synthetic_skr_year, save_synthetic_skr_year, synthetic_polygons, synthetic_catalogue, synthetic_lfe_table, synthetic_ppo, synthetic_akr_sweeps
+
+# Filepaths
+benchmark_results_fp = 'benchmarks/results'
+
+# Sizes of the inputs at scale 1: a year of SKR flux and AKR sweeps, the polygons of a year, the detections and
+# ephemeris minutes of the mission
+year_steps = 175200
+year_polygons = 700
+mission_lfes = 10000
+mission_minutes = 7200000
+ppo_samples = 500000
+
+# Every benchmark takes the scale and a temporary folder, and returns the timed function and a description of its size
+def bench_create_mask(scale, tmp_fp):
+    time, freq, _ = synthetic_skr_year(n_time=max(int(year_steps * scale), 480), nan_fraction=0)
+    time_num = mdates.date2num(time)
+    polygons = synthetic_polygons(max(int(year_polygons * scale), 5), start=str(time[0]), end=str(time[-1]))
+    polygons = [np.column_stack((mdates.date2num(poly[:, 0].astype('datetime64[s]')), poly[:, 1])) for poly in polygons]
+
+    def run():
+        for poly in polygons:
+            create_mask(poly, time_num, freq, compact=True)
+
+    return run, f'{len(polygons)} polygons on a {len(freq)}x{len(time_num)} grid'
+
+def bench_sav_cache(scale, tmp_fp):
+    # No .sav writer is available, so the year is written straight to the cache and the raw folder is left empty
+    _, freq, flux = save_synthetic_skr_year(2006, tmp_fp + '/SKR_cache', n_time=max(int(year_steps * scale), 480))
+
+    def run():
+        lfe_func._open_packed_arrays.cache_clear()
+        _, _, flux = get_sav_data(2006, skr_raw_fp=tmp_fp + '/SKR_raw', skr_cache_fp=tmp_fp + '/SKR_cache')
+        np.nansum(flux)  # Read every page of the memory map
+
+    return run, f'{len(freq)}x{flux.shape[1]} cached flux values'
+
+def bench_catalogue_pack(scale, tmp_fp):
+    catalogue_fp = tmp_fp + '/catalogue.json'
+    with open(catalogue_fp, 'w') as f:
+        json.dump(synthetic_catalogue(max(int(14 * year_polygons * scale), 5)), f)
+
+    def run():
+        if os.path.exists(tmp_fp + '/catalogue.bin'):
+            os.remove(tmp_fp + '/catalogue.bin')
+        lfe_func._open_packed_arrays.cache_clear()
+        get_catalogue(catalogue_fp, cache_fp=tmp_fp)
+
+    return run, f'{max(int(14 * year_polygons * scale), 5)} TFCat features'
+
+def bench_catalogue_load(scale, tmp_fp):
+    catalogue_fp = tmp_fp + '/catalogue.json'
+    with open(catalogue_fp, 'w') as f:
+        json.dump(synthetic_catalogue(max(int(14 * year_polygons * scale), 5)), f)
+    get_catalogue(catalogue_fp, cache_fp=tmp_fp)
+
+    def run():
+        lfe_func._open_packed_arrays.cache_clear()
+        catalogue_polygons(get_catalogue(catalogue_fp, cache_fp=tmp_fp)[0], 'num')
+
+    return run, f'{max(int(14 * year_polygons * scale), 5)} packed polygons'
+
+def _akr_sweeps(scale):
+    akr_df = synthetic_akr_sweeps(max(int(year_steps * scale), 100))
+    akr_df.replace(-1, np.nan, inplace=True)
+    create_sweeps(akr_df, time='datetime_ut', inplace=True)
+
+    return akr_df
+
+def bench_linear_segments(scale, tmp_fp):
+    akr_df = _akr_sweeps(scale)
+
+    def run():
+        linear_segments(akr_df, time='datetime_ut', frequency='freq', flux='akr_flux_si_1au', preserve_cols=['datetime_ut'])
+
+    return run, f'{akr_df["SWEEP"].iloc[-1]} sweeps, {len(akr_df)} rows'
+
+def bench_integrate_fixed(scale, tmp_fp):
+    akr_df = _akr_sweeps(scale)
+    df_lin = linear_segments(akr_df, time='datetime_ut', frequency='freq', flux='akr_flux_si_1au', preserve_cols=[])
+
+    return lambda: integrate(df_lin, flimits=[(20, 1000), (100, 400), (40, 100)]), f'{len(df_lin)} segments, 3 bands'
+
+def bench_integrate_variable(scale, tmp_fp):
+    akr_df = _akr_sweeps(scale)
+    df_lin = linear_segments(akr_df, time='datetime_ut', frequency='freq', flux='akr_flux_si_1au', preserve_cols=[])
+
+    rng = np.random.default_rng(0)
+    sweeps = np.unique(akr_df['SWEEP'])
+    flims = np.sort(rng.choice(np.unique(akr_df['freq']), (len(sweeps), 2)), axis=1)
+    flims = pd.DataFrame({'fmin': flims[:, 0], 'fmax': flims[:, 1], 'SWEEP': sweeps})
+
+    return lambda: integrate(df_lin, flimits=flims), f'{len(df_lin)} segments'
+
+def bench_lfe_joiner(scale, tmp_fp):
+    lfe_df = synthetic_lfe_table(max(int(mission_lfes * scale), 50))
+
+    return lambda: LFE_joiner(tmp_fp + '/', lfe_df), f'{len(lfe_df)} detections'
+
+def bench_ppo_phases(scale, tmp_fp):
+    ppo = synthetic_ppo(max(int(ppo_samples * scale), 1000))
+    times = synthetic_lfe_table(max(int(mission_lfes * scale), 50))['start']
+
+    def run():
+        get_ppo_phases(times, ppo, mode='nearest')
+        get_ppo_phases(times, ppo, mode='linear')
+
+    return run, f'{len(times)} times, {len(ppo["south_model_time"])} phase samples'
+
+def bench_lst_binning(scale, tmp_fp):
+    _, freq, flux = synthetic_skr_year(n_time=max(int(year_steps * scale), 480))
+    local_time = (np.arange(flux.shape[1]) * 180 / 3600 / 10) % 24  # Slow drift through local time
+
+    def run():
+        stats = init_binned_stats(np.arange(0, 24.2, 0.2), len(freq))
+        update_binned_stats(stats, local_time, flux)
+
+    return run, f'{flux.shape[0]}x{flux.shape[1]} flux values'
+
+def bench_rho_z_binning(scale, tmp_fp):
+    rng = np.random.default_rng(0)
+    n = max(int(mission_minutes * scale), 1000)
+    rho, z = rng.uniform(0, 60, n), rng.normal(0, 10, n)
+
+    return lambda: histogram_2d(rho, z, np.arange(0, 61, 1), np.arange(-30, 30.5, 0.5)), f'{n} ephemeris minutes'
+
+BENCHMARKS = {'create_mask': bench_create_mask,
+              'sav_cache': bench_sav_cache,
+              'catalogue_pack': bench_catalogue_pack,
+              'catalogue_load': bench_catalogue_load,
+              'linear_segments': bench_linear_segments,
+              'integrate_fixed': bench_integrate_fixed,
+              'integrate_variable': bench_integrate_variable,
+              'LFE_joiner': bench_lfe_joiner,
+              'get_ppo_phases': bench_ppo_phases,
+              'lst_binning': bench_lst_binning,
+              'rho_z_binning': bench_rho_z_binning}
+
+def run_benchmarks(names=None, scales=(0.01, 0.1, 1), repeat=3):
+    """Time the benchmarks on synthetic inputs at several scales.
+
+    Parameters
+    ----------
+    names: list, optional
+        Benchmarks to run, from BENCHMARKS. Default is all of them.
+
+    scales: iterable, optional
+        Input sizes relative to the real data, see the sizes at scale 1 at the top of this file.
+
+    repeat: int, optional
+        Number of timed runs of each benchmark, after an untimed warm-up run.
+
+    Returns
+    -------
+    results: dict
+        'best' and 'median' run time in seconds, all 'times' and the input 'size', by benchmark and scale.
+    """
+    results = {}
+    for name in names or BENCHMARKS:
+        results[name] = {}
+        for scale in scales:
+            tmp_fp = tempfile.mkdtemp(prefix='lfe_benchmark_')
+            try:
+                run, size = BENCHMARKS[name](scale, tmp_fp)
+                run()
+
+                times = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    run()
+                    times.append(time.perf_counter() - start)
+            finally:
+                shutil.rmtree(tmp_fp, ignore_errors=True)
+
+            results[name][str(scale)] = {'size': size, 'best': min(times), 'median': float(np.median(times)), 'times': times}
+            print(f'{name:<20} scale {scale:<6} {min(times):10.4f} s  ({size})')
+
+    return results
+
+def compare_results(results, reference):
+    """Print the ratio of the best run times to those of a previous results file.
+
+    Parameters
+    ----------
+    results, reference: dict
+        Results as saved by this script.
+    """
+    print(f'Compared to {reference["commit"]} ({reference["date"]}), ratio > 1 is slower:')
+    for name, scales in results['results'].items():
+        for scale, result in scales.items():
+            previous = reference['results'].get(name, {}).get(scale)
+            if previous is not None:
+                print(f'{name:<20} scale {scale:<6} {result["best"] / previous["best"]:6.2f}')
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the hot paths of the LFE code on synthetic data.')
+    parser.add_argument('names', nargs='*', help=f'benchmarks to run, from {list(BENCHMARKS)}')
+    parser.add_argument('--scales', type=float, nargs='+', default=[0.01, 0.1, 1], help='input sizes relative to the real data')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs of each benchmark')
+    parser.add_argument('--output', help='results file, default is benchmarks/results/benchmarks_<commit>.json')
+    parser.add_argument('--compare', help='previous results file to compare with')
+    args = parser.parse_args()
+
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f'unknown benchmarks {sorted(unknown)}, choose from {list(BENCHMARKS)}')
+
+    commit = git_commit()
+    results = {'commit': commit,
+               'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'python': platform.python_version(),
+               'numpy': np.__version__,
+               'pandas': pd.__version__,
+               'machine': platform.machine(),
+               'cpu_count': os.cpu_count(),
+               'repeat': args.repeat,
+               'results': run_benchmarks(args.names or None, args.scales, args.repeat)}
+
+    output_fp = args.output or benchmark_results_fp + f'/benchmarks_{commit}.json'
+    os.makedirs(os.path.dirname(output_fp) or '.', exist_ok=True)
+    with open(output_fp, 'w') as f:
+        json.dump(results, f, indent=1)
+    print(f'Saved {output_fp}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare_results(results, json.load(f))
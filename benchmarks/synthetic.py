@@ -0,0 +1,270 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.append('data_processing')
+from lfe_func import save_packed_arrays
+
+skr_step = np.timedelta64(180, 's')  # SKR time step
+
+def synthetic_skr_year(year=2006, n_time=175200, n_freq=48, nan_fraction=0.1, seed=0):
+    """Generate an SKR-like flux array with the layout returned by get_sav_data.
+
+    Parameters
+    ----------
+    year: int, optional
+        Year of the time axis, which starts on January 1st.
+
+    n_time: int, optional
+        Number of 3 minute time steps. Default is a full year.
+
+    n_freq: int, optional
+        Number of frequency channels. Default is the 48 SKR channels.
+
+    nan_fraction: float, optional
+        Fraction of missing (NaN) flux values.
+
+    seed: int, optional
+        Random seed.
+
+    Returns
+    -------
+    time: numpy.array
+        Time series in 3 minute steps, datetime64[s].
+
+    freq: numpy.array
+        Frequency channels in kHz.
+
+    flux: numpy.array (freq.shape, time.shape)
+        Log-normal flux in W/m^2/Hz modulated at the PPO period, NaN where missing.
+    """
+    rng = np.random.default_rng(seed)
+
+    time = np.datetime64(f'{year}-01-01', 's') + np.arange(n_time) * skr_step
+    freq = np.logspace(np.log10(3.5), np.log10(1200), n_freq)  # Cassini RPWS/HFR-like channels
+
+    # SKR peaks around 100-400 kHz, and is modulated at the ~10.7 hour PPO period
+    spectrum = -21 + 1.5 * np.exp(-np.log10(freq / 200)**2 / 0.2)
+    modulation = 0.5 * np.sin(2 * np.pi * np.arange(n_time) * 180 / (10.7 * 3600))
+    flux = 10**(spectrum[:, np.newaxis] + modulation + rng.normal(0, 0.5, (n_freq, n_time)))
+    flux[rng.random((n_freq, n_time)) < nan_fraction] = np.nan
+
+    return time, freq, flux
+
+def save_synthetic_skr_year(year, skr_cache_fp, **kwargs):
+    """Save a synthetic SKR year as a get_sav_data cache file, so get_sav_data(year, skr_cache_fp=...) reads it.
+
+    Parameters
+    ----------
+    year: int
+        Year of the file.
+
+    skr_cache_fp: str
+        Folder of the cache file.
+
+    **kwargs
+        Passed to synthetic_skr_year.
+
+    Returns
+    -------
+    time, freq, flux: numpy.array
+        Arrays saved, see synthetic_skr_year.
+    """
+    time, freq, flux = synthetic_skr_year(year, **kwargs)
+
+    os.makedirs(skr_cache_fp, exist_ok=True)
+    save_packed_arrays(skr_cache_fp + f'/SKR_{year}_CJ.bin', {'time': time, 'freq': freq, 'flux': flux}, meta={'source': None})
+
+    return time, freq, flux
+
+def synthetic_polygons(n_polygons, start='2006-01-01', end='2007-01-01', n_vertices=(8, 60), seed=0):
+    """Generate LFE-like time-frequency polygons.
+
+    Polygons are star-shaped around a random centre, lasting from 20 minutes to 5 hours and reaching from below
+    100 kHz up to 100-800 kHz.
+
+    Parameters
+    ----------
+    n_polygons: int
+        Number of polygons.
+
+    start, end: str, optional
+        Time range of the polygons.
+
+    n_vertices: tuple, optional
+        Lowest and highest number of vertices of a polygon.
+
+    seed: int, optional
+        Random seed.
+
+    Returns
+    -------
+    polygons: list
+        Closed polygon time-frequency coordinates sorted by start time, time in unix seconds and frequency in kHz.
+    """
+    rng = np.random.default_rng(seed)
+    unix_start, unix_end = pd.Timestamp(start).timestamp(), pd.Timestamp(end).timestamp()
+
+    centres = np.sort(rng.uniform(unix_start, unix_end - 5 * 3600, n_polygons))
+    durations = rng.uniform(20 * 60, 5 * 3600, n_polygons)
+    freq_low, freq_high = rng.uniform(10, 100, n_polygons), rng.uniform(100, 800, n_polygons)
+
+    polygons = []
+    for centre, duration, f_low, f_high in zip(centres, durations, freq_low, freq_high):
+        n = rng.integers(n_vertices[0], n_vertices[1] + 1)
+        angle = np.sort(rng.uniform(0, 2 * np.pi, n))
+        radius = rng.uniform(0.6, 1, n)
+
+        # Ellipse in time and log frequency
+        log_centre, log_radius = (np.log10(f_low) + np.log10(f_high)) / 2, (np.log10(f_high) - np.log10(f_low)) / 2
+        poly_time = centre + duration / 2 * (1 + radius * np.cos(angle))
+        poly_freq = 10**(log_centre + log_radius * radius * np.sin(angle))
+
+        poly = np.column_stack((poly_time, poly_freq))
+        polygons.append(np.vstack((poly, poly[:1])))
+
+    return polygons
+
+def synthetic_catalogue(n_polygons, **kwargs):
+    """Generate a TFCat-like catalogue of LFE polygons.
+
+    Parameters
+    ----------
+    n_polygons: int
+        Number of features.
+
+    **kwargs
+        Passed to synthetic_polygons.
+
+    Returns
+    -------
+    catalogue: dict
+        TFCat FeatureCollection, to be saved with json.dump.
+    """
+    features = [{'type': 'Feature', 'id': i,
+                 'geometry': {'type': 'Polygon', 'coordinates': [poly.tolist()]},
+                 'properties': {'feature_type': 'LFE'}}
+                for i, poly in enumerate(synthetic_polygons(n_polygons, **kwargs))]
+
+    return {'type': 'FeatureCollection',
+            'features': features,
+            'crs': {'type': 'local', 'properties': {'name': 'Time-Frequency', 'time_coords_id': 'unix', 'spectral_coords': {'type': 'frequency', 'unit': 'kHz'}}}}
+
+def synthetic_lfe_table(n_lfes, start='2004-01-01', end='2017-09-15', gap_fraction=0.3, seed=0):
+    """Generate an LFE detection table shaped like lfe_detections_unet.csv.
+
+    Parameters
+    ----------
+    n_lfes: int
+        Number of detections.
+
+    start, end: str, optional
+        Time range of the detections.
+
+    gap_fraction: float, optional
+        Fraction of detections starting less than 10 minutes after the end of the previous one, which LFE_joiner joins.
+
+    seed: int, optional
+        Random seed.
+
+    Returns
+    -------
+    lfe_df: pandas.DataFrame
+        Detections sorted by start time with 'start', 'end', 'label', 'probability', ephemeris and 'duration' columns.
+    """
+    rng = np.random.default_rng(seed)
+
+    durations = pd.to_timedelta(rng.uniform(10, 300, n_lfes), unit='m').round('s')
+    span = (pd.Timestamp(end) - pd.Timestamp(start)) / n_lfes
+
+    # Gaps after each detection, short ones are joined
+    short = rng.random(n_lfes) < gap_fraction
+    gaps = np.where(short, rng.uniform(0, 10, n_lfes), rng.exponential(span / pd.Timedelta(1, 'm'), n_lfes))
+    offsets = np.concatenate([[0], np.cumsum(durations[:-1] / pd.Timedelta(1, 'm') + gaps[:-1])])
+
+    starts = pd.Timestamp(start) + pd.to_timedelta(offsets, unit='m').round('s')
+    starts = starts[starts < pd.Timestamp(end)]
+    n_lfes = len(starts)
+
+    r_ksm = rng.uniform(3, 60, n_lfes)
+    lat = rng.uniform(-np.pi / 4, np.pi / 4, n_lfes)
+    lst = rng.uniform(0, 24, n_lfes)
+    x_ksm, y_ksm = r_ksm * np.cos(lat) * np.cos(lst * np.pi / 12 - np.pi), r_ksm * np.cos(lat) * np.sin(lst * np.pi / 12 - np.pi)
+
+    lfe_df = pd.DataFrame({'start': starts, 'end': starts + durations[:n_lfes],
+                           'label': rng.choice(['LFE', 'LFE_m', 'LFE_sp', 'LFE_ext'], n_lfes),
+                           'probability': rng.uniform(0.5, 1, n_lfes),
+                           'x_ksm': x_ksm, 'y_ksm': y_ksm, 'z_ksm': r_ksm * np.sin(lat), 'R_ksm': r_ksm,
+                           'subLST': lst, 'subLat': np.degrees(lat), 'subLon': rng.uniform(0, 360, n_lfes)})
+    lfe_df['duration'] = (lfe_df['end'] - lfe_df['start']).dt.total_seconds()
+
+    return lfe_df
+
+def synthetic_ppo(n_samples, days=5000, seed=0):
+    """Generate PPO phase series with the layout of the phase sav file read by add_ppos.py.
+
+    Parameters
+    ----------
+    n_samples: int
+        Number of model times of each series.
+
+    days: float, optional
+        Days since 2004-01-01 covered by the series.
+
+    seed: int, optional
+        Random seed.
+
+    Returns
+    -------
+    ppo: dict
+        'south_model_time' and 'north_model_time' in days since 2004-01-01, and 'south_mag_phase' and
+        'north_mag_phase' in degrees in [0, 360).
+    """
+    rng = np.random.default_rng(seed)
+
+    ppo = {}
+    for hemisphere, period in (('south', 10.79), ('north', 10.64)):
+        model_time = np.sort(rng.uniform(0, days, n_samples))
+        phase = (360 * 24 / period * model_time + rng.normal(0, 5, n_samples)) % 360
+        ppo[f'{hemisphere}_model_time'], ppo[f'{hemisphere}_mag_phase'] = model_time, phase
+
+    return ppo
+
+def synthetic_akr_sweeps(n_sweeps, n_freq=32, start='2003-01-01', nan_fraction=0.05, seed=0):
+    """Generate Wind/Waves-like AKR sweeps with the columns of the wi_wa_rad1_l3_akr csv files.
+
+    Parameters
+    ----------
+    n_sweeps: int
+        Number of sweeps, one every 3 minutes.
+
+    n_freq: int, optional
+        Number of frequency channels per sweep.
+
+    start: str, optional
+        Time of the first sweep.
+
+    nan_fraction: float, optional
+        Fraction of missing flux values, written as -1 as in the csv files.
+
+    seed: int, optional
+        Random seed.
+
+    Returns
+    -------
+    akr_df: pandas.DataFrame
+        'datetime_ut', 'freq' in kHz and 'akr_flux_si_1au' for every channel of every sweep.
+    """
+    rng = np.random.default_rng(seed)
+
+    sweep_time = pd.Timestamp(start) + np.arange(n_sweeps) * pd.Timedelta(3, 'm')
+    freq = np.linspace(20, 1040, n_freq)
+
+    flux = 10**rng.normal(-19, 1, (n_sweeps, n_freq))
+    flux[rng.random((n_sweeps, n_freq)) < nan_fraction] = -1
+
+    return pd.DataFrame({'datetime_ut': np.repeat(sweep_time, n_freq),
+                         'freq': np.tile(freq, n_sweeps),
+                         'akr_flux_si_1au': flux.ravel()})
@@ -2,49 +2,80 @@ import numpy as np
 import pandas as pd
 
 from scipy.io import readsav
-from tqdm import tqdm
 
 data_directory = 'data/calculated/'
 ppo_file = 'data/raw/mag_phases_2004_2017_final.sav' # Phases Calibration Data
 
-join_unet = pd.read_csv('data/calculated/LFEs_joined.csv', index_col = 0)
+def get_ppo_phases(times, ppo, mode='nearest'):
+    """Look up the south and north PPO phases at any array of times.
 
-def SavePPO(file_path, LFE_df, data_directory, file_name):
-    """Read PPO phase sav file, and matching lfe start with the PPOs."""
-    print("Finding LFE Phase")
+    Parameters
+    ----------
+    times: array-like
+        Times to look up, anything pandas.to_datetime understands.
 
-    print(f"Loading {file_path}")
-    ppo_df = readsav(file_path)
+    ppo: dict
+        PPO phase data as read from the phase sav file, with south/north model times in days since 2004-01-01.
+
+    mode: str, optional
+        'nearest' returns the phase of the closest model time, 'linear' interpolates linearly between the two
+        surrounding model times on the unwrapped phase. Samples with a missing model time or phase are left out.
+        Default is 'nearest'.
+
+    Returns
+    -------
+    south_phase, north_phase: numpy.array
+        Phases at the given times in degrees, wrapped into [0, 360) in both modes.
+    """
+    if mode not in ('nearest', 'linear'):
+        raise ValueError(f'mode not understood. You chose: {mode}. Please specify either "nearest" or "linear".')
+
+    doy2004 = np.asarray((pd.to_datetime(np.asarray(times).ravel()) - pd.Timestamp(2004, 1, 1)) / pd.Timedelta(1, 'D'), dtype=float) # days since 2004-01-01 00:00:00
 
+    south_phase = _lookup_phase(doy2004, ppo["south_model_time"], ppo["south_mag_phase"], mode)
+    north_phase = _lookup_phase(doy2004, ppo["north_model_time"], ppo["north_mag_phase"], mode)
 
-    south_time = ppo_df["south_model_time"] # minutes since 2004-01-01 00:00:00
-    south_phase = ppo_df["south_mag_phase"]
+    return south_phase, north_phase
 
-    north_time = ppo_df["north_model_time"]
-    north_phase = ppo_df["north_mag_phase"]
+def _lookup_phase(t, model_time, phase, mode):
+    """Binary search the phase series at times t, see get_ppo_phases."""
+    model_time, phase = np.asarray(model_time, dtype=float), np.asarray(phase, dtype=float)
 
-    doy2004_0 = pd.Timestamp(2004, 1, 1)
+    # Samples with a missing time or phase are dropped, a NaN phase would otherwise spread to every later unwrapped phase
+    finite = np.isfinite(model_time) & np.isfinite(phase)
+    model_time, phase = model_time[finite], phase[finite]
 
-    lfe_south_phase_indices = []
-    lfe_north_phase_indices = []
-    for i, lfe in tqdm(LFE_df.iterrows(), total=len(LFE_df)):
+    order = np.argsort(model_time, kind='stable')
+    model_time, phase = model_time[order], phase[order]
 
-        lfe_start_time = lfe["start"] # pandas timestamp
-        lfe_start_doy2004 = (pd.Timestamp(lfe_start_time) - doy2004_0).total_seconds() / 60 / 60 / 24 # days since 2004-01-01 00:00:00
+    right = np.clip(np.searchsorted(model_time, t, side='left'), 1, len(model_time) - 1)
+    left = right - 1
 
-        # Find minimum time difference
-        south_index = (np.abs(south_time - lfe_start_doy2004)).argmin()
-        lfe_south_phase_indices.append(south_index)
+    if mode == 'nearest':
+        # Ties go to the earlier sample, then to the first of repeated model times, like argmin
+        nearest = np.where(np.abs(t - model_time[left]) <= np.abs(model_time[right] - t), left, right)
+        nearest = np.searchsorted(model_time, model_time[nearest], side='left')
+        return phase[nearest] % 360
 
-        north_index = (np.abs(north_time - lfe_start_doy2004)).argmin()
-        lfe_north_phase_indices.append(north_index)
+    # Interpolate the unwrapped phase, then wrap back into [0, 360)
+    unwrapped = np.unwrap(phase, period=360)
+    interpolated = np.interp(t, model_time, unwrapped)
 
+    return (interpolated + (phase[left] - unwrapped[left])) % 360
 
-    print(len(lfe_south_phase_indices))
-    LFE_df["south phase"] = np.array(south_phase)[lfe_south_phase_indices]
-    LFE_df["north phase"] = np.array(north_phase)[lfe_north_phase_indices]
+def SavePPO(file_path, LFE_df, data_directory, file_name):
+    """Read PPO phase sav file, and matching lfe start with the PPOs."""
+    print("Finding LFE Phase")
+
+    print(f"Loading {file_path}")
+    ppo_df = readsav(file_path)
+
+    LFE_df["south phase"], LFE_df["north phase"] = get_ppo_phases(LFE_df["start"], ppo_df)
 
     print(f"Saving new csv file to {data_directory+file_name}")
     LFE_df.to_csv(data_directory + file_name)
 
-SavePPO(ppo_file, join_unet, data_directory, "Joined_LFEs_w_phases.csv")
\ No newline at end of file
+if __name__ == '__main__':
+    join_unet = pd.read_csv('data/calculated/LFEs_joined.csv', index_col = 0)
+
+    SavePPO(ppo_file, join_unet, data_directory, "Joined_LFEs_w_phases.csv")
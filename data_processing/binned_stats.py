@@ -0,0 +1,368 @@
+import os
+
+import numpy as np
+
+from lfe_func import get_sav_data, get_poly_flux, get_ephemeris, save_packed_arrays, load_packed_arrays, file_signature
+
+# Log-spaced flux histogram edges used for the quantiles, 50 bins per decade
+_HIST_EDGES = np.logspace(-25, -15, 501)
+
+# Edges of the cached fine dwell histograms per ephemeris coordinate, coarser binnings aligned on them are summed from
+# the cache instead of rescanning the ephemeris
+_DWELL_BINS = {'x_ksm': np.arange(-250, 250.5, 0.5),
+               'y_ksm': np.arange(-250, 250.5, 0.5),
+               'z_ksm': np.arange(-250, 250.5, 0.5),
+               'rho': np.arange(0, 250.25, 0.25),
+               'R_ksm': np.arange(0, 250.25, 0.25),
+               'subLST': np.linspace(0, 24, 481),
+               'subLat': np.arange(-90, 90.25, 0.25),
+               'subLon': np.arange(0, 360.5, 0.5)}
+
+def init_binned_stats(bins, n_channels, hist_edges=_HIST_EDGES):
+    """Create an empty accumulator of binned flux statistics.
+
+    Parameters
+    ----------
+    bins: numpy.array
+        Edges of the bins of the binning coordinate, binned as pandas.cut does: (bins[i], bins[i + 1]].
+
+    n_channels: int
+        Number of frequency channels of the flux.
+
+    hist_edges: numpy.array, optional
+        Increasing edges of the flux histograms kept per (bin, channel) for the quantiles. Values outside of the
+        edges are counted in an underflow and an overflow bin.
+
+    Returns
+    -------
+    stats: dict
+        'bins', 'hist_edges', and per (bin, channel) the 'sum' and 'count' of the finite flux values and their 'hist'
+        of shape (len(bins) - 1, n_channels, len(hist_edges) + 1).
+    """
+    n_bins = len(bins) - 1
+
+    return {'bins': np.asarray(bins, dtype=float),
+            'hist_edges': np.asarray(hist_edges, dtype=float),
+            'sum': np.zeros((n_bins, n_channels)),
+            'count': np.zeros((n_bins, n_channels), dtype=np.int64),
+            'hist': np.zeros((n_bins, n_channels, len(hist_edges) + 1), dtype=np.int64)}
+
+def update_binned_stats(stats, coordinate, flux):
+    """Add a block of flux to the binned statistics.
+
+    Parameters
+    ----------
+    stats: dict
+        Accumulator from init_binned_stats, modified in place.
+
+    coordinate: numpy.array
+        Binning coordinate (e.g. subLST) of each time, NaN values are left out.
+
+    flux: numpy.array (n_channels, coordinate.shape)
+        Flux values, NaN values are left out.
+    """
+    bins, hist_edges = stats['bins'], stats['hist_edges']
+    n_bins, n_channels, n_hist = stats['hist'].shape
+
+    # Bin of each time, as pandas.cut with right-closed bins
+    bin_index = np.searchsorted(bins, coordinate, side='left') - 1
+    in_bins = (coordinate > bins[0]) & (coordinate <= bins[-1])
+
+    flux = np.asarray(flux)[:, in_bins]
+    bin_index = np.broadcast_to(bin_index[in_bins], flux.shape)
+    channel = np.broadcast_to(np.arange(n_channels)[:, None], flux.shape)
+
+    finite = np.isfinite(flux)
+    flux, cell = flux[finite], bin_index[finite] * n_channels + channel[finite]
+
+    stats['sum'] += np.bincount(cell, weights=flux, minlength=n_bins * n_channels).reshape(n_bins, n_channels)
+    stats['count'] += np.bincount(cell, minlength=n_bins * n_channels).reshape(n_bins, n_channels)
+
+    hist_index = np.searchsorted(hist_edges, flux, side='right')
+    hist_index = np.minimum(hist_index, n_hist - 1)  # Underflow is 0, values at or above the last edge go to n_hist - 1
+    stats['hist'] += np.bincount(cell * n_hist + hist_index, minlength=n_bins * n_channels * n_hist).reshape(n_bins, n_channels, n_hist)
+
+def binned_mean(stats):
+    """Mean flux per (bin, channel), NaN where a bin has no values.
+
+    Parameters
+    ----------
+    stats: dict
+        Accumulator from init_binned_stats.
+
+    Returns
+    -------
+    mean: numpy.array (n_bins, n_channels)
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(stats['count'] > 0, stats['sum'] / stats['count'], np.nan)
+
+def _hist_value(hist, cumulative, log_edges, rank):
+    """Flux of the value of integer rank in each histogram, the values of a bin spread evenly in log flux."""
+    hist_index = np.minimum(np.sum(cumulative <= rank[..., None], axis=-1), hist.shape[-1] - 1)
+
+    below = np.take_along_axis(cumulative - hist, hist_index[..., None], axis=-1)[..., 0]
+    in_bin = np.take_along_axis(hist, hist_index[..., None], axis=-1)[..., 0]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fraction = (rank - below + 0.5) / in_bin
+
+    edge_index = np.clip(hist_index - 1, 0, len(log_edges) - 2)
+    log_value = log_edges[edge_index] + fraction * (log_edges[edge_index + 1] - log_edges[edge_index])
+    log_value = np.where(hist_index == 0, log_edges[0], log_value)
+    log_value = np.where(hist_index == hist.shape[-1] - 1, log_edges[-1], log_value)
+
+    return 10**log_value
+
+def binned_quantile(stats, q):
+    """Flux quantile per (bin, channel) estimated from the histograms.
+
+    The values of a histogram bin are taken as evenly spread in log flux inside it, and the quantile is interpolated
+    between the two values around it as numpy.quantile does, so it is exact to within one histogram bin (about 5%
+    with the default edges). Values in the underflow or overflow bin are taken as the first or last edge.
+
+    Parameters
+    ----------
+    stats: dict
+        Accumulator from init_binned_stats.
+
+    q: float
+        Quantile, between 0 and 1. 0.5 gives the median.
+
+    Returns
+    -------
+    quantile: numpy.array (n_bins, n_channels)
+        NaN where a bin has no values.
+    """
+    hist, log_edges = stats['hist'], np.log10(stats['hist_edges'])
+    cumulative = np.cumsum(hist, axis=-1)
+    total = cumulative[..., -1]
+
+    rank = q * np.maximum(total - 1, 0)
+    low, high = np.floor(rank), np.ceil(rank)
+
+    value_low = _hist_value(hist, cumulative, log_edges, low)
+    value_high = _hist_value(hist, cumulative, log_edges, high)
+    quantile = value_low + (rank - low) * (value_high - value_low)
+
+    return np.where(total > 0, quantile, np.nan)
+
+def get_binned_stats(bins, coordinate='subLST', years=range(2004, 2018), source='raw', hist_edges=_HIST_EDGES,
+                     skr_raw_fp='data/raw/SKR_raw', skr_cache_fp='data/calculated/SKR_cache',
+                     poly_flux_fp='data/calculated/poly_flux_combined.zarr',
+                     ephemeris_store_fp='data/calculated/20040101000000_20170915115700_ephemeris.bin'):
+    """Bin the SKR flux of the whole mission by an ephemeris coordinate, one year in memory at a time.
+
+    Every flux time is matched to the ephemeris minute at the same time, as a merge on the time column would.
+
+    Parameters
+    ----------
+    bins: numpy.array
+        Edges of the coordinate bins, e.g. numpy.arange(0, 24.2, 0.2) for 12 minutes of local time.
+
+    coordinate: str, optional
+        Ephemeris column to bin by. Default is 'subLST'.
+
+    years: iterable, optional
+        Years to include. Default is the whole mission.
+
+    source: str, optional
+        'raw' for the full SKR flux from get_sav_data, 'poly' for the polygon-selected flux from get_poly_flux.
+
+    hist_edges: numpy.array, optional
+        Flux histogram edges, see init_binned_stats.
+
+    skr_raw_fp, skr_cache_fp, poly_flux_fp, ephemeris_store_fp: str, optional
+        Paths of the data, see get_sav_data, get_poly_flux and get_ephemeris.
+
+    Returns
+    -------
+    freq: numpy.array
+        Frequency channels.
+
+    stats: dict
+        Accumulator from init_binned_stats holding the whole mission, see binned_mean and binned_quantile.
+    """
+    stats = None
+    for year in years:
+        if source == 'raw':
+            time, freq, flux = get_sav_data(year, skr_raw_fp, skr_cache_fp)
+        elif source == 'poly':
+            time, freq, flux = get_poly_flux(f'{year}-01-01', f'{year}-12-31T23:59:59', poly_flux_fp)
+        else:
+            raise ValueError(f"source must be 'raw' or 'poly', not {source!r}")
+
+        if stats is None:
+            stats = init_binned_stats(bins, len(freq), hist_edges)
+
+        values = get_ephemeris(time, columns=[coordinate], store_fp=ephemeris_store_fp)[coordinate].to_numpy()
+        update_binned_stats(stats, values, flux)
+
+    return freq, stats
+
+def ephemeris_coordinate(table, name):
+    """Values of an ephemeris coordinate from a table of ephemeris columns.
+
+    Parameters
+    ----------
+    table: pandas.DataFrame or dict
+        Ephemeris columns, e.g. the LFE catalogue or the arrays of the ephemeris store.
+
+    name: str
+        Column name, or 'rho' for the distance from the KSM z axis computed from x_ksm and y_ksm.
+
+    Returns
+    -------
+    values: numpy.array
+    """
+    if name == 'rho':
+        return np.sqrt(np.asarray(table['x_ksm'], dtype=float)**2 + np.asarray(table['y_ksm'], dtype=float)**2)
+
+    return np.asarray(table[name], dtype=float)
+
+def _bin_index(values, bins):
+    """Bin of each value as pandas.cut with right-closed bins, -1 for values outside of the bins or NaN."""
+    values, bins = np.asarray(values, dtype=float), np.asarray(bins, dtype=float)
+    n_bins = len(bins) - 1
+    width = np.diff(bins)
+
+    if np.allclose(width, width[0]):
+        # Direct index on a regular grid, moved by one bin where rounding puts a value on the wrong side of an edge
+        with np.errstate(invalid='ignore'):
+            index = np.ceil((values - bins[0]) / width[0]) - 1
+        index = np.clip(np.nan_to_num(index, nan=0), 0, n_bins - 1).astype(np.intp)
+        index = index - (values <= bins[index]) + (values > bins[index + 1])
+    else:
+        index = np.searchsorted(bins, values, side='left') - 1
+
+    return np.where((values > bins[0]) & (values <= bins[-1]), index, -1)
+
+def histogram_2d(x, y, x_bins, y_bins):
+    """Count the points in each cell of a 2-D binning, as pandas.cut and groupby().size() would.
+
+    Parameters
+    ----------
+    x, y: numpy.array
+        Coordinates of the points, NaN values are left out.
+
+    x_bins, y_bins: numpy.array
+        Bin edges, bins are right-closed.
+
+    Returns
+    -------
+    counts: numpy.array (len(y_bins) - 1, len(x_bins) - 1)
+        Number of points per cell, y along the first axis as for pcolormesh(x_bins, y_bins, counts).
+    """
+    x_index, y_index = _bin_index(x, x_bins), _bin_index(y, y_bins)
+    n_x, n_y = len(x_bins) - 1, len(y_bins) - 1
+
+    valid = (x_index >= 0) & (y_index >= 0)
+
+    return np.bincount(y_index[valid] * n_x + x_index[valid], minlength=n_x * n_y).reshape(n_y, n_x)
+
+def _aligned_edges(fine_bins, bins):
+    """Position of each edge of bins among fine_bins, None if an edge is not one of fine_bins."""
+    if fine_bins is None:
+        return None
+
+    position = np.clip(np.searchsorted(fine_bins, bins), 1, len(fine_bins) - 1)
+    position = np.where(np.abs(fine_bins[position - 1] - bins) < np.abs(fine_bins[position] - bins), position - 1, position)
+
+    if not np.allclose(fine_bins[position], bins, rtol=0, atol=1e-9 * np.max(np.abs(fine_bins))):
+        return None
+
+    return position
+
+def get_dwell_histogram(x, y, x_bins, y_bins, ephemeris_store_fp='data/calculated/20040101000000_20170915115700_ephemeris.bin',
+                        dwell_cache_fp='data/calculated/dwell_cache'):
+    """Minutes spent by Cassini in each cell of a 2-D binning of two ephemeris coordinates.
+
+    The histogram of every coordinate pair is computed once on the fine _DWELL_BINS edges and cached in dwell_cache_fp
+    until the ephemeris store changes. Binnings whose edges are all fine edges are summed from the cache, other
+    binnings are computed from the ephemeris store directly.
+
+    Parameters
+    ----------
+    x, y: str
+        Ephemeris coordinates, see ephemeris_coordinate.
+
+    x_bins, y_bins: numpy.array
+        Bin edges, bins are right-closed.
+
+    ephemeris_store_fp: str, optional
+        Path of the ephemeris store, see get_ephemeris.
+
+    dwell_cache_fp: str, optional
+        Folder of the cached fine histograms.
+
+    Returns
+    -------
+    dwell: numpy.array (len(y_bins) - 1, len(x_bins) - 1)
+        Minutes of ephemeris in each cell.
+    """
+    x_edges = _aligned_edges(_DWELL_BINS.get(x), np.asarray(x_bins, dtype=float))
+    y_edges = _aligned_edges(_DWELL_BINS.get(y), np.asarray(y_bins, dtype=float))
+
+    if x_edges is None or y_edges is None:
+        ephemeris, meta = load_packed_arrays(ephemeris_store_fp)
+        counts = histogram_2d(ephemeris_coordinate(ephemeris, x), ephemeris_coordinate(ephemeris, y), x_bins, y_bins)
+        return counts * meta['step_s'] / 60
+
+    cache_fp = os.path.join(dwell_cache_fp, f'dwell_{x}_{y}.bin')
+    source = file_signature(ephemeris_store_fp)
+
+    fine = None
+    if os.path.exists(cache_fp):
+        arrays, meta = load_packed_arrays(cache_fp)
+        if meta['source'] == source:
+            fine = arrays['dwell']
+
+    if fine is None:
+        ephemeris, meta = load_packed_arrays(ephemeris_store_fp)
+        fine = histogram_2d(ephemeris_coordinate(ephemeris, x), ephemeris_coordinate(ephemeris, y), _DWELL_BINS[x], _DWELL_BINS[y]) * meta['step_s'] / 60
+
+        os.makedirs(dwell_cache_fp, exist_ok=True)
+        save_packed_arrays(cache_fp, {'dwell': fine}, meta={'source': source})
+
+    # Sum the fine cells inside each coarse cell
+    fine = fine[y_edges[0]:y_edges[-1], x_edges[0]:x_edges[-1]]
+    dwell = np.add.reduceat(fine, y_edges[:-1] - y_edges[0], axis=0)
+
+    return np.add.reduceat(dwell, x_edges[:-1] - x_edges[0], axis=1)
+
+def get_rate_map(events, x, y, x_bins, y_bins, ephemeris_store_fp='data/calculated/20040101000000_20170915115700_ephemeris.bin',
+                 dwell_cache_fp='data/calculated/dwell_cache'):
+    """Occurrence map of events normalised by the time Cassini spent in each cell.
+
+    Parameters
+    ----------
+    events: pandas.DataFrame
+        Events with ephemeris columns, e.g. the LFE catalogue.
+
+    x, y: str
+        Ephemeris coordinates, see ephemeris_coordinate.
+
+    x_bins, y_bins: numpy.array
+        Bin edges, bins are right-closed.
+
+    ephemeris_store_fp, dwell_cache_fp: str, optional
+        See get_dwell_histogram.
+
+    Returns
+    -------
+    counts: numpy.array (len(y_bins) - 1, len(x_bins) - 1)
+        Number of events per cell.
+
+    dwell: numpy.array (len(y_bins) - 1, len(x_bins) - 1)
+        Minutes spent by Cassini in each cell.
+
+    rate: numpy.array (len(y_bins) - 1, len(x_bins) - 1)
+        Events per minute spent in each cell, NaN where Cassini never was.
+    """
+    counts = histogram_2d(ephemeris_coordinate(events, x), ephemeris_coordinate(events, y), x_bins, y_bins)
+    dwell = get_dwell_histogram(x, y, x_bins, y_bins, ephemeris_store_fp, dwell_cache_fp)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rate = np.where(dwell > 0, counts / dwell, np.nan)
+
+    return counts, dwell, rate
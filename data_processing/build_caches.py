@@ -0,0 +1,13 @@
+from lfe_func import get_sav_data, get_catalogue
+
+# Filepaths
+unet_catalogue_fp = 'data/calculated/2004001_2017258_joint_catalogue.json'
+
+# Build the memory-mappable caches read by get_polygon_flux.py and get_lfe_power.py once, before they run, so the two
+# scripts only read them and can run at the same time
+
+for year in range(2004, 2018):
+    print(year)
+    get_sav_data(year)
+
+get_catalogue(unet_catalogue_fp)
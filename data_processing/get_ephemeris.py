@@ -1,12 +1,24 @@
+import os
+import glob
+import hashlib
+import datetime
+import importlib
+from functools import partial
+
 import spiceypy as spice
 import numpy as np
 import pandas as pd
-import datetime
 import tqdm
+from multiprocess import Pool  # Change 'multiprocess' to 'multiprocessing' if given an error
+
+from lfe_func import save_ephemeris_store, get_ephemeris
 
 #spice.furnsh("SPICE/cassini/metakernel_cassini.txt")
 #spice.furnsh("SPICE/cassini/kernels/fk/cas_dyn_v03.tf")
 unet_catalogue_csv_fp = 'data/raw/2004001_2017258_start_stop_times.csv'
+metakernel_fp = 'SPICE/cassini/metakernel_cassini.txt'
+ephemeris_chunks_fp = 'data/calculated/ephemeris_chunks'
+ephemeris_store_fp = 'data/calculated/20040101000000_20170915115700_ephemeris.bin'
 
 #   CASSINI end date: Sep. 15 2017
 start_datetime = datetime.datetime(2004, 1, 1)
@@ -15,12 +27,23 @@ stop_datetime = datetime.datetime(2017, 9, 15, 11, 57) # datetime.datetime(2017,
 #   Get an array of datetimes spanning start to stop
 minutely_datetimes = np.arange(start_datetime, stop_datetime, datetime.timedelta(minutes=1), dtype = datetime.datetime)
 
-def get_CassiniEphemeris(datetimes):
+def get_CassiniEphemeris(datetimes, metakernel=metakernel_fp, backend=spice, progress=True, vectorized=True):
     """
     Parameters
     ----------
     datetimes : list of datetimes
         A list of python datetimes for which the ephemeris will be returned
+    metakernel : str, optional
+        Path of the SPICE metakernel to load
+    backend : module, optional
+        SPICE implementation, spiceypy by default. Any object providing the
+        spiceypy functions used here can be swapped in, e.g. a stub for tests
+    progress : bool, optional
+        Show a progress bar over the datetimes
+    vectorized : bool, optional
+        Compute the sub-spacecraft point for all datetimes at once with
+        get_SubSpacecraftPoint, instead of one subpnt/recpgr/et2lst call
+        per datetime
 
     Returns
     -------
@@ -32,54 +55,57 @@ def get_CassiniEphemeris(datetimes):
 
     """
     #   Load a CASSINI SPICE metakernel
-    with spice.KernelPool('SPICE/cassini/metakernel_cassini.txt'):
+    with backend.KernelPool(metakernel):
         
         #   Get SPICE code for Saturn and 3D radii
-        target_id = str(spice.bodn2c('Saturn'))
-        _, R_S_3 = spice.bodvrd(target_id, 'RADII', 3)
+        target_id = str(backend.bodn2c('Saturn'))
+        _, R_S_3 = backend.bodvrd(target_id, 'RADII', 3)
         saturn_flattening = (R_S_3[0] - R_S_3[2]) / R_S_3[0]
         
         #   Convert datetimes to ETs for SPICE
-        ets = spice.datetime2et(datetimes)
+        ets = backend.datetime2et(datetimes)
         
         #   Query the spacecraft position with SPICE
-        pos, lt = spice.spkpos('CASSINI', 
+        pos, lt = backend.spkpos('CASSINI', 
                                ets, 
                                'CASSINI_KSM', 
                                'None', 
                                target_id)
         
-        sub_lats = []
-        sub_lons = []
-        sub_lsts = []
-        for et in tqdm.tqdm(ets):
+        if vectorized:
+            sub_lons, sub_lats, sub_lsts = get_SubSpacecraftPoint(ets, target_id, R_S_3, backend=backend)
+        else:
+            sub_lats = []
+            sub_lons = []
+            sub_lsts = []
+            for et in tqdm.tqdm(ets, disable=not progress):
             
-            #   Get the sub-observer (i.e. spacecraft) point on the target (planet)
-            #   This does not handle array inputs, hence the loop
-            subpoint, epoch, vec = spice.subpnt('INTERCEPT/ELLIPSOID',  # Method
-                                                target_id,              # Saturn
-                                                et,                     # When
-                                                'IAU_SATURN',           # Frame
-                                                'None',                 # Light travel time correction
-                                                'CASSINI')              # Observer
+                #   Get the sub-observer (i.e. spacecraft) point on the target (planet)
+                #   This does not handle array inputs, hence the loop
+                subpoint, epoch, vec = backend.subpnt('INTERCEPT/ELLIPSOID',  # Method
+                                                    target_id,              # Saturn
+                                                    et,                     # When
+                                                    'IAU_SATURN',           # Frame
+                                                    'None',                 # Light travel time correction
+                                                    'CASSINI')              # Observer
             
-            #   Convert from rectangular IAU_SATURN coords to planetographic
-            lon, lat, alt = spice.recpgr(target_id, 
-                                         subpoint, 
-                                         R_S_3[0], 
-                                         saturn_flattening)
+                #   Convert from rectangular IAU_SATURN coords to planetographic
+                lon, lat, alt = backend.recpgr(target_id, 
+                                             subpoint, 
+                                             R_S_3[0], 
+                                             saturn_flattening)
             
-            sub_lats.append(lat)
-            sub_lons.append(lon)
+                sub_lats.append(lat)
+                sub_lons.append(lon)
             
-            #   Convert from time to local solar time (LST), given a longitude
-            lst_tuple = spice.et2lst(et, 
-                                     int(target_id), 
-                                     lon, 
-                                     'PLANETOGRAPHIC')
-            #   Convert local solar time to decimal hours
-            decimal_hour_lst = lst_tuple[0] + lst_tuple[1]/60 + lst_tuple[2]/3600
-            sub_lsts.append(decimal_hour_lst)
+                #   Convert from time to local solar time (LST), given a longitude
+                lst_tuple = backend.et2lst(et, 
+                                         int(target_id), 
+                                         lon, 
+                                         'PLANETOGRAPHIC')
+                #   Convert local solar time to decimal hours
+                decimal_hour_lst = lst_tuple[0] + lst_tuple[1]/60 + lst_tuple[2]/3600
+                sub_lsts.append(decimal_hour_lst)
     
     #   Put everything in a dataframe
     df = pd.DataFrame({'start':datetimes,
@@ -95,32 +121,164 @@ def get_CassiniEphemeris(datetimes):
     
     return df
 
-#   Print this to a csv (this will be pretty hefty)
-eph_df = get_CassiniEphemeris(minutely_datetimes)
-eph_df.to_csv('data/calculated/20040101000000_20170915115700_ephemeris.csv')
+def get_SubSpacecraftPoint(ets, target_id, R_S_3, backend=spice):
+    """
+    Parameters
+    ----------
+    ets : array of floats
+        Ephemeris times, SPICE kernels must already be loaded
+    target_id : str
+        SPICE code of Saturn
+    R_S_3 : array of floats
+        The 3 radii of Saturn
+    backend : module, optional
+        SPICE implementation, spiceypy by default
+
+    Returns
+    -------
+    lon, lat, lst : arrays of floats
+        The same values as the per-epoch subpnt('INTERCEPT/ELLIPSOID'),
+        recpgr and et2lst(..., 'PLANETOGRAPHIC') calls: planetographic
+        longitude (positive west, Saturn rotates prograde) and latitude in
+        radians, and local solar time in decimal hours. et2lst truncates to
+        whole seconds, this does not
+
+    """
+    saturn_flattening = (R_S_3[0] - R_S_3[2]) / R_S_3[0]
+
+    #   Spacecraft and Sun positions in the body-fixed frame, in bulk. The
+    #   Sun is corrected as in et2lst
+    pos, _ = backend.spkpos('CASSINI', ets, 'IAU_SATURN', 'None', target_id)
+    sun, _ = backend.spkpos('SUN', ets, 'IAU_SATURN', 'LT+S', target_id)
+    pos, sun = np.atleast_2d(pos), np.atleast_2d(sun)
+
+    #   The intercept sub-point is where the line from the spacecraft to the
+    #   centre crosses the ellipsoid
+    subpoint = pos / np.sqrt(np.sum((pos / R_S_3)**2, axis=1))[:, None]
+    x, y, z = subpoint.T
+
+    #   Planetographic coordinates, the latitude is that of the surface normal
+    lon = np.mod(-np.arctan2(y, x), 2*np.pi)
+    lat = np.arctan2(z, (1 - saturn_flattening)**2 * np.hypot(x, y))
+
+    #   Local solar time from the angle between the planetocentric (east)
+    #   longitudes of the sub-point and of the Sun, noon facing the Sun
+    angle = np.arctan2(y, x) - np.arctan2(sun[:, 1], sun[:, 0])
+    lst = np.mod(12 + angle * 12/np.pi, 24)
+
+    return lon, lat, lst
+
+def get_CassiniEphemeris_chunked(datetimes, checkpoint_fp=ephemeris_chunks_fp, chunk_size=100000, cpu_num=4,
+                                 metakernel=metakernel_fp, backend='spiceypy'):
+    """
+    Parameters
+    ----------
+    datetimes : list of datetimes
+        A list of python datetimes for which the ephemeris will be returned
+    checkpoint_fp : str, optional
+        Folder where every finished chunk is saved. Chunks already saved there
+        are not computed again, so an interrupted run resumes where it stopped.
+        Temporary files left there by an interrupted run are removed. Chunk
+        names include a hash of the backend and of the metakernel path and
+        content, so editing the metakernel starts new chunks
+    chunk_size : int, optional
+        Number of datetimes per chunk
+    cpu_num : int, optional
+        Number of worker processes, each loading its own SPICE kernel pool
+    metakernel : str, optional
+        Path of the SPICE metakernel to load
+    backend : str, optional
+        Name of the SPICE implementation module passed on to
+        get_CassiniEphemeris, spiceypy by default. Every worker imports it
+        by name, so it does not need to be picklable and works with both
+        multiprocess and multiprocessing pools
+
+    Returns
+    -------
+    df : pandas DataFrame
+        Same as get_CassiniEphemeris, for all the input datetimes in order
+    """
+    os.makedirs(checkpoint_fp, exist_ok=True)
+
+    #   Partial chunks of an interrupted run
+    for tmp_fp in glob.glob(checkpoint_fp + '/*.tmp'):
+        os.remove(tmp_fp)
+
+    #   Chunk files are named after the kernels, their first and last datetime and length
+    kernels = _kernel_hash(metakernel, backend)
+    chunks = [datetimes[i:i + chunk_size] for i in range(0, len(datetimes), chunk_size)]
+    chunk_fps = [checkpoint_fp + f"/ephemeris_{kernels}_{chunk[0]:%Y%m%d%H%M%S}_{chunk[-1]:%Y%m%d%H%M%S}_{len(chunk)}.pkl" for chunk in chunks]
+    missing = [(chunk, chunk_fp) for chunk, chunk_fp in zip(chunks, chunk_fps) if not os.path.exists(chunk_fp)]
+
+    if missing:
+        with Pool(cpu_num) as p, tqdm.tqdm(total=len(missing)) as pbar:
+            for _ in p.imap_unordered(partial(_save_ephemeris_chunk, metakernel=metakernel, backend=backend), missing):
+                pbar.update()
+
+    return pd.concat([pd.read_pickle(chunk_fp) for chunk_fp in chunk_fps], ignore_index=True)
+
+def _kernel_hash(metakernel, backend):
+    """Short hash of the backend name and of the metakernel path and content, naming the chunks computed with them."""
+    digest = hashlib.sha256(f'{backend}\0{os.path.abspath(metakernel)}\0'.encode())
+    if os.path.exists(metakernel):
+        with open(metakernel, 'rb') as f:
+            digest.update(f.read())
+
+    return digest.hexdigest()[:12]
+
+def _save_ephemeris_chunk(chunk, metakernel, backend):
+    """Compute the ephemeris of one chunk and save it, through a temporary file so partial chunks are never kept."""
+    datetimes, chunk_fp = chunk
+
+    df = get_CassiniEphemeris(datetimes, metakernel=metakernel, backend=importlib.import_module(backend), progress=False)
+
+    try:
+        df.to_pickle(chunk_fp + '.tmp')
+        os.replace(chunk_fp + '.tmp', chunk_fp)
+    finally:
+        if os.path.exists(chunk_fp + '.tmp'):
+            os.remove(chunk_fp + '.tmp')
+
+if __name__ == '__main__':
+    #   Chunks run in parallel and are checkpointed, **BE CAREFUL ABOUT CPU_NUM VARIABLE**
+    cpu_num = 4
+
+    #   Print this to a csv (this will be pretty hefty)
+    eph_df = get_CassiniEphemeris_chunked(minutely_datetimes, cpu_num=cpu_num)
+    eph_df.to_csv('data/calculated/20040101000000_20170915115700_ephemeris.csv')
+
+    #   Binary store with O(1) minute lookups, used below and by the notebooks
+    save_ephemeris_store(eph_df, ephemeris_store_fp)
+
+    lfe_unet = pd.read_csv(unet_catalogue_csv_fp)
+    startTimes = lfe_unet["start"]
+    endTimes = lfe_unet["end"]
+    labels = lfe_unet["label"]
+    probability = lfe_unet["probability"]
 
-lfe_unet = pd.read_csv(unet_catalogue_csv_fp)
-startTimes = lfe_unet["start"]
-endTimes = lfe_unet["end"]
-labels = lfe_unet["label"]
-probability = lfe_unet["probability"]
+    durations = []
+    for start, end in zip(startTimes, endTimes):
+        start = datetime.datetime.strptime(start, "%Y-%m-%d %H:%M:%S.%f")
+        end = datetime.datetime.strptime(end, "%Y-%m-%d %H:%M:%S.%f")
 
-durations = []
-for start, end in zip(startTimes, endTimes):
-    start = datetime.datetime.strptime(start, "%Y-%m-%d %H:%M:%S.%f")
-    end = datetime.datetime.strptime(end, "%Y-%m-%d %H:%M:%S.%f")
+        durations.append((end - start).total_seconds())
 
-    durations.append((end - start).total_seconds())
+    lfe_starts = [datetime.datetime.strptime(t, '%Y-%m-%d %H:%M:%S.%f') for t in startTimes]
+    lfe_stops = [datetime.datetime.strptime(t, '%Y-%m-%d %H:%M:%S.%f') for t in endTimes]
 
-lfe_starts = [datetime.datetime.strptime(t, '%Y-%m-%d %H:%M:%S.%f') for t in startTimes]
-lfe_stops = [datetime.datetime.strptime(t, '%Y-%m-%d %H:%M:%S.%f') for t in endTimes]
+    #   Interpolate the LFE start ephemeris from the minutely store, SPICE is
+    #   only needed for starts outside of it
+    lfe_eph_df = get_ephemeris(lfe_starts, interpolate=True, store_fp=ephemeris_store_fp)
+    lfe_eph_df.insert(0, 'start', lfe_starts)
 
-lfe_eph_df = get_CassiniEphemeris(lfe_starts)
+    outside = lfe_eph_df['x_ksm'].isna().to_numpy()
+    if outside.any():
+        lfe_eph_df.loc[outside] = get_CassiniEphemeris([lfe_starts[i] for i in np.flatnonzero(outside)]).set_index(lfe_eph_df.index[outside])[lfe_eph_df.columns]
 
-lfe_unet['start'] = lfe_starts
-lfe_unet['end'] = lfe_stops
-lfe_detections_unet = lfe_unet.merge(lfe_eph_df, left_on='start', right_on='start', how ='left')
+    lfe_unet['start'] = lfe_starts
+    lfe_unet['end'] = lfe_stops
+    lfe_detections_unet = lfe_unet.merge(lfe_eph_df, left_on='start', right_on='start', how ='left')
 
-lfe_detections_unet['duration'] = durations
+    lfe_detections_unet['duration'] = durations
 
-lfe_detections_unet.to_csv('data/calculated/lfe_detections_unet.csv')
\ No newline at end of file
+    lfe_detections_unet.to_csv('data/calculated/lfe_detections_unet.csv')
\ No newline at end of file
@@ -0,0 +1,162 @@
+import sys
+
+import numpy as np
+import pandas as pd
+
+import matplotlib.dates as mdates
+
+from tqdm import tqdm
+from multiprocess import Pool  # Change 'multiprocess' to 'multiprocessing' if given an error
+
+from lfe_func import get_sav_data, get_catalogue, get_catalogue_index, query_polygon_index, polygon_column_intervals
+
+sys.path.append('integration_not_sorted')
+from integration_tools import band_weights
+
+# Filepaths
+unet_catalogue_fp = 'data/calculated/2004001_2017258_joint_catalogue.json'
+lfe_joined_fp = 'data/calculated/LFEs_joined.csv'
+lfe_power_fp = 'data/calculated/LFEs_joined_power.csv'
+
+skr_column_s = 180  # Duration of an SKR time column in seconds
+distance = 1.496e11  # Flux is normalised to 1 AU, as in integration_tools.sum_ints
+
+# Flux of the year loaded by each worker, the cached SKR arrays are memory mapped so workers share the pages
+_year_data = {}
+
+def init_power_worker(year):
+    """Pool initializer loading the SKR data of a year in a worker.
+
+    Parameters
+    ----------
+    year: int
+        Year of the polygons given to the worker.
+    """
+    time, freq, flux = get_sav_data(year)
+    _year_data['time_num'] = mdates.date2num(time)
+    _year_data['freq'] = freq
+    _year_data['flux'] = flux
+
+def polygon_power(poly_coords):
+    """Integrate the flux inside a polygon in every time column it covers.
+
+    The frequency limits of each column are the intervals from polygon_column_intervals, and the flux is integrated
+    between them as integration_tools.integrate does with per-sweep limits: linear between channels, skipping
+    segments with a missing end.
+
+    Parameters
+    ----------
+    poly_coords: numpy.array
+        Polygon time-frequency coordinates, time in matplotlib date units. Only the columns of the year loaded by the
+        worker are integrated, so a polygon crossing the new year is given whole to the workers of both years.
+
+    Returns
+    -------
+    energy: float
+        Power summed over the columns, times the column duration, in J/sr.
+
+    peak_power: float
+        Largest column power in W/sr, NaN if the polygon covers no column.
+
+    peak_index: int
+        Time index of the column with the peak power, -1 if the polygon covers no column.
+    """
+    time_index, freq_min, freq_max = polygon_column_intervals(poly_coords, _year_data['time_num'])
+    if not len(time_index):
+        return 0., np.nan, -1
+
+    column_index, columns = np.unique(time_index, return_inverse=True)
+    freq, flux = _year_data['freq'], _year_data['flux'][:, column_index]
+
+    valid = np.isfinite(flux[:-1]) & np.isfinite(flux[1:])
+    flux_left, flux_right = np.where(valid, flux[:-1], 0), np.where(valid, flux[1:], 0)
+
+    weight_left, weight_right = band_weights(freq, np.column_stack((freq_min, freq_max)))
+    interval_power = np.sum(weight_left * flux_left[:, columns].T + weight_right * flux_right[:, columns].T, axis=1)
+
+    column_power = np.bincount(columns, weights=interval_power) * (distance**2) * 1e3
+    peak = np.argmax(column_power)
+
+    return np.sum(column_power) * skr_column_s, column_power[peak], column_index[peak]
+
+def match_lfe_starts(lfe_starts, catalogue_starts, tolerance=np.timedelta64(skr_column_s, 's')):
+    """Find the LFE of every catalogue polygon from their start times.
+
+    Parameters
+    ----------
+    lfe_starts: numpy.array
+        Start times of the LFEs, datetime64.
+
+    catalogue_starts: numpy.array
+        Start times of the catalogue polygons, datetime64.
+
+    tolerance: numpy.timedelta64, optional
+        Largest difference between matched start times. Default is one SKR time column.
+
+    Returns
+    -------
+    lfe_index: numpy.array
+        Index in lfe_starts of the LFE starting closest to each polygon, -1 if none starts within tolerance.
+    """
+    lfe_starts, catalogue_starts = np.asarray(lfe_starts, dtype='datetime64[ns]'), np.asarray(catalogue_starts, dtype='datetime64[ns]')
+    if not len(lfe_starts):
+        return np.full(len(catalogue_starts), -1)
+
+    order = np.argsort(lfe_starts, kind='stable')
+    sorted_starts = lfe_starts[order]
+
+    position = np.searchsorted(sorted_starts, catalogue_starts)
+    left, right = np.clip(position - 1, 0, len(sorted_starts) - 1), np.clip(position, 0, len(sorted_starts) - 1)
+    nearest = np.where(np.abs(catalogue_starts - sorted_starts[left]) <= np.abs(sorted_starts[right] - catalogue_starts), left, right)
+
+    return np.where(np.abs(sorted_starts[nearest] - catalogue_starts) <= tolerance, order[nearest], -1)
+
+if __name__ == '__main__':
+    lfe_joined = pd.read_csv(lfe_joined_fp, index_col=0, parse_dates=['start', 'end'])
+
+    poly_index = get_catalogue_index(unet_catalogue_fp, time='num')
+    poly_tf_list = poly_index['polygons']
+
+    # Polygons are matched to the joined LFEs by start time: the LFE times saved by join_json.py in the feature
+    # properties, or the start of the polygon for catalogues without them
+    catalogue, catalogue_meta = get_catalogue(unet_catalogue_fp)
+    properties = [feature.get('properties') or {} for feature in catalogue_meta['features']]
+    if all('start' in feature for feature in properties):
+        catalogue_starts = pd.to_datetime([feature['start'] for feature in properties], format='ISO8601').to_numpy()
+    else:
+        catalogue_starts = pd.to_datetime(np.asarray(catalogue['time_min']), unit='s').to_numpy()
+
+    lfe_index = match_lfe_starts(lfe_joined['start'].to_numpy(), catalogue_starts)
+    if np.any(lfe_index < 0):
+        print(f'{np.sum(lfe_index < 0)} polygons of {unet_catalogue_fp} match no LFE of {lfe_joined_fp}, they are left out')
+
+    # LFEs without a polygon keep NaN values
+    energy = np.where(np.isin(np.arange(len(lfe_joined)), lfe_index), 0., np.nan)
+    peak_power = np.full(len(lfe_joined), np.nan)
+    peak_time = np.full(len(lfe_joined), np.datetime64('NaT'), dtype='datetime64[ns]')
+
+    cpu_num = 4
+
+    # Polygons crossing the new year are given whole to both years, each year integrates its own columns and the
+    # parts are combined here
+    for year in range(2004, 2018):
+        print(year)
+
+        year_low, year_high = mdates.date2num(np.datetime64(f'{year}')), mdates.date2num(np.datetime64(f'{year + 1}'))
+        poly_ids = [i for i in query_polygon_index(poly_index, year_low, year_high) if lfe_index[i] >= 0]
+        time = get_sav_data(year)[0]
+
+        with Pool(cpu_num, initializer=init_power_worker, initargs=(year,)) as p:
+            results = p.imap(polygon_power, [poly_tf_list[i] for i in poly_ids], chunksize=16)
+            for lfe_id, (poly_energy, poly_peak, peak_index) in tqdm(zip(lfe_index[poly_ids], results), total=len(poly_ids)):
+                energy[lfe_id] += poly_energy
+                if poly_peak > np.nan_to_num(peak_power[lfe_id], nan=-np.inf):
+                    peak_power[lfe_id] = poly_peak
+                    peak_time[lfe_id] = time[peak_index]
+
+    lfe_power = lfe_joined[['start', 'end']].copy()
+    lfe_power['energy'] = energy
+    lfe_power['peak_power'] = peak_power
+    lfe_power['peak_time'] = peak_time
+
+    lfe_power.to_csv(lfe_power_fp)
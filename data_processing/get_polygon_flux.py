@@ -1,57 +1,28 @@
 import shutil
+from functools import partial
 from pathlib import Path
 
 import numpy as np
 import xarray as xr
 
 import matplotlib.dates as mdates
-from matplotlib.path import Path
-
-from tfcat import TFCat
 
 from tqdm import tqdm
 from multiprocess import Pool  # Change 'multiprocess' to 'multiprocessing' if given an error
 
-from lfe_func import get_sav_data, get_poly_coords
+from lfe_func import get_sav_data, get_poly_coords, create_mask, init_mask_worker, to_shared_memory, add_to_labels, get_catalogue_index
 
 # Filepaths
 unet_catalogue_fp = 'data/calculated/2004001_2017258_joint_catalogue.json'
 skr_poly_flux_fp = 'data/calculated/skr_poly_flux'
+skr_lfe_labels_fp = 'data/calculated/skr_lfe_labels'
+poly_flux_store_fp = 'data/calculated/poly_flux_combined.zarr'
 
-# Import all Polygon Time Frequency Coordinates and put them in a list
-catalogue = TFCat.from_file(unet_catalogue_fp)
-
-poly_tf_list = []
-for i in range(len(catalogue._data['features'])):
-    poly_time, poly_freq = np.array(catalogue._data['features'][i]['geometry']['coordinates'][0]).T
-
-    poly_time = poly_time.astype('datetime64[s]')
-
-    poly_tf = np.array([mdates.date2num(poly_time), poly_freq]).T
-
-    poly_tf_list.append(poly_tf)
-
-def create_mask(poly_coords):
-    """Create a flux mask given polygon coordinates.
-
-    Parameters
-    ----------
-    poly_coords: list
-        List of polygon time-frequency coordinates.
-    
-    Returns
-    -------
-    mask: numpy.array
-        Boolean mask of dimension flux where True values represent polygon coordinates in the flux.
-    """
-    freq_grid, time_grid = np.meshgrid(freq, mdates.date2num(time), indexing='ij')
-    points = np.vstack((time_grid.flatten(), freq_grid.flatten())).T
-
-    path = Path(poly_coords)
-    mask_flat = path.contains_points(points)
-    mask = mask_flat.reshape(flux.shape)
+poly_flux_chunk_size = 4800  # Time steps per store chunk, 10 days of 3 minute steps
 
-    return mask
+# Import all Polygon Time Frequency Coordinates (time in matplotlib date units), read from the packed catalogue
+poly_index = get_catalogue_index(unet_catalogue_fp, time='num')
+poly_tf_list = poly_index['polygons']
 
 # Loop over every mission year to get yearly files of masked flux w.r.t polygon coordinates, time and frequency. The dimensions of these arrays are similar to sav data files.
 
@@ -61,19 +32,34 @@ for year in range(2004, 2018):
     print(year)
     
     time, freq, flux = get_sav_data(year)
-    poly_coordinates = get_poly_coords(year, poly_tf_list)
+    time_num = mdates.date2num(time)
+    poly_coordinates, poly_ids = get_poly_coords(year, poly_tf_list, return_index=True, poly_index=poly_index)
 
     cpu_num = 9
-    mask_list = []
 
-    max_ = len(poly_coordinates)
-    with Pool(cpu_num) as p, tqdm(total=max_) as pbar:
-        for result in p.imap(create_mask, poly_coordinates):
-            pbar.update()
-            pbar.refresh()
-            mask_list.append(result)
+    # Workers attach to a single shared copy of the grid, and only send back the small bounding box masks which
+    # are OR-ed into the combined mask as they arrive. Memory does not grow with the number of polygons.
+    time_shm, time_spec = to_shared_memory(time_num)
+    freq_shm, freq_spec = to_shared_memory(freq)
+    combined_mask = np.zeros(flux.shape, dtype=bool)
 
-    combined_mask = np.sum(mask_list, axis=0).astype(bool)
+    # Catalogue index of the polygon covering each pixel, further polygons on the same pixel go to the overflow table
+    labels = np.full(flux.shape, -1, dtype=np.int32)
+    overflow = []
+
+    max_ = len(poly_coordinates)
+    try:
+        with Pool(cpu_num, initializer=init_mask_worker, initargs=(time_spec, freq_spec)) as p, tqdm(total=max_) as pbar:
+            results = p.imap(partial(create_mask, compact=True), poly_coordinates, chunksize=16)
+            for poly_id, (freq_slice, time_slice, sub_mask) in zip(poly_ids, results):
+                pbar.update()
+                pbar.refresh()
+                combined_mask[freq_slice, time_slice] |= sub_mask
+                add_to_labels(labels, overflow, poly_id, freq_slice, time_slice, sub_mask)
+    finally:
+        for shm in (time_shm, freq_shm):
+            shm.close()
+            shm.unlink()
 
     masked_flux = flux.copy()
     masked_flux[~combined_mask] = np.nan
@@ -82,22 +68,24 @@ for year in range(2004, 2018):
 
     da.to_netcdf(skr_poly_flux_fp + f'/poly_flux_{year}.ncdf')
 
-# Combine files
-times = []
-fluxes = []
-for year in range(2004, 2018):
-    ds = xr.open_dataset(skr_poly_flux_fp + f'/poly_flux_{year}.ncdf', engine='netcdf4') 
-    time, flux = ds['time'].to_numpy(), ds['flux'].to_numpy()
-    times.append(time)
-    fluxes.append(flux)
+    # Append the year to the time-chunked mission store, which is created by the first year
+    if year == 2004:
+        da.to_dataset().to_zarr(poly_flux_store_fp, mode='w', encoding={'flux': {'chunks': (len(freq), poly_flux_chunk_size)}})
+    else:
+        da.to_dataset().to_zarr(poly_flux_store_fp, append_dim='time')
+
+    overflow_freq, overflow_time, overflow_id = (np.concatenate(col) for col in zip(*overflow)) if overflow else (np.array([], dtype=np.int32),) * 3
 
-times = np.hstack(times)
-fluxes = np.hstack(fluxes)
-freqs = ds['frequency'].to_numpy()
+    ds = xr.Dataset({'label': (['frequency', 'time'], labels),
+                     'overflow_frequency_index': (['overflow'], overflow_freq.astype(np.int32)),
+                     'overflow_time_index': (['overflow'], overflow_time.astype(np.int32)),
+                     'overflow_feature_id': (['overflow'], overflow_id.astype(np.int32))},
+                    coords={'frequency': (['frequency'], freq), 'time': (['time'], time)})
 
-da = xr.DataArray(fluxes, dims=['frequency', 'time'], coords= {'frequency': (['frequency'], freqs), 'time':(['time'], times)}, name='flux')
+    ds.to_netcdf(skr_lfe_labels_fp + f'/lfe_labels_{year}.ncdf', encoding={'label': {'zlib': True}})
 
-da.to_netcdf('data/calculated/poly_flux_combined.ncdf')
+# Combined file for the notebooks, streamed chunk by chunk from the mission store
+xr.open_zarr(poly_flux_store_fp)['flux'].to_netcdf('data/calculated/poly_flux_combined.ncdf')
 
 # Delete intermediate files
 #if Path(skr_poly_flux_fp).is_dir():
@@ -1,10 +1,13 @@
-import json
 import time as t
 from datetime import datetime, timedelta
+from functools import partial, reduce
 
 import numpy as np
 import pandas as pd
-from tfcat import TFCat
+
+from multiprocess import Pool  # Change 'multiprocess' to 'multiprocessing' if given an error
+
+from lfe_func import get_catalogue_index, query_polygon_index, pack_polygons, save_catalogue_json
 
 #dates you would like to plot visualisations for year-month-day
 data_str_start = '2004-01-01'
@@ -24,190 +27,165 @@ def get_polygons(polygon_fp, start, end):
         unix_start=t.mktime(start.utctimetuple())
         unix_end=t.mktime(end.utctimetuple())
         #array of polygons found within time interval specified.
-        polygon_array=[]
-        catalogue = TFCat.from_file(polygon_fp)
+        catalogue_index = get_catalogue_index(polygon_fp)
         print(" a catalogue exists ")
-        for i in range(len(catalogue._data["features"])):
-            time_points=np.array(catalogue._data["features"][i]['geometry']['coordinates'][0])[:,0]
-            if any(time_points <= unix_end) and any(time_points >= unix_start):
-                polygon_array.append(np.array(catalogue._data["features"][i]['geometry']['coordinates'][0]))
+        polygon_array = [catalogue_index['polygons'][i] for i in query_polygon_index(catalogue_index, unix_start, unix_end)]
         return polygon_array
     
-    # Comparison func - total lfes match joint?
-def comparison(date_start, date_end):
-    # define number of polygons in time range
-    data_start = pd.Timestamp(date_start)
-    data_end = pd.Timestamp(date_end)
-    
-    # Define Number of NOT JOINED LFEs - AKA TOTAL number of defined polygons in initial .json file
-    full_df = pd.read_csv(LFE_calculated_path + "lfe_detections_unet.csv")
-    full_df = full_df.loc[(full_df['start'] >= date_start) & (full_df['start'] <= date_end)]
+def match_joined_lfes(joined_df, detections_df):
+    """Find the detections making up each joined LFE with a sorted merge on start times.
+
+    Both tables are sorted by start time (stable) before the merge, the groups are returned in the order of joined_df
+    and give positions in the original order of detections_df.
+
+    Parameters
+    ----------
+    joined_df: pandas.DataFrame
+        Joined LFEs from join_lfes.py.
+
+    detections_df: pandas.DataFrame
+        LFE detections the joined LFEs were made from.
+
+    Returns
+    -------
+    groups: list
+        Positions in detections_df of the detections of each joined LFE, by start time: those starting between the
+        start and the end of the joined LFE, and before the next joined LFE.
+    """
+    detection_order = np.argsort(detections_df['start'].to_numpy(), kind='stable')
+    joined_order = np.argsort(joined_df['start'].to_numpy(), kind='stable')
+
+    starts = detections_df['start'].to_numpy()[detection_order]
+    joined_starts, joined_ends = joined_df['start'].to_numpy()[joined_order], joined_df['end'].to_numpy()[joined_order]
+
+    first = np.searchsorted(starts, joined_starts, side='left')
+    last = np.minimum(np.searchsorted(starts, joined_ends, side='right'), np.append(first[1:], len(starts)))
+
+    unmatched = (first >= len(starts)) | (starts[np.minimum(first, len(starts) - 1)] != joined_starts)
+    if np.any(unmatched):
+        raise ValueError(f'{np.sum(unmatched)} joined LFEs do not start with a detection, first at {joined_starts[unmatched][0]}')
+
+    groups = [None] * len(joined_order)
+    for position, i, j in zip(joined_order, first, last):
+        groups[position] = detection_order[i:j]
+
+    return groups
+
+def stitch_polygons(polygon_0, polygon_1, quantile=0.95):
+    """Join two consecutive polygons into one.
+
+    The vertices of polygon_0 after its time quantile and of polygon_1 before its 1 - quantile time quantile are cut
+    between their highest and lowest frequency vertices, and the two outlines are connected between those vertices.
+
+    Parameters
+    ----------
+    polygon_0, polygon_1: numpy.array
+        Time-frequency vertices of the earlier and the later polygon.
+
+    quantile: float, optional
+        Time quantile of polygon_0 after which vertices are cut. Default is 0.95.
+
+    Returns
+    -------
+    polygon: numpy.array
+        Time-frequency vertices of the joined polygon.
+    """
+    # Polygon 0 - fmax, fmin, tmax
+    cond = np.quantile(polygon_0[:, 0], quantile)
+
+    # Find frequencies that pass threshold condition on POLYGON 0
+    new_polys = polygon_0[np.where(polygon_0[:, 0] >= cond)] # BAD POINTS
+    max_f0 = np.max(new_polys[:, 1]) # Frequency MAX
+    max_t0_u = new_polys[np.where(new_polys[:, 1] == max_f0)[0][0], 0] # Actual T MAX Upper VALUE
+    min_f0 = np.min(new_polys[:, 1]) # Frequency min
+    max_t0_l = new_polys[np.where(new_polys[:, 1] == min_f0)[0][0], 0] # Actual T MAX Lower VALUE
+
+    # Polygon 1 - fmax, fmin, tmin
+    cond1 = np.quantile(polygon_1[:, 0], 1 - quantile)
+
+    # Find frequencies that pass threshold condition on POLYGON 1
+    new_polys_1 = polygon_1[np.where(polygon_1[:, 0] <= cond1)] # BAD POINTS
+    max_f1 = np.max(new_polys_1[:, 1]) # Frequency MAX
+    min_t1_u = new_polys_1[np.where(new_polys_1[:, 1] == max_f1)[0][0], 0] # Actual T MIN upper VALUE
+    min_f1 = np.min(new_polys_1[:, 1]) # Frequency min
+    min_t1_l = new_polys_1[np.where(new_polys_1[:, 1] == min_f1)[0][0], 0] # Actual T MIN Lower VALUE
+
+    # Mask values b/w quantile initialization points
+    poly0_low_bound = np.where((polygon_0[:, 0] == max_t0_l) & (polygon_0[:, 1] == min_f0))[0][0]
+    poly0_up_bound = np.where((polygon_0[:, 0] == max_t0_u) & (polygon_0[:, 1] == max_f0))[0][0]
+    mask0 = np.zeros(np.shape(polygon_0)[0], dtype = bool)
+    mask0[np.arange(poly0_low_bound+1, poly0_up_bound, 1)] = True
+    masked_polys0 = polygon_0[~mask0]
+
+    poly1_low_bound = np.where((polygon_1[:, 0] == min_t1_l) & (polygon_1[:, 1] == min_f1))[0][0]
+    poly1_up_bound = np.where((polygon_1[:, 0] == min_t1_u) & (polygon_1[:, 1] == max_f1))[0][0]
+    mask1 = np.zeros(np.shape(polygon_1)[0], dtype = bool)
+    mask1[np.arange(poly1_up_bound+1, poly1_low_bound, 1)] = True
+    masked_polys1 = polygon_1[~mask1]
+
+    # Attach poly1_low to poly0_low
+    ind_poly0_low = np.where((masked_polys0[:, 0] == max_t0_l) & (masked_polys0[:, 1] == min_f0))[0][0]
+    ind_poly1_low = np.where((masked_polys1[:, 0] == min_t1_l) & (masked_polys1[:, 1] == min_f1))[0][0]
+
+    # Reorder poly1 so that index 1 is at lowest bound
+    masked_polys1 = np.concatenate([masked_polys1[ind_poly1_low:], masked_polys1[:ind_poly1_low]])
+
+    return np.insert(masked_polys0, ind_poly0_low+1, masked_polys1, axis = 0)
+
+def join_polygons(polygons, quantile=0.95):
+    """Join any number of consecutive polygons, stitching each one to the polygon joined so far.
+
+    Parameters
+    ----------
+    polygons: list
+        Time-frequency vertices of the polygons, in time order.
+
+    quantile: float, optional
+        See stitch_polygons.
+
+    Returns
+    -------
+    polygon: numpy.array
+        Time-frequency vertices of the joined polygon.
+    """
+    return reduce(partial(stitch_polygons, quantile=quantile), polygons)
+
+if __name__ == '__main__':
+    total_df = pd.read_csv(LFE_calculated_path + "lfe_detections_unet.csv", parse_dates=['start', 'end'])
+    joint_df = pd.read_csv(LFE_calculated_path + "LFEs_joined.csv", parse_dates=['start', 'end'])
+
+    total_df = total_df.loc[(total_df['start'] >= data_start) & (total_df['start'] <= data_end)]
+    joint_df = joint_df.loc[(joint_df['start'] >= data_start) & (joint_df['start'] <= data_end)]
+
+    # The catalogue has one polygon per detection, in the same order
     saved_polys = get_polygons(polygon_fp, data_start, data_end)
-    poly_num = len(saved_polys)
-    print('Uncalibrated, total polygons:', poly_num)
-
-    # define number of JOINED LFEs given in 'joined....csv' file 
-    joint = pd.read_csv(LFE_calculated_path + "LFEs_joined.csv")
-    joint_min = joint.loc[(joint['start'] >= date_start) & (joint['start'] <= date_end)]
-    joint_num = np.shape(joint_min)[0]
-    print('Joined Polygons:', joint_num)
-    return full_df, saved_polys, joint_min, poly_num, joint_num
-
-# Do we even need to join? 
-total_df, saved_polys, joint_polys, poly_num, joint_num = comparison(data_str_start, data_str_end)
-
-##########################################################################################################
-# NEW POLYGON ARRAY
-polygon_array = []
-
-if poly_num == joint_num: # This means that no polygons need joining 
-    final_vertices = saved_polys
-    print("we don't need to join any polygons!")
-else: # We need to create new array with collection of JOINT vertices
-    print('we have to join some polygons!')
-    i = 0
-    while i < np.shape(joint_polys)[0]: # Length of new saved_polys array
-        print(i) # out of 4553
-        start_joint = joint_polys['start'][i]
-        end_joint = joint_polys['end'][i]
-        print(start_joint, end_joint)
-
-        total_ind = np.where((total_df['start'] == start_joint) & (total_df['end'] == end_joint))
-        num_spots = len(total_ind[0])
-
-        if num_spots == 1: # No need to JOIN polygons - exist in original .json file
-            polygon_vertices = saved_polys[total_ind[0][0]]
-            polygon_array.append(polygon_vertices)
-        else:
-            print('we need to add polygon w/ dates: ', start_joint, 'to ', end_joint)
-            quantiles0 = [0.95]
-            quantiles1 = [0.05]
-
-            # initial new start & end times of joining
-            data_start=pd.Timestamp(f'{start_joint}') 
-            data_end=pd.Timestamp(f'{end_joint}')
-            ind_polys = get_polygons(polygon_fp, data_start, data_end)
-
-            tup = []
-            tlow = []
-            fup = []
-            flow = []
-            conditions = []
-
-            for quant0, quant1 in zip(quantiles0, quantiles1):
-                #print('Quantiles:', quant0, quant1)
-                # Polygon 0 - fmax, fmin, tmax
-                cond = np.quantile(ind_polys[0][:, 0], quant0)
-
-                # Find frequencies that pass threshold condition on POLYGON 0
-                max_f0 = np.max(ind_polys[0][np.where(ind_polys[0][:, 0] >= cond), 1][0]) # Frequency MAX
-                new_polys = ind_polys[0][np.where(ind_polys[0][:, 0] >= cond)] # BAD POINTS
-                old_polys = ind_polys[0][np.where(ind_polys[0][:, 0] < cond)] # GOOD POINTS
-                delete_polys_len0 = len(new_polys)
-                ind_max_t = np.where(max_f0 == ind_polys[0][np.where(ind_polys[0][:, 0] >= cond),1])[1][0] # Index of time MAXIMUM from where to draw initial line
-                max_t0_u = new_polys[ind_max_t, 0] # Actual T MAX Upper VALUE
-                #print('Maximum t & Maximum freq for LEFT POLY:', max_t0_u, max_f0)
-
-                min_f0 = np.min(ind_polys[0][np.where(ind_polys[0][:, 0] >= cond), 1][0]) # Frequency min
-                ind_min_t = np.where(min_f0 == ind_polys[0][np.where(ind_polys[0][:, 0] >= cond),1])[1][0] # Index of time MINIMUM from where to draw initial line
-                max_t0_l = new_polys[ind_min_t, 0] # Actual T MAX Lower VALUE
-                #print('Maximum t & Minimum freq for LEFT POLY:', max_t0_l, min_f0)
-
-
-                # Polygon 1 - fmax, fmin, tmin
-                cond1 = np.quantile(ind_polys[1][:, 0], quant1)
-
-                # Find frequencies that pass threshold condition on POLYGON 1
-                max_f1 = np.max(ind_polys[1][np.where(ind_polys[1][:, 0] <= cond1), 1][0]) # Frequency MAX
-                new_polys_1 = ind_polys[1][np.where(ind_polys[1][:, 0] <= cond1)] # BAD POINTS
-                old_polys_1 = ind_polys[1][np.where(ind_polys[1][:, 0] > cond1)] # GOOD POINTS
-                delete_polys_len1 = len(new_polys_1)
-                ind_max_t1 = np.where(max_f1 == ind_polys[1][np.where(ind_polys[1][:, 0] <= cond1),1])[1][0]  # Index of time MAXIMUM from where to draw initial line
-                min_t1_u = new_polys_1[ind_max_t1, 0]  # Actual T MIN upper VALUE
-                #print('Minimum t & Maximum freq for RIGHT POLY:', min_t1_u, max_f1)
-
-                min_f1 = np.min(ind_polys[1][np.where(ind_polys[1][:, 0] <= cond1), 1][0]) # Frequency min
-                ind_min_t1 = np.where(min_f1 == ind_polys[1][np.where(ind_polys[1][:, 0] <= cond1),1])[1][0] # Index of time MINIMUM from where to draw initial line
-                min_t1_l = new_polys_1[ind_min_t1, 0]  # Actual T MIN Lower VALUE
-                #print('Minimum t & Minimum freq for RIGHT POLY:', min_t1_l, min_f1)
-
-                # Apped to appropriate list
-                tup.append([max_t0_u, min_t1_u])
-                tlow.append([max_t0_l, min_t1_l])
-                fup.append([max_f0, max_f1])
-                flow.append([min_f0, min_f1])
-                conditions.append([cond, cond1])
-
-            # REDefine quantiles / paths PER FIGURE
-            quantiles00 = np.array([0.95])
-
-            ## AXIS 1 - JOINT POLYGONS
-            # TIME BOUNDS
-            # Pick b/w dif quantile
-            q = np.where(quantiles00 == 0.95)[0][0]
-
-            # Mask values b/w 95% initialization points 
-            poly0_low_bound = np.where((ind_polys[0][:, 0] == tlow[q][0]) & (ind_polys[0][:, 1] == flow[q][0]))[0][0]
-            poly0_up_bound = np.where((ind_polys[0][:, 0] == tup[q][0]) & (ind_polys[0][:, 1] == fup[q][0]))[0][0]
-            mask0_ind = np.arange(poly0_low_bound+1, poly0_up_bound, 1)
-
-            # Create a mask for certain points
-            mask0 = np.zeros(np.shape(ind_polys[0])[0], dtype = bool)
-            mask0[mask0_ind] = True
-            masked_polys0 = ind_polys[0][~mask0]
-
-            # Mask values b/w 5% initialization points 
-            poly1_low_bound = np.where((ind_polys[1][:, 0] == tlow[q][1]) & (ind_polys[1][:, 1] == flow[q][1]))[0][0]
-            poly1_up_bound = np.where((ind_polys[1][:, 0] == tup[q][1]) & (ind_polys[1][:, 1] == fup[q][1]))[0][0]
-            mask1_ind = np.arange(poly1_up_bound+1, poly1_low_bound, 1)
-
-            # Create a mask for certain points
-            mask1 = np.zeros(np.shape(ind_polys[1])[0], dtype = bool)
-            mask1[mask1_ind] = True
-            masked_polys1 = ind_polys[1][~mask1]
-
-            # Attach poly1_low to poly0_low
-            ind_poly0_low = np.where((masked_polys0[:, 0] == tlow[q][0]) & (masked_polys0[:, 1] == flow[q][0]))[0][0]
-            ind_poly0_up = np.where((masked_polys0[:, 0] == tup[q][0]) & (masked_polys0[:, 1] == fup[q][0]))[0][0]
-
-            ind_poly1_low = np.where((masked_polys1[:, 0] == tlow[q][1]) & (masked_polys1[:, 1] == flow[q][1]))[0][0]
-            ind_poly1_up = np.where((masked_polys1[:, 0] == tup[q][1]) & (masked_polys1[:, 1] == fup[q][1]))[0][0]
-
-            # Reorder poly1 so that index 1 is at lowest bound
-            masked_polys1 = np.concatenate([masked_polys1[ind_poly1_low:], masked_polys1[:ind_poly1_low]])
-            test = np.insert(masked_polys0, ind_poly0_low+1, masked_polys1, axis = 0)
-            #test = [test]
-
-            # Append to polygon array
-            polygon_array.append(test)
-        
-        i += 1
-
-# DST corrections to joined polygons
-#for polygon in range(len(polygon_array)):
-#    data_start = np.min([datetime.fromtimestamp(polygon_array[polygon][:, 0][i]) for i in range(len(polygon_array[polygon][:, 0]))])
-#   data_end = np.max([datetime.fromtimestamp(polygon_array[polygon][:, 0][i]) for i in range(len(polygon_array[polygon][:, 0]))])
-#
-#    # This would allow for polygons across two years - December DEF not impacted by DST
-#    if data_start >= europe_dst_range(data_start.year)[0] and data_end <= europe_dst_range(data_end.year)[1]:
-#        for vertex in range(len(polygon_array[polygon])):
-#            polygon_array[polygon][vertex, 0] = (datetime.fromtimestamp(polygon_array[polygon][vertex, 0]) - pd.Timedelta(1, 'hour')).timestamp()
-#    else:
-#        pass
-
-# Create a new .json file with JOINED & DST-corrected Polygon Vertices
-# Joint polygons to dictionary
-new_dic = {}
-new_dic['features'] = []
-
-for shape in range(len(polygon_array)):
-    if len(polygon_array[shape]) == 1:
-        coords = [tuple(polygon_array[shape][0][j]) for j in range(len(polygon_array[shape][0]))]
-        new_dic['features'].append({"geometry" : {"coordinates": [coords]}})
-    else:
-        coords = [tuple(list(polygon_array[shape][j])) for j in range(len(polygon_array[shape]))]
-        new_dic['features'].append({"geometry" : {"coordinates": [coords]}})
-
-# Save .json file
-with open('data/calculated/2004001_2017258_joint_catalogue.json', 'w') as outfile:
-    json.dump(new_dic, outfile)
\ No newline at end of file
+    print('Uncalibrated, total polygons:', len(saved_polys))
+    print('Joined Polygons:', len(joint_df))
+    if len(saved_polys) != len(total_df):
+        raise ValueError(f'{polygon_fp} has {len(saved_polys)} polygons but there are {len(total_df)} detections')
+
+    # Polygons of each joined LFE in detection order, a single polygon is kept as it is
+    groups = match_joined_lfes(joint_df, total_df)
+    group_polys = [[saved_polys[i] for i in group] for group in groups]
+
+    cpu_num = 4
+
+    with Pool(cpu_num) as p:
+        polygon_array = p.map(join_polygons, group_polys, chunksize=64)
+
+    # DST corrections to joined polygons
+    #for polygon in range(len(polygon_array)):
+    #    data_start = np.min([datetime.fromtimestamp(polygon_array[polygon][:, 0][i]) for i in range(len(polygon_array[polygon][:, 0]))])
+    #   data_end = np.max([datetime.fromtimestamp(polygon_array[polygon][:, 0][i]) for i in range(len(polygon_array[polygon][:, 0]))])
+    #
+    #    # This would allow for polygons across two years - December DEF not impacted by DST
+    #    if data_start >= europe_dst_range(data_start.year)[0] and data_end <= europe_dst_range(data_end.year)[1]:
+    #        for vertex in range(len(polygon_array[polygon])):
+    #            polygon_array[polygon][vertex, 0] = (datetime.fromtimestamp(polygon_array[polygon][vertex, 0]) - pd.Timedelta(1, 'hour')).timestamp()
+    #    else:
+    #        pass
+
+    # Save the JOINED & DST-corrected Polygon Vertices as a new TFCat .json file, with the times of each joined LFE
+    features = [{'id': i, 'properties': {'start': start.isoformat(), 'end': end.isoformat()}}
+                for i, (start, end) in enumerate(zip(joint_df['start'], joint_df['end']))]
+    save_catalogue_json('data/calculated/2004001_2017258_joint_catalogue.json', pack_polygons(polygon_array), meta={'features': features})
@@ -4,110 +4,57 @@ import pandas as pd
 data_directory = 'data/calculated/'
 lfe_detections_fp = 'lfe_detections_unet.csv'
 
-LFE_df = pd.read_csv(data_directory + lfe_detections_fp, parse_dates=['start','end'])
-
-def LFE_joiner(data_directory, LFE_df, LFE_secs):
-    #print("want to examine dt between successive LFEs and join those which are short")
-    time_diff_df = pd.DataFrame({'st':LFE_df['start'][1:].values, 'en':LFE_df['end'][:-1].values})
-    time_diff_minutes = time_diff_df.st-time_diff_df.en
-    time_diff_minutes = [time_diff_minute.total_seconds()/60. for time_diff_minute in time_diff_minutes]
-    #print("checking time difference")
-    
-    starts_joined = []
-    ends_joined = []
-    x_ksm_joined = []
-    y_ksm_joined = []
-    z_ksm_joined = []
-    label_joined = []
-    R_ksm_joined = []
-    subLST_joined = []
-    subLat_joined = []
-    subLon_joined = []
-
-
-    tdm = np.array(time_diff_minutes)
-    starts_joined.append(LFE_df['start'][0]) #manually fill the first LFE (short gap after)
-    ends_joined.append(LFE_df['end'][0])    #manually fill the first LFE (short gap after)
-    x_ksm_joined.append(LFE_df['x_ksm'][0]) #manually fill the first LFE (short gap after)
-    y_ksm_joined.append(LFE_df['y_ksm'][0]) #manually fill the first LFE (short gap after)
-    z_ksm_joined.append(LFE_df['z_ksm'][0]) #manually fill the first LFE (short gap after)
-    label_joined.append(LFE_df['label'][0]) #manually fill the first LFE (short gap after)
-    R_ksm_joined.append(LFE_df['R_ksm'][0]) #manually fill the first LFE (short gap after)
-    subLST_joined.append(LFE_df['subLST'][0]) #manually fill the first LFE (short gap after)
-    subLat_joined.append(LFE_df['subLat'][0]) #manually fill the first LFE (short gap after)
-    subLon_joined.append(LFE_df['subLon'][0]) #manually fill the first LFE (short gap after)
-    
-    iter_skip=True
-    for i in range(tdm.size):
-        if iter_skip:
-            #print("iteration skipped")
-            iter_skip=False
-            continue
-        #print("iteration number:")
-        #print(i)
-        if tdm[i] > 10:  #10 minute cutoff for between events  
-            #just keep starts and end as in original list
-            starts_joined.append(LFE_df['start'][i])
-            ends_joined.append(LFE_df['end'][i])#
-            x_ksm_joined.append(LFE_df['x_ksm'][i])
-            y_ksm_joined.append(LFE_df['y_ksm'][i])
-            z_ksm_joined.append(LFE_df['z_ksm'][i])
-            label_joined.append(LFE_df['label'][i])
-            R_ksm_joined.append(LFE_df['R_ksm'][i])
-            subLST_joined.append(LFE_df['subLST'][i])
-            subLat_joined.append(LFE_df['subLat'][i])
-            subLon_joined.append(LFE_df['subLon'][i])
-            #print("long gap and no joining")    
-            #print(i)
-        else:
-            #keep start as original list and revised end as next entry
-            #print("short gap and joining")
-            #print(LFE_df['start'][i])
-            starts_joined.append(LFE_df['start'][i])    
-            ends_joined.append(LFE_df['end'][i+1])
-            x_ksm_joined.append(LFE_df['x_ksm'][i])
-            y_ksm_joined.append(LFE_df['y_ksm'][i])
-            z_ksm_joined.append(LFE_df['z_ksm'][i])
-            label_joined.append(LFE_df['label'][i])
-            R_ksm_joined.append(LFE_df['R_ksm'][i])
-            subLST_joined.append(LFE_df['subLST'][i])
-            subLat_joined.append(LFE_df['subLat'][i])
-            subLon_joined.append(LFE_df['subLon'][i])
-            iter_skip=True   #want it to skip an iteration
-        
-    #now make a new dataframe with the joined LFEs
-    LFE_df_joined = pd.DataFrame({'start':starts_joined, 
-                                  'end':ends_joined,
-                                  'x_ksm':x_ksm_joined,
-                                  'y_ksm':y_ksm_joined,
-                                  'z_ksm':z_ksm_joined,
-                                  'R_ksm':R_ksm_joined,
-                                  'subLST':subLST_joined,
-                                  'subLat':subLat_joined,
-                                  'subLon':subLon_joined,
-                                  'label':label_joined})  
-    LFE_duration_joined = LFE_df_joined['end'] - LFE_df_joined['start']  #want this in minutes and to be smart about day/year boundaries
-  
-    LFE_secs_joined = []
-    for i in range(np.array(LFE_duration_joined).size):
-        LFE_secs_joined.append(LFE_duration_joined[i].total_seconds())
+def LFE_joiner(data_directory, LFE_df, gap_minutes=10, file_name='LFEs_joined.csv'):
+    """Join successive LFEs separated by short gaps.
+
+    Runs of any number of LFEs where each LFE starts at most gap_minutes after the latest end of the LFEs before it are
+    merged in one pass, using the cumulative sum of the long gaps as group ID. An LFE lying inside a longer earlier one
+    does not shorten the window of the next one.
+
+    Parameters
+    ----------
+    data_directory: str
+        Folder the joined LFEs are saved to.
+
+    LFE_df: pandas.DataFrame
+        LFE detections sorted by start time, with ephemeris columns.
+
+    gap_minutes: float, optional
+        Longest gap between two LFEs for them to be joined. Default is 10 minutes.
+
+    file_name: str, optional
+        Name of the csv file the joined LFEs are saved to. Default is 'LFEs_joined.csv'.
+
+    Returns
+    -------
+    LFE_df_joined: pandas.DataFrame
+        Joined LFEs, starting with the start time, label and ephemeris of the first LFE of each group and ending at the
+        latest end time of the group.
+
+    LFE_secs_joined: list
+        Durations of the joined LFEs in seconds.
+    """
+    starts, ends = LFE_df['start'].to_numpy(), LFE_df['end'].to_numpy()
+
+    # Gaps are taken from the latest end so far, which is the latest end of the current group as groups do not overlap
+    time_diff_minutes = (starts[1:] - np.maximum.accumulate(ends)[:-1]) / np.timedelta64(1, 'm')
+
+    # A new group starts at the first LFE and after every long gap
+    new_group = np.concatenate([[True], time_diff_minutes > gap_minutes])
+    group_id = np.cumsum(new_group) - 1
+
+    LFE_df_joined = LFE_df.iloc[np.flatnonzero(new_group)][['start', 'end', 'x_ksm', 'y_ksm', 'z_ksm', 'R_ksm', 'subLST', 'subLat', 'subLon', 'label']].reset_index(drop=True)
+    LFE_df_joined['end'] = pd.Series(ends).groupby(group_id).max().to_numpy()
 
     #Add the duration to the new datafram
-    LFE_df_joined['duration'] = LFE_secs_joined
-    #breakpoint()
-    file_name = 'LFEs_joined.csv'
-    #print(f"Saving new csv file to {data_directory + file_name}")
+    LFE_df_joined['duration'] = (LFE_df_joined['end'] - LFE_df_joined['start']).dt.total_seconds()
+    LFE_secs_joined = LFE_df_joined['duration'].tolist()
+
     LFE_df_joined.to_csv(data_directory + file_name)
-    
-    #print("printing the n elements in new LFE joined")
-    #print(LFE_df_joined)
 
     return LFE_df_joined, LFE_secs_joined
 
-LFE_duration = LFE_df['end'] - LFE_df['start']  #want this in minutes and to be smart about day/year boundaries
+if __name__ == '__main__':
+    LFE_df = pd.read_csv(data_directory + lfe_detections_fp, parse_dates=['start','end'])
 
-LFE_secs = []
-for i in range(np.array(LFE_duration).size):
-    LFE_secs.append(LFE_duration[i].total_seconds())
-    LFE_joiner(data_directory, LFE_df, LFE_secs)
-    print(f'{i/np.array(LFE_duration).size*100:.1f}%')
\ No newline at end of file
+    LFE_joiner(data_directory, LFE_df)
@@ -1,16 +1,50 @@
+import os
+import json
+import tempfile
+from functools import lru_cache
+
+from multiprocess import shared_memory
+
 import numpy as np
+import pandas as pd
+import xarray as xr
 import matplotlib.dates as mdates
 from scipy.io import readsav
+from scipy import sparse
+from tfcat import TFCat
+
+# Packed array file format, see save_packed_arrays
+_PACKED_MAGIC = b'LFEPACK1'
+_PACKED_ALIGN = 64
+
+# Ephemeris store columns, and the period of the angular ones
+_EPHEMERIS_COLUMNS = ['x_ksm', 'y_ksm', 'z_ksm', 'subLat', 'subLon', 'subLST', 'R_ksm']
+_EPHEMERIS_PERIODS = {'subLon': 360., 'subLST': 24.}
+
+# Time-frequency grid of the mask workers, set by init_mask_worker
+_mask_grid = {}
+
+# SKR time step, and the time decimation factors of the spectrogram pyramid levels (512 steps is just over a day)
+_SKR_STEP = np.timedelta64(180, 's')
+_PYRAMID_FACTORS = [2, 4, 8, 16, 32, 64, 128, 256, 512]
 
-def get_sav_data(year):
+def get_sav_data(year, skr_raw_fp='data/raw/SKR_raw', skr_cache_fp='data/calculated/SKR_cache'):
     """Select sav data for a chosen year.
     
-    Parses through an SKR year file to obtain the time, frequency and flux data.
+    Parses through an SKR year file to obtain the time, frequency and flux data. The parsed arrays are saved once to
+    a memory-mappable cache file, and every call returns read-only views of that file (copy them before modifying),
+    including the call writing it.
     
     Parameters
     ----------
     year: int or str
         Year of the file wanted.
+
+    skr_raw_fp: str, optional
+        Folder of the yearly SKR .sav files.
+
+    skr_cache_fp: str or None, optional
+        Folder of the cache files. If None, the .sav file is parsed without caching and writable arrays are returned.
     
     Returns
     -------
@@ -23,10 +57,18 @@ def get_sav_data(year):
     flux: numpy.array (freq.shape, time.shape)
         Magnetic flux values for the chosen year.
     """
+    file_skr = skr_raw_fp + f'/SKR_{year}_CJ.sav'
 
-    skr_raw_fp = 'data/raw/SKR_raw'
+    if skr_cache_fp is not None:
+        file_cache = skr_cache_fp + f'/SKR_{year}_CJ.bin'
+        source = file_signature(file_skr)
+
+        if os.path.exists(file_cache):
+            arrays, meta = _open_packed_arrays(file_cache, os.stat(file_cache).st_mtime_ns)
+
+            if source is None or meta.get('source') == source:
+                return arrays['time'], arrays['freq'], arrays['flux']
 
-    file_skr = skr_raw_fp + f'/SKR_{year}_CJ.sav'
     raw_skr = readsav(file_skr)
     flux, time_doy, freq = raw_skr['s'].copy(), raw_skr['t'], raw_skr['f']
     flux[flux == 0] = np.nan  # replace 0 with nans
@@ -35,9 +77,398 @@ def get_sav_data(year):
     time = time.astype('datetime64[m]')
     time = time.astype('datetime64[s]')
 
+    if skr_cache_fp is not None:
+        os.makedirs(skr_cache_fp, exist_ok=True)
+        save_packed_arrays(file_cache, {'time': time, 'freq': freq, 'flux': flux}, meta={'source': source})
+
+        arrays, _ = _open_packed_arrays(file_cache, os.stat(file_cache).st_mtime_ns)
+        return arrays['time'], arrays['freq'], arrays['flux']
+
     return time, freq, flux
 
-def get_poly_coords(year, poly_tf_list):
+def get_spectrogram(start, end, log_freq_bins=399, max_columns=None, stat='mean', skr_raw_fp='data/raw/SKR_raw',
+                    skr_cache_fp='data/calculated/SKR_cache', pyramid_fp='data/calculated/SKR_pyramid'):
+    """Select the SKR flux of a time window, regridded onto a logarithmic frequency axis.
+
+    The window is found by binary search on the time axis of the cached yearly arrays from get_sav_data, so only the
+    flux columns inside it are read, and windows crossing the new year are joined. All columns are interpolated at
+    once with a sparse matrix giving the same values as numpy.interp.
+
+    If the window holds more than max_columns time steps, the flux is read from the first level of the spectrogram
+    pyramid (see get_spectrogram_pyramid) with at most max_columns columns, e.g. the width of the plot in pixels.
+
+    Parameters
+    ----------
+    start, end: numpy.datetime64, pandas.Timestamp or str
+        Limits of the time window, start included and end excluded.
+
+    log_freq_bins: int or None, optional
+        Number of logarithmic steps between the first and last Cassini frequencies. If None, the flux is returned on
+        the Cassini frequency bins. Default is 399.
+
+    max_columns: int or None, optional
+        Largest number of time columns wanted. Default is None, the full 3 minute resolution.
+
+    stat: str, optional
+        Statistic of the decimated columns when a pyramid level is used: 'mean', 'max' or 'count' (number of valid
+        values). Default is 'mean'.
+
+    skr_raw_fp, skr_cache_fp, pyramid_fp: str, optional
+        See get_sav_data and get_spectrogram_pyramid.
+
+    Returns
+    -------
+    time: numpy.array
+        Time series in 3 minute step, or the time of the first step of each decimated column, starting with the
+        column containing start.
+
+    freq: numpy.array
+        Frequency axis.
+
+    flux: numpy.array (freq.shape, time.shape)
+        Magnetic flux values.
+    """
+    start, end = np.datetime64(pd.Timestamp(start), 's'), np.datetime64(pd.Timestamp(end), 's')
+
+    # Smallest pyramid level fitting in max_columns, 1 for the full resolution
+    factor = 1
+    if max_columns is not None and (end - start) / _SKR_STEP > max_columns:
+        factor = next((f for f in _PYRAMID_FACTORS if (end - start) / (f * _SKR_STEP) <= max_columns), _PYRAMID_FACTORS[-1])
+
+    times, fluxes = [], []
+    for year in range(start.astype(object).year, (end - np.timedelta64(1, 's')).astype(object).year + 1):
+        if factor == 1:
+            time, freq, flux = get_sav_data(year, skr_raw_fp, skr_cache_fp)
+        else:
+            arrays, meta = get_spectrogram_pyramid(year, skr_raw_fp, skr_cache_fp, pyramid_fp)
+            freq, flux = arrays['freq'], arrays[f'{stat}_{factor}']
+            time = np.datetime64(meta['start']) + np.arange(flux.shape[1]) * factor * np.timedelta64(meta['step_s'], 's')
+
+        # Decimated columns start at the column containing start, which can begin before it
+        if factor == 1:
+            first = np.searchsorted(time, start, side='left')
+        else:
+            first = max(np.searchsorted(time, start, side='right') - 1, 0)
+
+        window = slice(first, np.searchsorted(time, end, side='left'))
+        times.append(time[window])
+        fluxes.append(flux[:, window])
+
+    time, flux = np.concatenate(times), np.concatenate(fluxes, axis=1)
+
+    if log_freq_bins is None:
+        return time, freq, flux
+
+    log_freq, regrid = _log_regrid_matrix(tuple(freq), log_freq_bins)
+
+    return time, log_freq, regrid @ flux
+
+def get_spectrogram_pyramid(year, skr_raw_fp='data/raw/SKR_raw', skr_cache_fp='data/calculated/SKR_cache',
+                            pyramid_fp='data/calculated/SKR_pyramid'):
+    """Time-decimated levels of the SKR flux of a year, for plotting long windows.
+
+    Level f covers the year in columns of f 3-minute steps starting at the new year, for every f of _PYRAMID_FACTORS
+    (2, 4, ... 512), and holds the mean, maximum and number of valid values of the flux in each column. Every level
+    is summed from the one below it. The levels are saved once to a memory-mappable file, later calls return
+    read-only views of that file until the .sav file changes.
+
+    Parameters
+    ----------
+    year: int or str
+        Year wanted.
+
+    skr_raw_fp, skr_cache_fp: str, optional
+        See get_sav_data.
+
+    pyramid_fp: str, optional
+        Folder of the pyramid files.
+
+    Returns
+    -------
+    arrays: dict
+        'freq', and 'mean_{f}', 'max_{f}' (float32) and 'count_{f}' (uint16) arrays of shape (freq.shape, columns)
+        for every factor f. Columns without valid values have NaN mean and max.
+
+    meta: dict
+        'start' time of the first column of every level, 'step_s' the SKR time step and 'factors'.
+    """
+    file_pyramid = pyramid_fp + f'/SKR_{year}_pyramid.bin'
+    source = file_signature(skr_raw_fp + f'/SKR_{year}_CJ.sav')
+
+    if os.path.exists(file_pyramid):
+        arrays, meta = _open_packed_arrays(file_pyramid, os.stat(file_pyramid).st_mtime_ns)
+
+        if source is None or meta.get('source') == source:
+            return arrays, meta
+
+    time, freq, flux = get_sav_data(year, skr_raw_fp, skr_cache_fp)
+    start = np.datetime64(f'{year}-01-01T00:00:00')
+
+    # First level, from the runs of time steps falling in each column
+    column = ((time - start) // (_PYRAMID_FACTORS[0] * _SKR_STEP)).astype(np.intp)
+    run_start = np.flatnonzero(np.r_[True, column[1:] != column[:-1]])
+    n_columns = column[-1] + 1
+
+    valid = np.isfinite(flux)
+    total = np.zeros((len(freq), n_columns))
+    count = np.zeros((len(freq), n_columns), dtype=np.int64)
+    maximum = np.full((len(freq), n_columns), np.nan)
+    total[:, column[run_start]] = np.add.reduceat(np.where(valid, flux, 0), run_start, axis=1)
+    count[:, column[run_start]] = np.add.reduceat(valid, run_start, axis=1)
+    maximum[:, column[run_start]] = np.fmax.reduceat(flux, run_start, axis=1)
+
+    arrays = {'freq': freq}
+    for i, factor in enumerate(_PYRAMID_FACTORS):
+        if i > 0:
+            # Pairs of columns of the level below, padded to an even number of columns
+            pad = ((0, 0), (0, total.shape[1] % 2))
+            total = np.pad(total, pad).reshape(len(freq), -1, 2).sum(axis=-1)
+            count = np.pad(count, pad).reshape(len(freq), -1, 2).sum(axis=-1)
+            maximum = np.fmax.reduce(np.pad(maximum, pad, constant_values=np.nan).reshape(len(freq), -1, 2), axis=-1)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            arrays[f'mean_{factor}'] = np.where(count > 0, total / count, np.nan).astype(np.float32)
+        arrays[f'max_{factor}'] = maximum.astype(np.float32)
+        arrays[f'count_{factor}'] = count.astype(np.uint16)
+
+    meta = {'source': source, 'start': str(start), 'step_s': int(_SKR_STEP / np.timedelta64(1, 's')), 'factors': _PYRAMID_FACTORS}
+
+    os.makedirs(pyramid_fp, exist_ok=True)
+    save_packed_arrays(file_pyramid, arrays, meta=meta)
+
+    return _open_packed_arrays(file_pyramid, os.stat(file_pyramid).st_mtime_ns)
+
+@lru_cache(maxsize=4)
+def _log_regrid_matrix(freq, log_freq_bins):
+    """Logarithmic frequency axis and the sparse matrix interpolating flux on the freq axis onto it."""
+    freq = np.asarray(freq, dtype=float)
+
+    # freq is in log scale from f[0]=3.9548001 to f[24] = 349.6542 and then in linear scale above
+    log_step = (np.log10(np.max(freq)) - np.log10(np.min(freq))) / log_freq_bins
+    log_freq = 10**(np.arange(np.log10(freq[0]), np.log10(freq[-1]), log_step, dtype=float))
+
+    # Two neighbouring channels per new frequency, with the weights of a linear interpolation
+    right = np.clip(np.searchsorted(freq, log_freq, side='right'), 1, len(freq) - 1)
+    left = right - 1
+    weight = np.clip((log_freq - freq[left]) / (freq[right] - freq[left]), 0, 1)
+
+    rows = np.repeat(np.arange(len(log_freq)), 2)
+    regrid = sparse.csr_matrix(((np.column_stack((1 - weight, weight))).ravel(), (rows, np.column_stack((left, right)).ravel())),
+                               shape=(len(log_freq), len(freq)))
+    regrid.eliminate_zeros()  # Frequencies on a channel only take that channel, as numpy.interp does
+
+    return log_freq, regrid
+
+def file_signature(fp):
+    """Get the size and modification time of a file, used to tell if a cache built from it is stale.
+
+    Parameters
+    ----------
+    fp: str
+        Path of the file.
+
+    Returns
+    -------
+    signature: list
+        [size in bytes, modification time in ns], None if the file does not exist.
+    """
+    if not os.path.exists(fp):
+        return None
+
+    stat = os.stat(fp)
+
+    return [stat.st_size, stat.st_mtime_ns]
+
+def save_packed_arrays(fp, arrays, meta=None):
+    """Save arrays to a single memory-mappable file.
+
+    The file starts with a magic string and a JSON header giving the dtype, shape and offset of every array, followed
+    by the raw array data aligned on 64 bytes. Arrays are converted to native byte order.
+
+    Parameters
+    ----------
+    fp: str
+        Path of the file to write. The file is written to a unique temporary file in the same folder first and then
+        moved, so processes writing the same file at the same time never leave a partly written file.
+
+    arrays: dict
+        Arrays to save, by name.
+
+    meta: dict, optional
+        JSON serialisable metadata saved in the header.
+    """
+    arrays = {name: np.ascontiguousarray(array, dtype=np.asarray(array).dtype.newbyteorder('=')) for name, array in arrays.items()}
+
+    header = {'meta': meta or {}, 'arrays': {}}
+    offset = 0
+    for name, array in arrays.items():
+        header['arrays'][name] = {'dtype': array.dtype.str, 'shape': array.shape, 'offset': offset}
+        offset += -(-array.nbytes // _PACKED_ALIGN) * _PACKED_ALIGN
+
+    header_bytes = json.dumps(header).encode()
+    data_start = -(-(len(_PACKED_MAGIC) + 8 + len(header_bytes)) // _PACKED_ALIGN) * _PACKED_ALIGN
+
+    tmp_fd, tmp_fp = tempfile.mkstemp(dir=os.path.dirname(fp) or '.', prefix=os.path.basename(fp) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(tmp_fd, 'wb') as f:
+            f.write(_PACKED_MAGIC)
+            f.write(np.uint64(len(header_bytes)).tobytes())
+            f.write(header_bytes)
+            for name, array in arrays.items():
+                f.seek(data_start + header['arrays'][name]['offset'])
+                f.write(array.tobytes())
+            f.truncate(data_start + offset)
+
+        os.replace(tmp_fp, fp)
+    except BaseException:
+        if os.path.exists(tmp_fp):
+            os.remove(tmp_fp)
+        raise
+
+def load_packed_arrays(fp):
+    """Load a file written by save_packed_arrays as read-only memory-mapped arrays.
+
+    Parameters
+    ----------
+    fp: str
+        Path of the file.
+
+    Returns
+    -------
+    arrays: dict
+        Zero-copy read-only views of the arrays, by name.
+
+    meta: dict
+        Metadata saved in the header.
+    """
+    buffer = np.memmap(fp, dtype=np.uint8, mode='r')
+
+    if bytes(buffer[:len(_PACKED_MAGIC)]) != _PACKED_MAGIC:
+        raise ValueError(f'{fp} is not a packed array file')
+
+    header_len = int(buffer[len(_PACKED_MAGIC):len(_PACKED_MAGIC) + 8].view(np.uint64)[0])
+    header = json.loads(bytes(buffer[len(_PACKED_MAGIC) + 8:len(_PACKED_MAGIC) + 8 + header_len]))
+    data_start = -(-(len(_PACKED_MAGIC) + 8 + header_len) // _PACKED_ALIGN) * _PACKED_ALIGN
+
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        dtype, shape = np.dtype(spec['dtype']), tuple(spec['shape'])
+        start = data_start + spec['offset']
+        arrays[name] = buffer[start:start + dtype.itemsize * int(np.prod(shape))].view(dtype).reshape(shape)
+
+    return arrays, header['meta']
+
+@lru_cache(maxsize=4)
+def _open_packed_arrays(fp, mtime_ns):
+    """Keep the most recently used packed files open, the modification time invalidates rewritten files."""
+    return load_packed_arrays(fp)
+
+def get_poly_flux(start, end, poly_flux_fp='data/calculated/poly_flux_combined.zarr'):
+    """Select polygon-masked flux for a time window from the mission store.
+
+    Only the store chunks overlapping the window are read and decompressed.
+
+    Parameters
+    ----------
+    start, end: numpy.datetime64 or str
+        Limits of the time window, both included.
+
+    poly_flux_fp: str, optional
+        Path of the time-chunked store written by get_polygon_flux.py.
+
+    Returns
+    -------
+    time: numpy.array
+        Time series in 3 minute step.
+
+    freq: numpy.array
+        Midpoint values of Cassini frequency bins.
+
+    flux: numpy.array (freq.shape, time.shape)
+        Magnetic flux values inside the LFE polygons, NaN elsewhere.
+    """
+    with xr.open_zarr(poly_flux_fp) as ds:
+        window = ds['flux'].sel(time=slice(np.datetime64(start), np.datetime64(end))).load()
+
+    return window['time'].to_numpy(), window['frequency'].to_numpy(), window.to_numpy()
+
+def save_ephemeris_store(eph_df, store_fp='data/calculated/20040101000000_20170915115700_ephemeris.bin'):
+    """Save a minutely ephemeris as a memory-mappable columnar file.
+
+    Parameters
+    ----------
+    eph_df: pandas.DataFrame
+        Ephemeris from get_ephemeris.py, with a 'start' time column in regular 1 minute steps.
+
+    store_fp: str, optional
+        Path of the file to write.
+    """
+    time = np.asarray(eph_df['start'], dtype='datetime64[s]')
+    if np.any(np.diff(time) != np.timedelta64(60, 's')):
+        raise ValueError('Ephemeris times are not in regular 1 minute steps')
+
+    columns = {col: np.asarray(eph_df[col], dtype=float) for col in _EPHEMERIS_COLUMNS}
+
+    save_packed_arrays(store_fp, columns, meta={'start': str(time[0]), 'step_s': 60})
+
+def get_ephemeris(times, columns=None, interpolate=False, store_fp='data/calculated/20040101000000_20170915115700_ephemeris.bin'):
+    """Look up the ephemeris at any times from the store written by save_ephemeris_store.
+
+    Row offsets are computed arithmetically from the fixed 1 minute cadence, no time parsing or merge is needed.
+
+    Parameters
+    ----------
+    times: array-like
+        Times to look up, anything numpy.datetime64 understands.
+
+    columns: list, optional
+        Ephemeris columns wanted. Default is all of them.
+
+    interpolate: bool, optional
+        If False, only times exactly on the minute grid get values. If True, values are interpolated linearly between
+        the two surrounding minutes, across the wrap of subLon (360 degrees) and subLST (24 hours). Default is False.
+
+    store_fp: str, optional
+        Path of the ephemeris store.
+
+    Returns
+    -------
+    eph: pandas.DataFrame
+        Ephemeris columns in the order of times, NaN for times outside of the store or off the grid.
+    """
+    arrays, meta = _open_packed_arrays(store_fp, os.stat(store_fp).st_mtime_ns)
+    columns = _EPHEMERIS_COLUMNS if columns is None else columns
+
+    offset = (np.asarray(times, dtype='datetime64[ns]') - np.datetime64(meta['start'])) / np.timedelta64(meta['step_s'], 's')
+    n_rows = len(arrays[columns[0]])
+
+    row = np.floor(offset)
+    weight = offset - row
+    if not interpolate:
+        row[weight != 0] = np.nan
+
+    valid = (row >= 0) & (row < n_rows) & ~((row == n_rows - 1) & (weight > 0))
+    left = np.where(valid, row, 0).astype(int)
+    right = np.minimum(left + 1, n_rows - 1)
+    weight = np.where(valid, weight, 0)
+
+    eph = {}
+    for col in columns:
+        value0, value1 = arrays[col][left], arrays[col][right]
+
+        if col in _EPHEMERIS_PERIODS:
+            # Interpolate towards the closest image of the next value across the wrap
+            period = _EPHEMERIS_PERIODS[col]
+            value1 = value0 + (value1 - value0 + period / 2) % period - period / 2
+            value = ((1 - weight) * value0 + weight * value1) % period
+        else:
+            value = (1 - weight) * value0 + weight * value1
+
+        eph[col] = np.where(valid, value, np.nan)
+
+    return pd.DataFrame(eph)
+
+def get_poly_coords(year, poly_tf_list, return_index=False, poly_index=None):
     """Select polygons for a chosen year from a list of polygons.
 
     Parameters
@@ -47,23 +478,585 @@ def get_poly_coords(year, poly_tf_list):
     
     poly_tf_list: list
         List of polygon time-frequency coordinates.
+
+    return_index: bool, optional
+        If True, also return the index in poly_tf_list of every selected polygon. Default is False.
+
+    poly_index: dict, optional
+        Index of poly_tf_list as returned by index_polygons, used to only look at the polygons overlapping the year.
     
     Returns
     -------
     polygon_coordinates: list
         List of polygon time-frequency coordinates for the chosen year.
+
+    polygon_indices: list
+        Index in poly_tf_list of each selected polygon, only returned if return_index is True.
     """
     year_range = 1
 
     year_low, year_high = mdates.date2num(np.datetime64(f'{year}')), mdates.date2num(np.datetime64(f'{year + year_range}'))
 
+    if poly_index is None:
+        candidates = range(len(poly_tf_list))
+    else:
+        candidates = query_polygon_index(poly_index, year_low, year_high)
+
     polygon_coordinates = []
-    for poly_coords in poly_tf_list:
+    polygon_indices = []
+    for i in candidates:
+        poly_coords = poly_tf_list[i]
     
         poly_time = poly_coords[:,0]
         time_mask = (poly_time >= year_low) & (poly_time <= year_high)
 
         if any(time_mask):
             polygon_coordinates.append(poly_coords[time_mask])
+            polygon_indices.append(i)
+
+    if return_index:
+        return polygon_coordinates, polygon_indices
+
+    return polygon_coordinates
+
+def index_polygons(polygons, time_min=None, time_max=None):
+    """Build a time-interval index over a list of polygons.
+
+    Parameters
+    ----------
+    polygons: list
+        List of polygon time-frequency coordinates, time in the first column.
+
+    time_min, time_max: numpy.array, optional
+        Time limits of every polygon if already known, e.g. the bbox columns of a packed catalogue.
+
+    Returns
+    -------
+    poly_index: dict
+        'polygons' list, per polygon 'time_min' and 'time_max' sorted by time_min, 'order' giving the position in
+        polygons of each sorted entry and 'max_duration' the longest polygon time span.
+    """
+    if time_min is None:
+        time_min = np.array([np.min(poly[:, 0]) for poly in polygons], dtype=float)
+        time_max = np.array([np.max(poly[:, 0]) for poly in polygons], dtype=float)
+    order = np.argsort(time_min, kind='stable')
+
+    return {'polygons': polygons,
+            'time_min': time_min[order],
+            'time_max': time_max[order],
+            'order': order,
+            'max_duration': np.max(time_max - time_min) if len(polygons) else 0.}
+
+def query_polygon_index(poly_index, start, end):
+    """Find the polygons overlapping a time window.
+
+    A polygon overlaps the window if at least one of its vertices is before the end and one after the start. Binary
+    searches on the sorted minimum times restrict the check to polygons starting less than the longest polygon
+    duration before the window.
+
+    Parameters
+    ----------
+    poly_index: dict
+        Index as returned by index_polygons.
+
+    start, end: float
+        Limits of the time window, in the time units of the polygons.
+
+    Returns
+    -------
+    polygon_indices: numpy.array
+        Sorted positions of the overlapping polygons in poly_index['polygons'].
+    """
+    low = np.searchsorted(poly_index['time_min'], start - poly_index['max_duration'], side='left')
+    high = np.searchsorted(poly_index['time_min'], end, side='right')
+
+    overlap = poly_index['time_max'][low:high] >= start
+
+    return np.sort(poly_index['order'][low:high][overlap])
+
+def pack_polygons(polygons):
+    """Pack polygons into flat vertex arrays with per-polygon offsets and bounding boxes.
+
+    Parameters
+    ----------
+    polygons: list
+        List of polygon time-frequency coordinates, time in unix seconds.
+
+    Returns
+    -------
+    arrays: dict
+        'vertices_unix' and 'vertices_num' (n_vertices, 2) with the time in unix seconds and in matplotlib date units
+        (of the time truncated to the second), 'offsets' so that polygon i is vertices[offsets[i]:offsets[i + 1]], and
+        per polygon 'time_min', 'time_max' (unix), 'time_num_min', 'time_num_max', 'freq_min' and 'freq_max'.
+    """
+    n_vertices = np.array([len(poly) for poly in polygons], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(n_vertices)])
+
+    vertices_unix = np.concatenate([np.asarray(poly, dtype=float).reshape(-1, 2) for poly in polygons]) if len(polygons) else np.zeros((0, 2))
+    vertices_num = np.column_stack((mdates.date2num(vertices_unix[:, 0].astype('datetime64[s]')), vertices_unix[:, 1]))
+
+    # Per polygon reductions over the runs of vertices, empty polygons have NaN limits
+    starts = np.minimum(offsets[:-1], max(len(vertices_unix) - 1, 0))
+    def reduce_runs(ufunc, values):
+        result = ufunc.reduceat(values, starts) if len(values) else np.zeros(len(polygons))
+        return np.where(n_vertices > 0, result, np.nan)
+
+    return {'vertices_unix': vertices_unix,
+            'vertices_num': vertices_num,
+            'offsets': offsets,
+            'time_min': reduce_runs(np.minimum, vertices_unix[:, 0]),
+            'time_max': reduce_runs(np.maximum, vertices_unix[:, 0]),
+            'time_num_min': reduce_runs(np.minimum, vertices_num[:, 0]),
+            'time_num_max': reduce_runs(np.maximum, vertices_num[:, 0]),
+            'freq_min': reduce_runs(np.minimum, vertices_unix[:, 1]),
+            'freq_max': reduce_runs(np.maximum, vertices_unix[:, 1])}
+
+def get_catalogue(catalogue_fp, cache_fp='data/calculated'):
+    """Load a TFCat catalogue as packed polygon arrays.
+
+    The JSON catalogue is parsed once and saved to a memory-mappable .bin file named after it in cache_fp (see
+    pack_polygons and save_packed_arrays), later calls return read-only views of that file until the JSON file changes.
+
+    Parameters
+    ----------
+    catalogue_fp: str
+        Path of the TFCat JSON catalogue.
+
+    cache_fp: str or None, optional
+        Folder of the cache files. If None, the JSON catalogue is parsed without caching and writable arrays are
+        returned.
+
+    Returns
+    -------
+    arrays: dict
+        Packed polygons as returned by pack_polygons.
+
+    meta: dict
+        'features', the 'id' and 'properties' of every feature, and 'catalogue', the other members of the catalogue
+        (crs, properties...).
+    """
+    source = file_signature(catalogue_fp)
+
+    if cache_fp is not None:
+        file_packed = cache_fp + '/' + os.path.splitext(os.path.basename(catalogue_fp))[0] + '.bin'
+
+        if os.path.exists(file_packed):
+            arrays, meta = _open_packed_arrays(file_packed, os.stat(file_packed).st_mtime_ns)
+
+            if source is None or meta.get('source') == source:
+                return arrays, meta
+
+    catalogue = TFCat.from_file(catalogue_fp)
+
+    features = catalogue._data['features']
+    arrays = pack_polygons([np.array(feature['geometry']['coordinates'][0], dtype=float) for feature in features])
+
+    meta = {'source': source,
+            'features': [{'id': feature.get('id'), 'properties': feature.get('properties')} for feature in features],
+            'catalogue': {key: value for key, value in catalogue._data.items() if key != 'features'}}
+
+    if cache_fp is not None:
+        os.makedirs(cache_fp, exist_ok=True)
+        save_packed_arrays(file_packed, arrays, meta=meta)
+
+        return _open_packed_arrays(file_packed, os.stat(file_packed).st_mtime_ns)
+
+    return arrays, meta
+
+def catalogue_polygons(arrays, time='unix'):
+    """Split packed vertices into one array per polygon.
+
+    Parameters
+    ----------
+    arrays: dict
+        Packed polygons as returned by pack_polygons or get_catalogue.
+
+    time: str, optional
+        'unix' for the time in unix seconds, 'num' for matplotlib date units. Default is 'unix'.
+
+    Returns
+    -------
+    polygons: list
+        Zero-copy views of the time-frequency vertices of every polygon.
+    """
+    vertices, offsets = arrays[f'vertices_{time}'], arrays['offsets']
+
+    return [vertices[start:end] for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+def save_catalogue_json(catalogue_fp, arrays, meta=None):
+    """Export packed polygons as a TFCat JSON catalogue.
+
+    Parameters
+    ----------
+    catalogue_fp: str
+        Path of the JSON file to write.
+
+    arrays: dict
+        Packed polygons as returned by pack_polygons or get_catalogue, time in unix seconds.
+
+    meta: dict, optional
+        'features' and 'catalogue' metadata as returned by get_catalogue, written back with the polygons.
+    """
+    meta = meta or {}
+    feature_meta = meta.get('features') or [{}] * (len(arrays['offsets']) - 1)
+
+    features = []
+    for polygon, feature in zip(catalogue_polygons(arrays, 'unix'), feature_meta):
+        tfcat_feature = {'type': 'Feature', 'geometry': {'type': 'Polygon', 'coordinates': [polygon.tolist()]}}
+        if feature.get('id') is not None:
+            tfcat_feature['id'] = feature['id']
+        if feature.get('properties') is not None:
+            tfcat_feature['properties'] = feature['properties']
+        features.append(tfcat_feature)
+
+    catalogue = {'type': 'FeatureCollection', **meta.get('catalogue', {}), 'features': features}
+
+    with open(catalogue_fp, 'w') as outfile:
+        json.dump(catalogue, outfile)
+
+def get_catalogue_index(catalogue_fp, time='unix', cache_fp='data/calculated'):
+    """Load a TFCat catalogue once and index its polygons in time.
+
+    Parameters
+    ----------
+    catalogue_fp: str
+        Path of the TFCat JSON catalogue.
+
+    time: str, optional
+        'unix' for polygon times in unix seconds, 'num' for matplotlib date units. Default is 'unix'.
+
+    cache_fp: str or None, optional
+        Folder of the packed catalogue file, see get_catalogue.
+
+    Returns
+    -------
+    poly_index: dict
+        Index as returned by index_polygons, of the polygon vertices in time and frequency. Repeated calls return the
+        same index until the file is modified.
+    """
+    return _load_catalogue_index(catalogue_fp, os.stat(catalogue_fp).st_mtime_ns, time, cache_fp)
+
+@lru_cache(maxsize=4)
+def _load_catalogue_index(catalogue_fp, mtime_ns, time, cache_fp):
+    arrays, meta = get_catalogue(catalogue_fp, cache_fp=cache_fp)
+    prefix = 'time_num' if time == 'num' else 'time'
+
+    return index_polygons(catalogue_polygons(arrays, time), arrays[f'{prefix}_min'], arrays[f'{prefix}_max'])
+
+def to_shared_memory(array):
+    """Copy an array into a new shared memory block.
+
+    Parameters
+    ----------
+    array: numpy.array
+        Array to share with worker processes.
+
+    Returns
+    -------
+    shm: multiprocess.shared_memory.SharedMemory
+        Shared memory block, to be closed and unlinked by the caller when done.
+
+    spec: tuple
+        (name, shape, dtype) needed by from_shared_memory to attach to the block.
+    """
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    shared[...] = array
+
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+def from_shared_memory(spec):
+    """Attach to a shared memory block created by to_shared_memory.
+
+    Parameters
+    ----------
+    spec: tuple
+        (name, shape, dtype) of the shared array.
+
+    Returns
+    -------
+    shm: multiprocess.shared_memory.SharedMemory
+        Shared memory block, which must be kept alive as long as the array is used.
+
+    array: numpy.array
+        Array backed by the shared memory block, without a copy.
+    """
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+    return shm, array
+
+def init_mask_worker(time_spec, freq_spec):
+    """Pool initializer attaching a worker to the shared time-frequency grid used by create_mask.
+
+    Parameters
+    ----------
+    time_spec: tuple
+        Shared memory spec of the time axis in matplotlib date units.
+
+    freq_spec: tuple
+        Shared memory spec of the frequency axis.
+    """
+    _mask_grid['time_shm'], _mask_grid['time_num'] = from_shared_memory(time_spec)
+    _mask_grid['freq_shm'], _mask_grid['freq'] = from_shared_memory(freq_spec)
+
+def create_mask(poly_coords, time_num=None, freq=None, compact=False):
+    """Create a flux mask given polygon coordinates.
+
+    The mask is filled one frequency channel at a time with the even-odd rule of matplotlib's Path.contains_points:
+    a pixel is inside if a ray from it towards later times crosses the polygon edges an odd number of times. Each
+    edge crossing a channel flips the pixels of the channel before its crossing time, which is found by binary search
+    on the sorted time axis and checked with the exact contains_points comparison. The cost grows with the number of
+    edges and covered pixels, not the size of the flux, and the mask is identical to contains_points on the grid.
+
+    Parameters
+    ----------
+    poly_coords: list
+        List of polygon time-frequency coordinates.
+
+    time_num: numpy.array, optional
+        Sorted time axis of the flux in matplotlib date units. Defaults to the grid set by init_mask_worker.
+
+    freq: numpy.array, optional
+        Sorted frequency axis of the flux. Defaults to the grid set by init_mask_worker.
+
+    compact: bool, optional
+        If True, only the mask of the channels and time steps the polygon covers is returned, together with the slices
+        locating it in the flux. Default is False.
+    
+    Returns
+    -------
+    mask: numpy.array
+        Boolean mask of dimension flux where True values represent polygon coordinates in the flux.
+
+    (freq_slice, time_slice, sub_mask): tuple
+        Returned instead of mask if compact is True. sub_mask is the boolean mask of flux[freq_slice, time_slice], no
+        pixel outside of it is in the polygon.
+    """
+    if time_num is None:
+        time_num, freq = _mask_grid['time_num'], _mask_grid['freq']
+
+    poly_coords = np.asarray(poly_coords, dtype=float)
+    time_0, freq_0 = poly_coords[:, 0], poly_coords[:, 1]
+    time_1, freq_1 = np.roll(time_0, -1), np.roll(freq_0, -1)  # Edges, closing the polygon if it is not closed
+
+    # Channels strictly above the lowest vertex and up to the highest one are the only ones edges can cross
+    freq_slice = slice(np.searchsorted(freq, np.min(freq_0), side='right'), np.searchsorted(freq, np.max(freq_0), side='right'))
+    channel_freq = freq[freq_slice]
+
+    # Edge and channel of every crossing, an edge crosses the channels in [min(f0, f1), max(f0, f1)) of its vertices
+    above_0 = freq_0[:, np.newaxis] >= channel_freq
+    above_1 = freq_1[:, np.newaxis] >= channel_freq
+    edge, channel = np.nonzero(above_0 != above_1)
+
+    if not len(edge):
+        sub_mask = np.zeros((len(channel_freq), 0), dtype=bool)
+        time_slice = slice(0, 0)
+    else:
+        t0, t1, f1, upward = time_0[edge], time_1[edge], freq_1[edge], above_1[edge, channel]
+        cross_a = (f1 - channel_freq[channel]) * (t0 - t1)
+        cross_b = freq_0[edge] - f1
+
+        def flips(index):
+            # Crossing test of contains_points for the pixels at the time index of each crossing
+            t = time_num[np.clip(index, 0, len(time_num) - 1)]
+            return (cross_a >= (t1 - t) * cross_b) == upward
+
+        # Each crossing flips the pixels before its crossing time, the pixel exactly on an upward edge is flipped too.
+        # The test is monotonic in time so rounding of the crossing time is corrected by stepping the binary search result.
+        cross_time = t1 - cross_a / cross_b
+        flip_end = np.where(upward, np.searchsorted(time_num, cross_time, side='right'), np.searchsorted(time_num, cross_time, side='left'))
+        while True:
+            longer = (flip_end < len(time_num)) & flips(flip_end)
+            shorter = (flip_end > 0) & ~flips(flip_end - 1)
+            if not (np.any(longer) or np.any(shorter)):
+                break
+            flip_end = flip_end + longer - shorter
+
+        # Every channel is crossed an even number of times, so pixels before the first or after the last crossing
+        # time are outside. In between, a pixel is inside if an odd number of crossings end after it.
+        time_slice = slice(np.min(flip_end), np.max(flip_end))
+        width = time_slice.stop - time_slice.start
+        flip_count = np.bincount(channel * (width + 1) + flip_end - time_slice.start, minlength=len(channel_freq) * (width + 1))
+        flips_after = np.cumsum(flip_count.reshape(len(channel_freq), width + 1)[:, ::-1], axis=1)[:, ::-1]
+        sub_mask = flips_after[:, 1:] % 2 == 1
+
+    if compact:
+        return freq_slice, time_slice, sub_mask
+
+    mask = np.zeros((len(freq), len(time_num)), dtype=bool)
+    mask[freq_slice, time_slice] = sub_mask
+
+    return mask
+
+def polygon_column_intervals(poly_coords, time_num):
+    """Find the frequency intervals covered by a polygon in each time column of the flux.
+
+    The vertical line of every time column is intersected with the polygon edges. An edge crosses the columns with
+    times in [min(t0, t1), max(t0, t1)), so a vertex shared by two edges is counted once and every column has an even
+    number of crossings, which pair up into the covered intervals.
+
+    Parameters
+    ----------
+    poly_coords: numpy.array
+        Polygon time-frequency coordinates, time in matplotlib date units.
+
+    time_num: numpy.array
+        Sorted time axis of the flux in matplotlib date units.
+
+    Returns
+    -------
+    time_index: numpy.array
+        Index in time_num of the column of each interval, sorted. A column appears several times if the polygon
+        crosses it more than once.
+
+    freq_min, freq_max: numpy.array
+        Frequency limits of each interval.
+    """
+    time_0, freq_0 = poly_coords[:, 0], poly_coords[:, 1]
+    time_1, freq_1 = np.roll(time_0, -1), np.roll(freq_0, -1)  # Edges, closing the polygon if it is not closed
+
+    first = np.searchsorted(time_num, np.minimum(time_0, time_1), side='left')
+    last = np.searchsorted(time_num, np.maximum(time_0, time_1), side='left')
+    crossings = last - first
+
+    # One (column, edge) pair per crossing
+    edge = np.repeat(np.arange(len(time_0)), crossings)
+    column = np.arange(np.sum(crossings)) - np.repeat(np.cumsum(crossings) - crossings, crossings) + np.repeat(first, crossings)
+
+    column_time = time_num[column]
+    crossing_freq = freq_0[edge] + (column_time - time_0[edge]) * (freq_1[edge] - freq_0[edge]) / (time_1[edge] - time_0[edge])
+
+    order = np.lexsort((crossing_freq, column))
+    column, crossing_freq = column[order], crossing_freq[order]
+
+    return column[::2], crossing_freq[::2], crossing_freq[1::2]
+
+def add_to_labels(labels, overflow, feature_id, freq_slice, time_slice, sub_mask):
+    """Write the pixels of one polygon into a label raster.
+
+    Pixels that already belong to another feature keep their label, and the new feature is recorded in the overflow
+    table instead.
+
+    Parameters
+    ----------
+    labels: numpy.array (freq.shape, time.shape)
+        Integer label raster, -1 where no feature covers the pixel. Modified in place.
+
+    overflow: list
+        List of (freq_index, time_index, feature_id) arrays of the overlapping pixels. Appended to in place.
+
+    feature_id: int
+        ID of the feature covering the pixels.
+
+    freq_slice, time_slice, sub_mask:
+        Compact polygon mask as returned by create_mask(..., compact=True).
+    """
+    region = labels[freq_slice, time_slice]
+
+    overlap_freq, overlap_time = np.nonzero(sub_mask & (region != -1))
+    if len(overlap_freq):
+        overflow.append((overlap_freq + freq_slice.start, overlap_time + time_slice.start, np.full(len(overlap_freq), feature_id, dtype=labels.dtype)))
+
+    region[sub_mask & (region == -1)] = feature_id
+
+def get_lfe_labels(year, labels_fp='data/calculated/skr_lfe_labels'):
+    """Load the LFE label raster of a chosen year.
+
+    Parameters
+    ----------
+    year: int or str
+        Year of the file wanted.
+
+    labels_fp: str, optional
+        Folder of the yearly label files written by get_polygon_flux.py.
+
+    Returns
+    -------
+    labels: xarray.Dataset
+        'label' on the (frequency, time) grid of get_sav_data holding the catalogue index of the feature covering each
+        pixel (-1 if none), and the 'overflow_*' variables listing the extra features of overlapping pixels.
+    """
+    with xr.open_dataset(labels_fp + f'/lfe_labels_{year}.ncdf', engine='netcdf4') as ds:
+        return ds.load()
+
+def index_lfe_labels(labels):
+    """Invert a label raster into a feature ID to pixels index.
+
+    Parameters
+    ----------
+    labels: xarray.Dataset
+        Label raster as returned by get_lfe_labels.
+
+    Returns
+    -------
+    label_index: dict
+        'feature_id' sorted unique IDs, 'offsets' into the 'freq_index' and 'time_index' pixel arrays where the
+        pixels of feature_id[i] are [offsets[i]:offsets[i + 1]].
+    """
+    label = labels['label'].to_numpy()
+    freq_index, time_index = np.nonzero(label != -1)
+    feature_id = label[freq_index, time_index]
+
+    freq_index = np.concatenate([freq_index, labels['overflow_frequency_index'].to_numpy()])
+    time_index = np.concatenate([time_index, labels['overflow_time_index'].to_numpy()])
+    feature_id = np.concatenate([feature_id, labels['overflow_feature_id'].to_numpy()])
+
+    order = np.argsort(feature_id, kind='stable')
+    unique_id, offsets = np.unique(feature_id[order], return_index=True)
+
+    return {'feature_id': unique_id,
+            'offsets': np.append(offsets, len(order)),
+            'freq_index': freq_index[order],
+            'time_index': time_index[order]}
+
+def get_lfe_pixels(label_index, feature_id):
+    """Get the pixels of an LFE from a label index.
+
+    Parameters
+    ----------
+    label_index: dict
+        Index as returned by index_lfe_labels.
+
+    feature_id: int
+        Catalogue index of the LFE.
+
+    Returns
+    -------
+    freq_index, time_index: numpy.array
+        Indices of the LFE pixels in the (frequency, time) grid, e.g. flux[freq_index, time_index].
+    """
+    i = np.searchsorted(label_index['feature_id'], feature_id)
+    if i == len(label_index['feature_id']) or label_index['feature_id'][i] != feature_id:
+        return np.array([], dtype=int), np.array([], dtype=int)
+
+    pixels = slice(label_index['offsets'][i], label_index['offsets'][i + 1])
+
+    return label_index['freq_index'][pixels], label_index['time_index'][pixels]
+
+def get_lfes_in_window(labels, start, end):
+    """Find all LFEs covering at least one pixel in a time window.
+
+    Parameters
+    ----------
+    labels: xarray.Dataset
+        Label raster as returned by get_lfe_labels.
+
+    start, end: numpy.datetime64 or str
+        Limits of the time window, both included.
+
+    Returns
+    -------
+    feature_id: numpy.array
+        Sorted catalogue indices of the LFEs in the window.
+    """
+    time = labels['time'].to_numpy()
+    t0, t1 = np.searchsorted(time, np.datetime64(start), side='left'), np.searchsorted(time, np.datetime64(end), side='right')
+
+    overflow_time = labels['overflow_time_index'].to_numpy()
+    overflow_id = labels['overflow_feature_id'].to_numpy()[(overflow_time >= t0) & (overflow_time < t1)]
+
+    feature_id = np.union1d(labels['label'][:, t0:t1].to_numpy(), overflow_id)
 
-    return polygon_coordinates
\ No newline at end of file
+    return feature_id[feature_id != -1]
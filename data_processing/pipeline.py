@@ -0,0 +1,325 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from lfe_func import file_signature
+
+# Filepaths
+pipeline_state_fp = 'data/calculated/pipeline_state.json'
+
+# Stages of data_processing, in the order of the README. Each stage runs its script from the Saturn_LFEs directory,
+# inputs and outputs are files or folders. A stage depends on the stages writing its inputs, and reruns when the content
+# of its inputs changes. The parameters are hard-coded in the scripts and lfe_func.py, which are hashed with the inputs.
+# Every file a script writes, including the SKR and catalogue caches of lfe_func, is declared as an output of a single
+# stage run before its readers, so stages running at the same time never write the same file.
+STAGES = {
+    'ephemeris': {
+        'script': 'data_processing/get_ephemeris.py',
+        'inputs': ['data_processing/lfe_func.py',
+                   'data/raw/2004001_2017258_start_stop_times.csv',
+                   'SPICE/cassini/metakernel_cassini.txt'],
+        'outputs': ['data/calculated/20040101000000_20170915115700_ephemeris.csv',
+                    'data/calculated/20040101000000_20170915115700_ephemeris.bin',
+                    'data/calculated/lfe_detections_unet.csv']},
+    'join_lfes': {
+        'script': 'data_processing/join_lfes.py',
+        'inputs': ['data/calculated/lfe_detections_unet.csv'],
+        'outputs': ['data/calculated/LFEs_joined.csv']},
+    'add_ppos': {
+        'script': 'data_processing/add_ppos.py',
+        'inputs': ['data/calculated/LFEs_joined.csv',
+                   'data/raw/mag_phases_2004_2017_final.sav'],
+        'outputs': ['data/calculated/Joined_LFEs_w_phases.csv']},
+    'join_json': {
+        'script': 'data_processing/join_json.py',
+        'inputs': ['data_processing/lfe_func.py',
+                   'data/raw/2004001_2017258_catalogue.json',
+                   'data/calculated/lfe_detections_unet.csv',
+                   'data/calculated/LFEs_joined.csv'],
+        'outputs': ['data/calculated/2004001_2017258_joint_catalogue.json',
+                    'data/calculated/2004001_2017258_catalogue.bin']},
+    'caches': {
+        'script': 'data_processing/build_caches.py',
+        'inputs': ['data_processing/lfe_func.py',
+                   'data/calculated/2004001_2017258_joint_catalogue.json',
+                   'data/raw/SKR_raw'],
+        'outputs': ['data/calculated/SKR_cache',
+                    'data/calculated/2004001_2017258_joint_catalogue.bin']},
+    'polygon_flux': {
+        'script': 'data_processing/get_polygon_flux.py',
+        'inputs': ['data_processing/lfe_func.py',
+                   'data/calculated/2004001_2017258_joint_catalogue.json',
+                   'data/calculated/2004001_2017258_joint_catalogue.bin',
+                   'data/calculated/SKR_cache',
+                   'data/raw/SKR_raw'],
+        'outputs': ['data/calculated/skr_poly_flux',
+                    'data/calculated/skr_lfe_labels',
+                    'data/calculated/poly_flux_combined.zarr',
+                    'data/calculated/poly_flux_combined.ncdf']},
+    'lfe_power': {
+        'script': 'data_processing/get_lfe_power.py',
+        'inputs': ['data_processing/lfe_func.py',
+                   'integration_not_sorted/integration_tools.py',
+                   'data/calculated/2004001_2017258_joint_catalogue.json',
+                   'data/calculated/2004001_2017258_joint_catalogue.bin',
+                   'data/calculated/SKR_cache',
+                   'data/calculated/LFEs_joined.csv',
+                   'data/raw/SKR_raw'],
+        'outputs': ['data/calculated/LFEs_joined_power.csv']},
+}
+
+def file_hash(fp, hash_cache):
+    """Hash the content of a file, reusing the cached hash while its size and modification time are unchanged.
+
+    Parameters
+    ----------
+    fp: str
+        Path of the file.
+
+    hash_cache: dict
+        Cache of [size, mtime_ns, hash] by path. Updated in place.
+
+    Returns
+    -------
+    digest: str
+        SHA-256 hex digest of the file content, None if it does not exist.
+    """
+    signature = file_signature(fp)
+    if signature is None:
+        return None
+
+    cached = hash_cache.get(fp)
+    if cached is not None and cached[:2] == signature:
+        return cached[2]
+
+    digest = hashlib.sha256()
+    with open(fp, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+
+    hash_cache[fp] = signature + [digest.hexdigest()]
+
+    return digest.hexdigest()
+
+def path_hash(fp, hash_cache):
+    """Hash a file, or every file of a folder with its relative path.
+
+    Parameters
+    ----------
+    fp: str
+        Path of the file or folder.
+
+    hash_cache: dict
+        Cache of [size, mtime_ns, hash] by file path. Updated in place.
+
+    Returns
+    -------
+    digest: str
+        SHA-256 hex digest, None if the path does not exist.
+    """
+    if not os.path.isdir(fp):
+        return file_hash(fp, hash_cache)
+
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(fp):
+        dirs.sort()
+        for name in sorted(files):
+            file_fp = os.path.join(root, name)
+            digest.update(f'{os.path.relpath(file_fp, fp)}\0{file_hash(file_fp, hash_cache)}\0'.encode())
+
+    return digest.hexdigest()
+
+def stage_key(name, hash_cache, stages=STAGES):
+    """Hash the script and inputs of a stage.
+
+    Parameters
+    ----------
+    name: str
+        Name of the stage in stages.
+
+    hash_cache: dict
+        Cache of [size, mtime_ns, hash] by file path. Updated in place.
+
+    stages: dict, optional
+        Stage declarations. Default is STAGES.
+
+    Returns
+    -------
+    key: str
+        SHA-256 hex digest identifying the stage run.
+
+    missing: list
+        Inputs that do not exist.
+    """
+    stage = stages[name]
+    paths = [stage['script']] + stage['inputs']
+    hashes = {fp: path_hash(fp, hash_cache) for fp in paths}
+
+    key = hashlib.sha256(json.dumps(hashes, sort_keys=True).encode()).hexdigest()
+
+    return key, [fp for fp in paths if hashes[fp] is None]
+
+def stage_dependencies(stages=STAGES):
+    """Find the stages writing the inputs of every stage.
+
+    Parameters
+    ----------
+    stages: dict, optional
+        Stage declarations. Default is STAGES.
+
+    Returns
+    -------
+    dependencies: dict
+        Set of upstream stage names for every stage.
+    """
+    writers = {}
+    for name, stage in stages.items():
+        for fp in stage['outputs']:
+            if fp in writers:
+                raise ValueError(f'{fp} is an output of both {writers[fp]} and {name}')
+            writers[fp] = name
+
+    return {name: {writers[fp] for fp in stage['inputs'] if fp in writers} for name, stage in stages.items()}
+
+def load_state(state_fp=pipeline_state_fp):
+    if not os.path.exists(state_fp):
+        return {'stages': {}, 'hashes': {}}
+
+    with open(state_fp) as f:
+        return json.load(f)
+
+def save_state(state, state_fp=pipeline_state_fp):
+    os.makedirs(os.path.dirname(state_fp), exist_ok=True)
+    with open(state_fp + '.tmp', 'w') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(state_fp + '.tmp', state_fp)
+
+def run_pipeline(targets=None, jobs=2, force=False, dry_run=False, mark_done=False, stages=STAGES, state_fp=pipeline_state_fp):
+    """Run the stages that are not up to date.
+
+    A stage is up to date if its outputs exist and the hash of its script and inputs matches the one recorded in the
+    state file after its last successful run. A stage downstream of a rerun stage is only run again if the outputs it
+    reads changed. Stages are started as soon as the stages they depend on are done, up to jobs of them at once, each
+    in its own Python process.
+
+    Parameters
+    ----------
+    targets: list, optional
+        Stages to bring up to date, together with the stages they depend on. Default is all stages.
+
+    jobs: int, optional
+        Number of stages run at the same time. Default is 2.
+
+    force: bool, optional
+        If True, the targets are run even if up to date. Default is False.
+
+    dry_run: bool, optional
+        If True, only print the stages that would run. Default is False.
+
+    mark_done: bool, optional
+        If True, record the stages as up to date without running them, e.g. after downloading the calculated files.
+        Default is False.
+
+    stages: dict, optional
+        Stage declarations. Default is STAGES.
+
+    state_fp: str, optional
+        Path of the JSON file recording the stage and file hashes.
+
+    Returns
+    -------
+    failed: list
+        Names of the stages which failed.
+    """
+    dependencies = stage_dependencies(stages)
+    state = load_state(state_fp)
+    hash_cache = state['hashes']
+
+    # Targets and everything upstream of them, in declaration order
+    selected, pending = set(), list(targets or stages)
+    while pending:
+        name = pending.pop()
+        if name not in stages:
+            raise ValueError(f'Unknown stage {name}, choose from {list(stages)}')
+        if name not in selected:
+            selected.add(name)
+            pending.extend(dependencies[name])
+    order = [name for name in stages if name in selected]
+    forced = set(targets or stages) if force else set()
+
+    done, failed, running = set(), [], {}
+    rerun = set()  # Stages which would run in a dry run, their outputs are assumed to change
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        while True:
+            for name in order:
+                if name in done or name in running or name in failed:
+                    continue
+                if not dependencies[name] & selected <= done:
+                    if dependencies[name] & set(failed):
+                        failed.append(name)
+                        print(f'{name}: skipped, an upstream stage failed')
+                    continue
+
+                key, missing = stage_key(name, hash_cache, stages)
+                outputs_exist = all(os.path.exists(fp) for fp in stages[name]['outputs'])
+                up_to_date = (state['stages'].get(name, {}).get('key') == key and outputs_exist
+                              and name not in forced and not (dry_run and dependencies[name] & rerun))
+
+                if up_to_date:
+                    done.add(name)
+                    print(f'{name}: up to date')
+                elif mark_done:
+                    state['stages'][name] = {'key': key, 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+                    done.add(name)
+                    print(f'{name}: marked as up to date')
+                elif dry_run:
+                    rerun.add(name)
+                    done.add(name)
+                    print(f'{name}: would run')
+                elif missing:
+                    failed.append(name)
+                    print(f'{name}: missing inputs {missing}')
+                else:
+                    print(f'{name}: running {stages[name]["script"]}')
+                    running[name] = (executor.submit(subprocess.run, [sys.executable, stages[name]['script']]), time.time())
+
+            if not running:
+                break
+
+            finished, _ = wait([future for future, _ in running.values()], return_when=FIRST_COMPLETED)
+            for name in [name for name, (future, _) in running.items() if future in finished]:
+                future, start = running.pop(name)
+                if future.result().returncode != 0:
+                    failed.append(name)
+                    print(f'{name}: failed with exit code {future.result().returncode}')
+                    continue
+
+                # The key is taken after the run, so an input changed during the run makes the stage rerun next time
+                done.add(name)
+                state['stages'][name] = {'key': stage_key(name, hash_cache, stages)[0], 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+                save_state(state, state_fp)
+                print(f'{name}: done in {time.time() - start:.0f} s')
+
+    if not dry_run:
+        save_state(state, state_fp)
+
+    return failed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the data_processing stages which are not up to date.')
+    parser.add_argument('targets', nargs='*', help=f'stages to bring up to date with their upstream stages, from {list(STAGES)}')
+    parser.add_argument('-j', '--jobs', type=int, default=2, help='number of stages run at the same time')
+    parser.add_argument('--force', action='store_true', help='run the targets even if up to date')
+    parser.add_argument('--dry-run', action='store_true', help='only print the stages which would run')
+    parser.add_argument('--mark-done', action='store_true', help='record the stages as up to date without running them')
+    args = parser.parse_args()
+
+    failed = run_pipeline(args.targets or None, jobs=args.jobs, force=args.force, dry_run=args.dry_run, mark_done=args.mark_done)
+
+    sys.exit(1 if failed else 0)
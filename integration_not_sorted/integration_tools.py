@@ -1,4 +1,7 @@
 #%% Imports
+import os
+import json
+from functools import partial
 import pandas as pd
 import numpy as np
 
@@ -47,6 +50,9 @@ def linear_segments(df, time='datetime_ut', frequency='FREQ', sweep='SWEEP', flu
     """
     Processes a DataFrame to compute linear segments based on frequency and flux values, ensuring sweep uniqueness.
 
+    The data is sorted once by (sweep, frequency) and the segments of every sweep are computed from contiguous
+    arrays, giving the same table as applying fit_pandas to each sweep.
+
     Parameters
     ----------
     df : pd.DataFrame
@@ -80,12 +86,24 @@ def linear_segments(df, time='datetime_ut', frequency='FREQ', sweep='SWEEP', flu
         df.loc[df[sweep] == df[sweep].min(), [time]].min()).values[0] > np.timedelta64(10, 'm'):
         raise ValueError('Sweep number duplication covering more than 10 minutes')
     
-    # Group by sweep and frequency, computing mean flux
+    # Group by sweep and frequency, computing mean flux. The result is sorted by (sweep, frequency)
     df_sweep_resampled = df.groupby([sweep, frequency])[flux].mean().reset_index()
     
-    # Apply the fit_pandas function to compute linear segments
-    fit_results = df_sweep_resampled.groupby(sweep, group_keys=False)[[sweep, frequency, flux]]\
-        .apply(fit_pandas, sweep=sweep, frequency=frequency, flux=flux).reset_index(drop=True)
+    # Compute the linear segments of all sweeps at once, as fit_pandas does for one sweep
+    sweeps = df_sweep_resampled[sweep].to_numpy()
+    freqs, fluxes = df_sweep_resampled[[frequency, flux]].values.T  # Extract frequency and flux as separate arrays
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slopes = np.diff(fluxes) / np.diff(freqs)  # Compute slopes between consecutive points
+    intercepts = fluxes[:-1] - slopes * freqs[:-1]  # Compute intercepts based on slope and frequency
+    
+    same_sweep = sweeps[1:] == sweeps[:-1]  # Drop the pairs crossing a sweep boundary
+    fit_results = pd.DataFrame({
+        sweep: sweeps[:-1][same_sweep],
+        'intercept': intercepts[same_sweep],
+        'slope': slopes[same_sweep],
+        'f1': freqs[:-1][same_sweep],
+        'f2': freqs[1:][same_sweep]
+    })
     
     if len(preserve_cols):  # If there are columns to preserve
         if not len(preserve_funcs):  # Ensure preservation functions are provided
@@ -103,11 +121,77 @@ def linear_segments(df, time='datetime_ut', frequency='FREQ', sweep='SWEEP', flu
         return fit_results.merge(preserved, on=sweep)  # Merge results with preserved data
     return fit_results
 
-def process_in_chunks(hdf5_file, output_file, chunk_size=100):
+def index_sweeps(hdf5_file, key='main', sweep='SWEEP', index_fp=None):
+    """
+    Builds (or loads) a sweep -> row-range index for an HDF5 table.
+
+    Only the sweep column is read. When every sweep occupies one contiguous block of rows, the index allows a chunk
+    of sweeps to be read with a row slice instead of a `where=` scan of the table. The index is cached in
+    index_fp (default: next to the input file) and rebuilt when the size or modification time of the input changes.
+
+    Parameters
+    ----------
+    hdf5_file : str
+        Path to input HDF5 file.
+    key : str, optional
+        Key of the table in the HDF5 file. Default is 'main'.
+    sweep : str, optional
+        Column name representing sweep identifiers. Default is 'SWEEP'.
+    index_fp : str, optional
+        Path of the cached index. Default is hdf5_file + '.sweep_index.npz'.
+
+    Returns
+    -------
+    dict
+        'sweeps': sweep value of each block, 'row_start': first row of each block (with the total number of rows
+        appended), 'contiguous': True when each sweep appears in a single block.
+    """
+    if index_fp is None:
+        index_fp = hdf5_file + '.sweep_index.npz'
+    stat = os.stat(hdf5_file)
+    signature = np.array([stat.st_size, stat.st_mtime_ns])
+
+    if os.path.exists(index_fp):
+        with np.load(index_fp) as cached:
+            if np.array_equal(cached['signature'], signature) and str(cached['key']) == key \
+                    and str(cached['sweep']) == sweep:
+                return {'sweeps': cached['sweeps'], 'row_start': cached['row_start'],
+                        'contiguous': bool(cached['contiguous'])}
+
+    sweep_values = pd.read_hdf(hdf5_file, key=key, columns=[sweep])[sweep].to_numpy()
+    # Start of every run of equal sweep values
+    block_start = np.flatnonzero(np.r_[True, sweep_values[1:] != sweep_values[:-1]])
+    sweeps = sweep_values[block_start]
+    contiguous = len(pd.unique(sweeps)) == len(sweeps)
+    row_start = np.r_[block_start, len(sweep_values)]
+
+    np.savez(index_fp, signature=signature, key=key, sweep=sweep, sweeps=sweeps, row_start=row_start,
+             contiguous=contiguous)
+    return {'sweeps': sweeps, 'row_start': row_start, 'contiguous': contiguous}
+
+
+def _process_chunk(chunk, hdf5_file, key, sweep, segment_kwargs):
+    """
+    Reads one chunk of sweeps, by row range or by a `where=` query, and computes its linear segments.
+    """
+    if chunk[0] == 'rows':
+        chunk_data = pd.read_hdf(hdf5_file, key=key, start=chunk[1], stop=chunk[2])
+    else:
+        chunk_data = pd.read_hdf(hdf5_file, key=key, where=f'{sweep} >= {chunk[1]} & {sweep} <= {chunk[2]}')
+    return linear_segments(chunk_data, sweep=sweep, **segment_kwargs)
+
+
+def process_in_chunks(hdf5_file, output_file, chunk_size=100, cpu_num=1, key='main', output_key='processed',
+                      sweep='SWEEP', index_fp=None, preserve_cols=['Date_UTC'], time='Date_UTC',
+                      flux='akr_flux_si_1au', **segment_kwargs):
     """
     Loads and processes HDF5 data in chunks while ensuring complete sweeps.
     The processed chunks are appended to an output HDF5 file.
 
+    Chunks are located with the sweep index from index_sweeps and processed by a pool of cpu_num workers. Results
+    are appended in chunk order, and the number of completed chunks is recorded in output_file + '.progress.json'
+    so that an interrupted run resumes from the first unfinished chunk.
+
     Parameters
     ----------
     hdf5_file : str
@@ -116,6 +200,18 @@ def process_in_chunks(hdf5_file, output_file, chunk_size=100):
         Path to output HDF5 file.
     chunk_size : int, optional
         Number of sweeps to process in each chunk. Default is 100.
+    cpu_num : int, optional
+        Number of worker processes. Default is 1 (no pool).
+    key : str, optional
+        Key of the input table. Default is 'main'.
+    output_key : str, optional
+        Key of the output table. Default is 'processed'.
+    sweep : str, optional
+        Column name representing sweep identifiers. Default is 'SWEEP'.
+    index_fp : str, optional
+        Path of the cached sweep index, see index_sweeps.
+    preserve_cols, time, flux, **segment_kwargs
+        Passed to linear_segments.
 
     Returns
     -------
@@ -124,7 +220,7 @@ def process_in_chunks(hdf5_file, output_file, chunk_size=100):
 
     Example
     -------
-    >>> process_in_chunks('input.h5', 'output.h5', chunk_size=50)
+    >>> process_in_chunks('input.h5', 'output.h5', chunk_size=50, cpu_num=4)
     """
     # Imports progressbar if available if not creates a dummy function
     try:
@@ -133,25 +229,63 @@ def process_in_chunks(hdf5_file, output_file, chunk_size=100):
         def progressbar(*args, **kwargs):
             return args[0]
     
-    # Open HDF5 file and retrieve unique sweep values
-    with pd.HDFStore(hdf5_file, mode='r') as store:
-        unique_sweeps = pd.read_hdf(store, key='main', columns=['SWEEP']).SWEEP.unique()
+    sweep_index = index_sweeps(hdf5_file, key=key, sweep=sweep, index_fp=index_fp)
+    sweeps, row_start = sweep_index['sweeps'], sweep_index['row_start']
     
-    # Loop through sweeps in chunks
-    for i in progressbar(range(0, len(unique_sweeps), chunk_size), prefix='Looping SWEEP chunks: '):
-        x1 = unique_sweeps[i]  # Start of chunk
-        x2 = unique_sweeps[min(i + chunk_size - 1, len(unique_sweeps) - 1)]  # End of chunk
-        
-        # Load the relevant sweep data for the chunk
-        chunk_data = pd.read_hdf(hdf5_file, where=f'SWEEP >= {x1} & SWEEP <= {x2}')
-        
-        # Process the chunk using linear segment fitting
-        chunk_result = linear_segments(chunk_data, preserve_cols=['Date_UTC'], time='Date_UTC', flux='akr_flux_si_1au')
-        
-        # Append the processed chunk to the output HDF5 file
-        chunk_result.to_hdf(output_file, key='processed', format='t', append=True, mode='a', data_columns=True)
+    # Chunks of chunk_size sweeps, as row ranges if the sweeps are contiguous or as sweep ranges otherwise
+    if sweep_index['contiguous']:
+        bounds = np.r_[np.arange(0, len(sweeps), chunk_size), len(sweeps)]
+        chunks = [('rows', int(row_start[b0]), int(row_start[b1])) for b0, b1 in zip(bounds[:-1], bounds[1:])]
+    else:
+        unique_sweeps = np.unique(sweeps)
+        chunks = [('sweeps', unique_sweeps[i], unique_sweeps[min(i + chunk_size, len(unique_sweeps)) - 1])
+                  for i in range(0, len(unique_sweeps), chunk_size)]
+    
+    # Resume from the completion record, dropping rows appended after the last recorded chunk
+    progress_fp = output_file + '.progress.json'
+    stat = os.stat(hdf5_file)
+    run = {'input': [stat.st_size, stat.st_mtime_ns], 'chunk_size': chunk_size, 'n_chunks': len(chunks)}
+    progress = {'completed': 0, 'nrows': 0}
+    if os.path.exists(progress_fp) and os.path.exists(output_file):
+        with open(progress_fp) as f:
+            record = json.load(f)
+        if record['run'] == run:
+            progress = record['progress']
+            with pd.HDFStore(output_file, mode='a') as store:
+                if output_key in store and store.get_storer(output_key).nrows > progress['nrows']:
+                    store.remove(output_key, start=progress['nrows'])
+        else:
+            os.remove(output_file)
+    elif os.path.exists(output_file):
+        os.remove(output_file)
+    
+    process = partial(_process_chunk, hdf5_file=hdf5_file, key=key, sweep=sweep,
+                      segment_kwargs=dict(preserve_cols=preserve_cols, time=time, flux=flux, **segment_kwargs))
+    todo = chunks[progress['completed']:]
+    
+    def save_progress():
+        with open(progress_fp + '.tmp', 'w') as f:
+            json.dump({'run': run, 'progress': progress}, f)
+        os.replace(progress_fp + '.tmp', progress_fp)
+    
+    def append(results):
+        for chunk_result in progressbar(results, max_value=len(todo), prefix='Looping SWEEP chunks: '):
+            # Append the processed chunk to the output HDF5 file
+            if len(chunk_result):
+                chunk_result.to_hdf(output_file, key=output_key, format='t', append=True, mode='a',
+                                    data_columns=True)
+            progress['completed'] += 1
+            progress['nrows'] += len(chunk_result)
+            save_progress()
+    
+    if cpu_num > 1:
+        from multiprocess import Pool  # Change 'multiprocess' to 'multiprocessing' if given an error
+        with Pool(cpu_num) as p:
+            append(p.imap(process, todo))
+    else:
+        append(map(process, todo))
     
-        return output_file
+    return output_file
 
     
 def integrate_linear_segment(row, f_min=40, f_max=1040):
@@ -260,12 +394,16 @@ def integrate(df, flimits, sweep='SWEEP', fmin='fmin', fmax='fmax', distance=1.4
     """
     Computes the total integral per sweep, using either fixed or variable limits.
 
+    The segment integrals are computed with array operations and summed per sweep with a grouped sum, which gives
+    the same values as applying integrate_linear_segment or integrate_with_variable_limits to every row.
+
     Parameters
     ----------
     df : pd.DataFrame
         DataFrame containing the segment data.
-    flimits : tuple or pd.DataFrame
-        If a tuple, contains (fmin, fmax) fixed limits. If a DataFrame, provides per-sweep limits.
+    flimits : tuple, list of tuples or pd.DataFrame
+        If a tuple, contains (fmin, fmax) fixed limits. If a list of tuples, every (fmin, fmax) band is integrated in
+        the same pass. If a DataFrame, provides per-sweep limits.
     sweep : str, optional
         Column name representing sweep identifiers. Default is 'SWEEP'.
     fmin : str, optional
@@ -276,7 +414,7 @@ def integrate(df, flimits, sweep='SWEEP', fmin='fmin', fmax='fmax', distance=1.4
     Returns
     -------
     pd.DataFrame
-        DataFrame with integrated values per sweep.
+        DataFrame with integrated values per sweep, one column per band.
 
     Example
     -------
@@ -292,18 +430,120 @@ def integrate(df, flimits, sweep='SWEEP', fmin='fmin', fmax='fmax', distance=1.4
        SWEEP  integral_40_140
     0      1           14850.0
     1      2           24000.0
+    >>> integrate(df, [(40, 140), (0, 1000)]).columns.tolist()
+    ['SWEEP', 'integral_40_140', 'integral_0_1000']
     """
-    df = df.copy()  # Create a copy of the DataFrame to avoid modifying the original
+    m, c = df['slope'].to_numpy(dtype=float), df['intercept'].to_numpy(dtype=float)  # Segment slopes and intercepts
+    f1, f2 = df['f1'].to_numpy(dtype=float), df['f2'].to_numpy(dtype=float)  # Segment frequency boundaries
     
     if isinstance(flimits, pd.DataFrame):  # Check if flimits is a DataFrame
-        fmin = dict(zip(flimits[sweep], flimits[fmin]))  # Convert fmin column to dictionary
-        fmax = dict(zip(flimits[sweep], flimits[fmax]))  # Convert fmax column to dictionary
-        df['integral_variable_limits'] = df.apply(integrate_with_variable_limits, axis=1, f_min=fmin, f_max=fmax)
-        return df.groupby('SWEEP')['integral_variable_limits'].apply(lambda x: sum_ints(x, distance)).reset_index()
+        # Align the per-sweep limits to the segments, the last row of a repeated sweep wins as in a dict
+        limits = flimits.drop_duplicates(subset=sweep, keep='last').set_index(sweep)
+        f_min = df[sweep].map(limits[fmin]).to_numpy(dtype=float)
+        f_max = df[sweep].map(limits[fmax]).to_numpy(dtype=float)
+        integrals = {'integral_variable_limits': _segment_integrals(m, c, f1, f2, f_min, f_max, variable=True)}
     else:
-        fmin, fmax = flimits  # Extract fixed frequency limits
-        df[f'integral_{fmin}_{fmax}'] = df.apply(integrate_linear_segment, axis=1, f_min=fmin, f_max=fmax)
-        return df.groupby('SWEEP')[f'integral_{fmin}_{fmax}'].apply(lambda x: sum_ints(x, distance)).reset_index()
+        bands = [flimits] if np.ndim(flimits) == 1 else flimits  # A single (fmin, fmax) or a list of bands
+        integrals = {f'integral_{f_min}_{f_max}': _segment_integrals(m, c, f1, f2, f_min, f_max) for f_min, f_max in bands}
+
+    integrals = pd.DataFrame(integrals, index=df.index)
+    integrals[sweep] = df[sweep]
+    
+    # nansum per sweep, scaled to the distance as in sum_ints
+    return (integrals.groupby(sweep).sum() * (distance**2) * 1e3).reset_index()
+
+def _segment_integrals(m, c, f1, f2, f_min, f_max, variable=False):
+    """
+    Array version of integrate_linear_segment (or integrate_with_variable_limits if variable is True).
+    """
+    f_int_min = np.maximum(f1, f_min)  # Lower bounds for integration, NaN if the limit is missing
+    f_int_max = np.minimum(f2, f_max)  # Upper bounds for integration
+    
+    with np.errstate(invalid='ignore'):
+        integral = (m / 2) * (f_int_max**2 - f_int_min**2) + c * (f_int_max - f_int_min)
+        integral = np.where(f_int_min >= f_int_max, 0, integral)  # Segments outside of the integration range
+    
+    if variable:
+        integral = np.where(np.isnan(f_int_min), np.nan, integral)  # Missing frequency limits
+    return integral
+        
+def band_weights(freq, bands):
+    """
+    Computes the trapezoid weights of each band on a fixed frequency grid.
+
+    The flux is taken as linear between consecutive channels, as in linear_segments. For the segment between
+    freq[j] and freq[j+1], the integral over the part of the segment inside a band is
+    wl[j] * flux[j] + wr[j] * flux[j+1], so channels only partly inside a band get fractional weights.
+
+    Parameters
+    ----------
+    freq : np.ndarray
+        Channel frequencies, in increasing order.
+    bands : list of tuples
+        (fmin, fmax) limits of each band.
+
+    Returns
+    -------
+    tuple of np.ndarray
+        (wl, wr), each of shape (len(bands), len(freq) - 1), the weights of the left and right channel of every
+        segment.
+
+    Example
+    -------
+    >>> band_weights(np.array([10., 20., 40.]), [(15, 40)])
+    (array([[ 1.25, 10.  ]]), array([[ 3.75, 10.  ]]))
+    """
+    freq = np.asarray(freq, dtype=float)
+    f0, f1 = freq[:-1], freq[1:]  # Segment boundaries
+    f_min, f_max = np.asarray(bands, dtype=float).T[:, :, None]  # Band limits, as columns
+    
+    a = np.clip(f_min, f0, f1)  # Part of each segment inside each band
+    b = np.clip(f_max, f0, f1)
+    b = np.maximum(a, b)
+    
+    wr = ((b - f0)**2 - (a - f0)**2) / (2 * (f1 - f0))  # Integral of the right channel's share of the segment
+    wl = (b - a) - wr
+    return wl, wr
+
+def integrate_spectrogram(freq, flux, flimits, distance=1.496e11):
+    """
+    Integrates a (freq, time) spectrogram on a fixed frequency grid over one or more bands.
+
+    Gives the same values as create_sweeps, linear_segments and integrate applied to the long-form data (one sweep
+    per time column), without building the DataFrames: segments with a missing (NaN) end are skipped as in the
+    nansum of sum_ints, and every band is computed with one matrix multiplication.
+
+    Parameters
+    ----------
+    freq : np.ndarray
+        Channel frequencies, in increasing order.
+    flux : np.ndarray
+        Flux of shape (len(freq), n_times), as returned by lfe_func.get_sav_data.
+    flimits : tuple or list of tuples
+        (fmin, fmax) limits, or a list of them.
+    distance : float, optional
+        Distance used in the scaling of sum_ints. Default is 1.496e11.
+
+    Returns
+    -------
+    np.ndarray
+        Integrated values of shape (n_times,) for a single band, or (len(flimits), n_times) for a list of bands.
+
+    Example
+    -------
+    >>> freq, flux = np.array([10., 20., 40.]), np.array([[1., np.nan], [2., 2.], [3., 3.]])
+    >>> integrate_spectrogram(freq, flux, (15, 40), distance=1.)
+    array([58750., 50000.])
+    """
+    bands = [flimits] if np.ndim(flimits) == 1 else flimits  # A single (fmin, fmax) or a list of bands
+    wl, wr = band_weights(freq, bands)
+    
+    flux = np.asarray(flux, dtype=float)
+    valid = np.isfinite(flux[:-1]) & np.isfinite(flux[1:])  # Segments with both ends measured
+    integral = wl @ np.where(valid, flux[:-1], 0) + wr @ np.where(valid, flux[1:], 0)
+    integral *= (distance**2) * 1e3  # Scaling of sum_ints
+    
+    return integral[0] if np.ndim(flimits) == 1 else integral
         
 def create_sweeps(data, time='datetime_ut', sweep='SWEEP', inplace=True):
     """
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The scripts import each other as top-level modules, as when run from the Saturn_LFEs directory
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(root, 'data_processing'), os.path.join(root, 'integration_not_sorted')]
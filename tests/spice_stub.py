@@ -0,0 +1,37 @@
+"""Minimal stand-in for the spiceypy functions used by get_ephemeris.get_CassiniEphemeris, without any kernel.
+
+Positions are smooth functions of the ephemeris time. Setting the SPICE_STUB_FAIL_AFTER environment variable makes
+spkpos raise for ephemeris times after it, to simulate a failing chunk.
+"""
+import os
+import contextlib
+
+import numpy as np
+
+R_S_3 = np.array([60268., 60268., 54364.])
+
+@contextlib.contextmanager
+def KernelPool(metakernel):
+    yield
+
+def bodn2c(name):
+    return 699
+
+def bodvrd(body, item, maxn):
+    return 3, R_S_3.copy()
+
+def datetime2et(datetimes):
+    return np.array([(dt - np.datetime64('2000-01-01T12:00:00')) / np.timedelta64(1, 's') for dt in np.asarray(datetimes, dtype='datetime64[us]')])
+
+def spkpos(target, ets, frame, abcorr, observer):
+    ets = np.atleast_1d(np.asarray(ets, dtype=float))
+
+    fail_after = os.environ.get('SPICE_STUB_FAIL_AFTER')
+    if fail_after is not None and np.any(ets > float(fail_after)):
+        raise RuntimeError('stub SPICE failure')
+
+    phase = ets / 86400 * 2 * np.pi / 10
+    distance = 1.4e9 if target == 'SUN' else 20 * R_S_3[0] * (1 + 0.5 * np.sin(ets / 86400 / 30))
+    pos = np.column_stack((distance * np.cos(phase), distance * np.sin(phase), 0.1 * distance * np.sin(phase / 3)))
+
+    return pos, np.zeros(len(ets))
@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+
+from add_ppos import get_ppo_phases
+
+def make_ppo(model_time, phase):
+    model_time, phase = np.asarray(model_time, dtype=float), np.asarray(phase, dtype=float)
+    return {'south_model_time': model_time, 'south_mag_phase': phase,
+            'north_model_time': model_time, 'north_mag_phase': phase}
+
+def days(*doy2004):
+    return pd.Timestamp(2004, 1, 1) + pd.to_timedelta(np.asarray(doy2004), unit='D')
+
+def test_linear_wraps_into_0_360():
+    ppo = make_ppo([0, 1, 2, 3], [300, 350, 10, 60])
+
+    south, north = get_ppo_phases(days(0.5, 1.9, 2.5), ppo, mode='linear')
+
+    np.testing.assert_allclose(south, [325, 8, 35])
+    np.testing.assert_allclose(north, south)
+    assert np.all((south >= 0) & (south < 360))
+
+def test_linear_skips_nan_phase():
+    ppo = make_ppo([0, 1, 2, 3, 4, 5], [300, 350, 10, np.nan, 110, 160])
+
+    south, _ = get_ppo_phases(days(1.5, 3.5, 4.5), ppo, mode='linear')
+
+    # The NaN sample is left out, day 3.5 is interpolated between days 2 and 4
+    np.testing.assert_allclose(south, [0, 85, 135])
+
+def test_linear_skips_nan_model_time():
+    ppo = make_ppo([0, 1, np.nan, 3], [300, 350, 20, 60])
+
+    south, _ = get_ppo_phases(days(2), ppo, mode='linear')
+
+    np.testing.assert_allclose(south, [25])
+
+def test_nearest_skips_nan_phase():
+    ppo = make_ppo([0, 1, 2, 3], [300, 350, np.nan, 60])
+
+    south, _ = get_ppo_phases(days(0.4, 2.1, 2.9), ppo, mode='nearest')
+
+    np.testing.assert_array_equal(south, [300, 60, 60])
+
+def test_both_modes_wrap_into_0_360():
+    ppo = make_ppo([0, 1, 2], [-10, 370, 20])
+
+    for mode in ('nearest', 'linear'):
+        south, _ = get_ppo_phases(days(0, 1, 2), ppo, mode=mode)
+
+        np.testing.assert_allclose(south, [350, 10, 20])
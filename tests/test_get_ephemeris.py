@@ -0,0 +1,76 @@
+import os
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import spice_stub
+from get_ephemeris import get_CassiniEphemeris, get_CassiniEphemeris_chunked
+
+@pytest.fixture
+def datetimes():
+    return np.arange(datetime.datetime(2006, 1, 1), datetime.datetime(2006, 1, 1, 0, 30), datetime.timedelta(minutes=1), dtype=datetime.datetime)
+
+def chunk_files(checkpoint_fp):
+    return sorted(os.listdir(checkpoint_fp))
+
+def test_chunked_matches_single_call(tmp_path, datetimes):
+    checkpoint_fp = str(tmp_path / 'chunks')
+
+    df = get_CassiniEphemeris_chunked(datetimes, checkpoint_fp=checkpoint_fp, chunk_size=7, cpu_num=2, backend='spice_stub')
+
+    pd.testing.assert_frame_equal(df, get_CassiniEphemeris(datetimes, backend=spice_stub, progress=False))
+    assert len(chunk_files(checkpoint_fp)) == 5  # 30 datetimes in chunks of 7
+
+def test_chunked_resumes_from_checkpoints(tmp_path, datetimes):
+    checkpoint_fp = str(tmp_path / 'chunks')
+    get_CassiniEphemeris_chunked(datetimes, checkpoint_fp=checkpoint_fp, chunk_size=7, cpu_num=2, backend='spice_stub')
+
+    files = chunk_files(checkpoint_fp)
+    os.remove(os.path.join(checkpoint_fp, files[2]))
+    mtimes = {name: os.stat(os.path.join(checkpoint_fp, name)).st_mtime_ns for name in files if name != files[2]}
+
+    df = get_CassiniEphemeris_chunked(datetimes, checkpoint_fp=checkpoint_fp, chunk_size=7, cpu_num=2, backend='spice_stub')
+
+    # Only the missing chunk is computed again
+    assert chunk_files(checkpoint_fp) == files
+    assert mtimes == {name: os.stat(os.path.join(checkpoint_fp, name)).st_mtime_ns for name in mtimes}
+    pd.testing.assert_frame_equal(df, get_CassiniEphemeris(datetimes, backend=spice_stub, progress=False))
+
+def test_chunked_cleans_temporary_files(tmp_path, datetimes, monkeypatch):
+    checkpoint_fp = str(tmp_path / 'chunks')
+    os.makedirs(checkpoint_fp)
+    open(os.path.join(checkpoint_fp, 'ephemeris_stale.pkl.tmp'), 'w').close()
+
+    # Chunks after the first 14 minutes fail, as if the run was interrupted
+    fail_after = spice_stub.datetime2et([datetimes[13]])[0]
+    monkeypatch.setenv('SPICE_STUB_FAIL_AFTER', str(fail_after))
+    with pytest.raises(RuntimeError):
+        get_CassiniEphemeris_chunked(datetimes, checkpoint_fp=checkpoint_fp, chunk_size=7, cpu_num=1, backend='spice_stub')
+
+    assert not [name for name in chunk_files(checkpoint_fp) if name.endswith('.tmp')]
+    assert len(chunk_files(checkpoint_fp)) == 2
+
+    monkeypatch.delenv('SPICE_STUB_FAIL_AFTER')
+    df = get_CassiniEphemeris_chunked(datetimes, checkpoint_fp=checkpoint_fp, chunk_size=7, cpu_num=1, backend='spice_stub')
+
+    assert len(chunk_files(checkpoint_fp)) == 5
+    pd.testing.assert_frame_equal(df, get_CassiniEphemeris(datetimes, backend=spice_stub, progress=False))
+
+def test_chunked_metakernel_change_starts_new_chunks(tmp_path, datetimes):
+    checkpoint_fp = str(tmp_path / 'chunks')
+    metakernel = tmp_path / 'metakernel.txt'
+    metakernel.write_text("\\begindata\nKERNELS_TO_LOAD = ( 'a.bsp' )\n")
+
+    get_CassiniEphemeris_chunked(datetimes, checkpoint_fp=checkpoint_fp, chunk_size=7, cpu_num=2, metakernel=str(metakernel), backend='spice_stub')
+    files = chunk_files(checkpoint_fp)
+    get_CassiniEphemeris_chunked(datetimes, checkpoint_fp=checkpoint_fp, chunk_size=7, cpu_num=2, metakernel=str(metakernel), backend='spice_stub')
+    assert chunk_files(checkpoint_fp) == files
+
+    # The stale chunks are kept but not read
+    metakernel.write_text("\\begindata\nKERNELS_TO_LOAD = ( 'b.bsp' )\n")
+    df = get_CassiniEphemeris_chunked(datetimes, checkpoint_fp=checkpoint_fp, chunk_size=7, cpu_num=2, metakernel=str(metakernel), backend='spice_stub')
+
+    assert len(chunk_files(checkpoint_fp)) == 10
+    pd.testing.assert_frame_equal(df, get_CassiniEphemeris(datetimes, backend=spice_stub, progress=False))
@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+
+import matplotlib.dates as mdates
+
+import get_lfe_power
+from get_lfe_power import match_lfe_starts, polygon_power
+
+def test_match_lfe_starts_by_time():
+    lfe_starts = pd.to_datetime(['2006-03-01 10:00', '2006-01-01 00:00', '2006-02-01 12:00', '2006-04-01 00:00']).to_numpy()
+
+    # Catalogue with one polygon missing, one off by a minute and one without any LFE
+    catalogue_starts = pd.to_datetime(['2006-01-01 00:00', '2006-02-01 12:01', '2006-03-01 10:00', '2006-05-01 00:00']).to_numpy()
+
+    np.testing.assert_array_equal(match_lfe_starts(lfe_starts, catalogue_starts), [1, 2, 0, -1])
+
+def test_polygon_power_split_over_years():
+    time = np.datetime64('2006-12-31T12:00:00') + np.arange(480) * np.timedelta64(180, 's')
+    freq = np.logspace(np.log10(3.5), np.log10(1200), 48)
+    flux = 10**np.random.default_rng(0).normal(-20, 0.5, (len(freq), len(time)))
+
+    # Polygon crossing the new year
+    start, end = mdates.date2num(np.datetime64('2006-12-31T20:00')), mdates.date2num(np.datetime64('2007-01-01T04:00'))
+    poly = np.array([[start, 20.], [end, 30.], [end, 600.], [start, 500.], [start, 20.]])
+
+    def power(columns):
+        get_lfe_power._year_data.update(time_num=mdates.date2num(time[columns]), freq=freq, flux=flux[:, columns])
+        return polygon_power(poly)
+
+    new_year = np.searchsorted(time, np.datetime64('2007-01-01'))
+    whole, first_year, second_year = power(slice(None)), power(slice(None, new_year)), power(slice(new_year, None))
+
+    np.testing.assert_allclose(first_year[0] + second_year[0], whole[0])
+    assert first_year[0] > 0 and second_year[0] > 0
+    assert max(first_year[1], second_year[1]) == whole[1]
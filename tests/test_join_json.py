@@ -0,0 +1,29 @@
+import numpy as np
+import pandas as pd
+
+from join_json import match_joined_lfes
+
+def lfe_table(starts, ends):
+    return pd.DataFrame({'start': pd.to_datetime(starts), 'end': pd.to_datetime(ends)})
+
+def test_match_joined_lfes_sorted():
+    detections = lfe_table(['2006-01-01 00:00', '2006-01-01 01:05', '2006-01-01 02:00', '2006-01-02 00:00'],
+                           ['2006-01-01 01:00', '2006-01-01 01:30', '2006-01-01 03:00', '2006-01-02 01:00'])
+    joined = lfe_table(['2006-01-01 00:00', '2006-01-01 02:00', '2006-01-02 00:00'],
+                       ['2006-01-01 01:30', '2006-01-01 03:00', '2006-01-02 01:00'])
+
+    groups = match_joined_lfes(joined, detections)
+
+    assert [group.tolist() for group in groups] == [[0, 1], [2], [3]]
+
+def test_match_joined_lfes_unsorted():
+    # Same tables, detections and joined LFEs shuffled
+    detections = lfe_table(['2006-01-01 02:00', '2006-01-02 00:00', '2006-01-01 01:05', '2006-01-01 00:00'],
+                           ['2006-01-01 03:00', '2006-01-02 01:00', '2006-01-01 01:30', '2006-01-01 01:00'])
+    joined = lfe_table(['2006-01-02 00:00', '2006-01-01 00:00', '2006-01-01 02:00'],
+                       ['2006-01-02 01:00', '2006-01-01 01:30', '2006-01-01 03:00'])
+
+    groups = match_joined_lfes(joined, detections)
+
+    # Positions in the shuffled detections, in the order of the shuffled joined LFEs
+    assert [group.tolist() for group in groups] == [[1], [3, 2], [0]]
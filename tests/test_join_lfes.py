@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+
+from join_lfes import LFE_joiner
+
+def make_lfes(intervals):
+    """Detections from (start, end) pairs in minutes after 2006-01-01."""
+    start, end = np.asarray(intervals).T
+    base = pd.Timestamp(2006, 1, 1)
+
+    return pd.DataFrame({'start': base + pd.to_timedelta(start, unit='m'), 'end': base + pd.to_timedelta(end, unit='m'),
+                         'x_ksm': 0., 'y_ksm': 0., 'z_ksm': 0., 'R_ksm': 0., 'subLST': 0., 'subLat': 0., 'subLon': 0.,
+                         'label': 'LFE'})
+
+def test_joins_chains_of_short_gaps(tmp_path):
+    lfe_df = make_lfes([(0, 30), (35, 60), (65, 90), (200, 230), (245, 260)])
+
+    joined, secs = LFE_joiner(str(tmp_path) + '/', lfe_df)
+
+    assert list(joined['start'] - pd.Timestamp(2006, 1, 1)) == list(pd.to_timedelta([0, 200, 245], unit='m'))
+    assert list(joined['end'] - pd.Timestamp(2006, 1, 1)) == list(pd.to_timedelta([90, 230, 260], unit='m'))
+    assert secs == [5400, 1800, 900]
+
+def test_gap_is_taken_from_latest_end(tmp_path):
+    # The second detection lies inside the first, the third starts 5 minutes after the end of the first
+    lfe_df = make_lfes([(0, 120), (10, 20), (125, 150), (300, 310)])
+
+    joined, _ = LFE_joiner(str(tmp_path) + '/', lfe_df)
+
+    assert len(joined) == 2
+    assert joined['end'].iloc[0] == pd.Timestamp(2006, 1, 1) + pd.Timedelta(150, 'm')
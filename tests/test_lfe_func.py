@@ -0,0 +1,66 @@
+import os
+import json
+
+import numpy as np
+
+from lfe_func import get_catalogue, catalogue_polygons, get_spectrogram, save_packed_arrays
+
+def write_catalogue(fp):
+    polygons = [[[0, 10], [60, 10], [60, 100], [0, 10]], [[120, 20], [300, 20], [300, 200], [120, 20]]]
+    catalogue = {'type': 'FeatureCollection',
+                 'features': [{'type': 'Feature', 'id': i, 'geometry': {'type': 'Polygon', 'coordinates': [poly]}, 'properties': {'feature_type': 'LFE'}}
+                              for i, poly in enumerate(polygons)],
+                 'crs': {'type': 'local', 'properties': {'name': 'Time-Frequency', 'time_coords_id': 'unix', 'spectral_coords': {'type': 'frequency', 'unit': 'kHz'}}}}
+    with open(fp, 'w') as f:
+        json.dump(catalogue, f)
+
+    return [np.array(poly, dtype=float) for poly in polygons]
+
+def test_catalogue_cache_is_written_to_cache_fp(tmp_path):
+    os.makedirs(tmp_path / 'raw')
+    polygons = write_catalogue(tmp_path / 'raw' / 'catalogue.json')
+
+    arrays, meta = get_catalogue(str(tmp_path / 'raw' / 'catalogue.json'), cache_fp=str(tmp_path / 'calculated'))
+
+    assert os.listdir(tmp_path / 'raw') == ['catalogue.json']
+    assert os.listdir(tmp_path / 'calculated') == ['catalogue.bin']
+    for poly, expected in zip(catalogue_polygons(arrays), polygons):
+        np.testing.assert_array_equal(poly, expected)
+    assert [feature['id'] for feature in meta['features']] == [0, 1]
+
+def test_catalogue_without_cache(tmp_path):
+    polygons = write_catalogue(tmp_path / 'catalogue.json')
+
+    arrays, _ = get_catalogue(str(tmp_path / 'catalogue.json'), cache_fp=None)
+
+    assert os.listdir(tmp_path) == ['catalogue.json']
+    np.testing.assert_array_equal(catalogue_polygons(arrays)[1], polygons[1])
+
+def test_decimated_spectrogram_matches_full_resolution(tmp_path):
+    rng = np.random.default_rng(0)
+    time = np.datetime64('2006-01-01T00:00:00') + np.arange(960) * np.timedelta64(180, 's')
+    freq = np.logspace(0.6, 3, 12)
+    flux = 10**rng.normal(-20, 1, (len(freq), len(time)))
+    flux[rng.random(flux.shape) < 0.1] = np.nan
+
+    os.makedirs(tmp_path / 'SKR_cache')
+    save_packed_arrays(str(tmp_path / 'SKR_cache' / 'SKR_2006_CJ.bin'), {'time': time, 'freq': freq, 'flux': flux}, meta={'source': None})
+    kwargs = {'log_freq_bins': None, 'skr_raw_fp': str(tmp_path / 'SKR_raw'), 'skr_cache_fp': str(tmp_path / 'SKR_cache'),
+              'pyramid_fp': str(tmp_path / 'SKR_pyramid')}
+
+    # 890 minutes from 05:10 do not fit in 40 columns of 3 or 12 minutes, so 24 minute columns are used
+    start, end = '2006-01-01T05:10', '2006-01-01T20:00'
+    full_time, _, full_flux = get_spectrogram(start, end, **kwargs)
+    coarse_time, _, coarse_flux = get_spectrogram(start, end, max_columns=40, **kwargs)
+
+    # The first column is the one containing start, not the first one starting after it
+    assert coarse_time[0] == np.datetime64('2006-01-01T04:48')
+    assert coarse_time[-1] == np.datetime64('2006-01-01T19:36')
+
+    for i, column_start in enumerate(coarse_time):
+        column = (time >= column_start) & (time < column_start + np.timedelta64(24, 'm'))
+        full_column = (full_time >= column_start) & (full_time < column_start + np.timedelta64(24, 'm'))
+        np.testing.assert_allclose(coarse_flux[:, i], np.nanmean(flux[:, column], axis=1), rtol=1e-6)
+
+        # Full resolution columns inside the window match the cached flux
+        np.testing.assert_array_equal(full_flux[:, full_column], flux[:, column & (time >= np.datetime64(start))])
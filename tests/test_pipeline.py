@@ -0,0 +1,61 @@
+import sys
+
+import pytest
+
+from pipeline import STAGES, run_pipeline, stage_dependencies
+
+def write_script(fp, text):
+    fp.write_text(text)
+    return str(fp)
+
+@pytest.fixture
+def stages(tmp_path, monkeypatch):
+    """Three stages: a and b read a.txt, c reads the outputs of both."""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'a.txt').write_text('hello\n')
+
+    return {'a': {'script': write_script(tmp_path / 'a.py', "open('b.txt', 'w').write(open('a.txt').read().upper())"),
+                  'inputs': ['a.txt'], 'outputs': ['b.txt']},
+            'b': {'script': write_script(tmp_path / 'b.py', "open('c.txt', 'w').write(open('a.txt').read()[::-1])"),
+                  'inputs': ['a.txt'], 'outputs': ['c.txt']},
+            'c': {'script': write_script(tmp_path / 'c.py', "open('d.txt', 'w').write(open('b.txt').read() + open('c.txt').read())"),
+                  'inputs': ['b.txt', 'c.txt'], 'outputs': ['d.txt']}}
+
+def ran(capsys):
+    return sorted(line.split(':')[0] for line in capsys.readouterr().out.splitlines() if ': running' in line)
+
+def test_stages_have_single_writers():
+    dependencies = stage_dependencies(STAGES)
+
+    # The caches shared by polygon_flux and lfe_power are built before both
+    assert {'caches'} <= dependencies['polygon_flux'] & dependencies['lfe_power']
+
+    # Packed catalogues are written to data/calculated, not next to the raw catalogue
+    assert not [fp for stage in STAGES.values() for fp in stage['outputs'] if fp.startswith('data/raw')]
+
+    with pytest.raises(ValueError):
+        stage_dependencies({'x': {'inputs': [], 'outputs': ['f']}, 'y': {'inputs': [], 'outputs': ['f']}})
+
+def test_reruns_only_changed_stages(stages, tmp_path, capsys):
+    kwargs = {'stages': stages, 'state_fp': str(tmp_path / 'state.json')}
+
+    assert run_pipeline(**kwargs) == []
+    assert ran(capsys) == ['a', 'b', 'c']
+    assert (tmp_path / 'd.txt').read_text() == 'HELLO\n\n' + 'olleh'
+
+    assert run_pipeline(**kwargs) == []
+    assert ran(capsys) == []
+
+    # b is edited but writes the same output, so c is not rerun
+    (tmp_path / 'b.py').write_text((tmp_path / 'b.py').read_text() + '\n# comment\n')
+    assert run_pipeline(**kwargs) == []
+    assert ran(capsys) == ['b']
+
+    (tmp_path / 'a.txt').write_text('world\n')
+    assert run_pipeline(**kwargs) == []
+    assert ran(capsys) == ['a', 'b', 'c']
+
+def test_failure_skips_downstream(stages, tmp_path, capsys):
+    (tmp_path / 'a.py').write_text('raise SystemExit(3)')
+
+    assert sorted(run_pipeline(stages=stages, state_fp=str(tmp_path / 'state.json'))) == ['a', 'c']
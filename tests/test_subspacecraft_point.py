@@ -0,0 +1,115 @@
+import datetime
+
+import numpy as np
+import pytest
+import spiceypy as spice
+
+from get_ephemeris import get_CassiniEphemeris
+
+# Minimal text kernels: leap seconds, Saturn radii and rotation, and a KSM-like frame
+LSK = """KPL/LSK
+\\begindata
+DELTET/DELTA_T_A = 32.184
+DELTET/K = 1.657D-3
+DELTET/EB = 1.671D-2
+DELTET/M = ( 6.239996D0 1.99096871D-7 )
+DELTET/DELTA_AT = ( 32, @1999-JAN-1
+                    33, @2006-JAN-1 )
+\\begintext
+"""
+
+PCK = """KPL/PCK
+\\begindata
+BODY699_RADII = ( 60268.0 60268.0 54364.0 )
+BODY699_POLE_RA = ( 40.589 -0.036 0.0 )
+BODY699_POLE_DEC = ( 83.537 -0.004 0.0 )
+BODY699_PM = ( 38.90 810.7939024 0.0 )
+\\begintext
+"""
+
+FK = """KPL/FK
+\\begindata
+FRAME_CASSINI_KSM = 1699001
+FRAME_1699001_NAME = 'CASSINI_KSM'
+FRAME_1699001_CLASS = 5
+FRAME_1699001_CLASS_ID = 1699001
+FRAME_1699001_CENTER = 699
+FRAME_1699001_RELATIVE = 'J2000'
+FRAME_1699001_DEF_STYLE = 'PARAMETERIZED'
+FRAME_1699001_FAMILY = 'TWO-VECTOR'
+FRAME_1699001_PRI_AXIS = 'X'
+FRAME_1699001_PRI_VECTOR_DEF = 'OBSERVER_TARGET_POSITION'
+FRAME_1699001_PRI_OBSERVER = 'SATURN'
+FRAME_1699001_PRI_TARGET = 'SUN'
+FRAME_1699001_PRI_ABCORR = 'NONE'
+FRAME_1699001_SEC_AXIS = 'Z'
+FRAME_1699001_SEC_VECTOR_DEF = 'CONSTANT'
+FRAME_1699001_SEC_FRAME = 'IAU_SATURN'
+FRAME_1699001_SEC_SPEC = 'RECTANGULAR'
+FRAME_1699001_SEC_VECTOR = ( 0, 0, 1 )
+\\begintext
+"""
+
+def write_states(handle, body, center, epochs, positions, velocities):
+    spice.spkw09(handle, body, center, 'J2000', epochs[0], epochs[-1], f'SYNTHETIC {body}', 7, len(epochs),
+                 np.hstack((positions, velocities)), epochs)
+
+@pytest.fixture(scope='module')
+def metakernel(tmp_path_factory):
+    """Synthetic kernels for two days of 2006: Saturn on a circular heliocentric orbit and an inclined, eccentric
+    Cassini orbit, so the sub-spacecraft point covers all longitudes and a wide range of latitudes."""
+    kernel_fp = tmp_path_factory.mktemp('kernels')
+    for name, text in (('lsk.tls', LSK), ('pck.tpc', PCK), ('fk.tf', FK)):
+        (kernel_fp / name).write_text(text)
+
+    with spice.KernelPool(str(kernel_fp / 'lsk.tls')):
+        epochs = np.arange(spice.str2et('2005-12-31T00:00:00'), spice.str2et('2006-01-04T00:00:00'), 300.)
+
+    # Saturn around the solar system barycentre, the Sun at the barycentre
+    omega_saturn = 2 * np.pi / (29.46 * 365.25 * 86400)
+    saturn_pos = 1.43e9 * np.column_stack((np.cos(omega_saturn * epochs), np.sin(omega_saturn * epochs), np.zeros(len(epochs))))
+    saturn_vel = 1.43e9 * omega_saturn * np.column_stack((-np.sin(omega_saturn * epochs), np.cos(omega_saturn * epochs), np.zeros(len(epochs))))
+
+    # Cassini around Saturn, radius 4-40 R_S over a 1.5 day orbit inclined by 60 degrees
+    omega = 2 * np.pi / (1.5 * 86400)
+    radius = 60268 * (22 + 18 * np.cos(omega * epochs / 2))
+    radius_rate = -60268 * 9 * omega * np.sin(omega * epochs / 2)
+    inclination = np.radians(60)
+    in_plane = np.column_stack((np.cos(omega * epochs), np.sin(omega * epochs) * np.cos(inclination), np.sin(omega * epochs) * np.sin(inclination)))
+    in_plane_rate = omega * np.column_stack((-np.sin(omega * epochs), np.cos(omega * epochs) * np.cos(inclination), np.cos(omega * epochs) * np.sin(inclination)))
+    cassini_pos = radius[:, None] * in_plane
+    cassini_vel = radius_rate[:, None] * in_plane + radius[:, None] * in_plane_rate
+
+    spk_fp = str(kernel_fp / 'synthetic.bsp')
+    handle = spice.spkopn(spk_fp, 'SYNTHETIC', 0)
+    write_states(handle, 699, 0, epochs, saturn_pos, saturn_vel)
+    write_states(handle, 10, 0, epochs, np.zeros((len(epochs), 3)), np.zeros((len(epochs), 3)))
+    write_states(handle, -82, 699, epochs, cassini_pos, cassini_vel)
+    spice.spkcls(handle)
+
+    metakernel_fp = kernel_fp / 'metakernel.tm'
+    kernels = ' '.join(f"'$KERNELS/{name}'" for name in ('lsk.tls', 'pck.tpc', 'fk.tf', 'synthetic.bsp'))
+    metakernel_fp.write_text(f"KPL/MK\n\\begindata\nPATH_VALUES = ( '{kernel_fp}' )\nPATH_SYMBOLS = ( 'KERNELS' )\n"
+                             f"KERNELS_TO_LOAD = ( {kernels} )\n\\begintext\n")
+
+    return str(metakernel_fp)
+
+def test_vectorized_matches_scalar_spice(metakernel):
+    datetimes = np.arange(datetime.datetime(2006, 1, 1), datetime.datetime(2006, 1, 3), datetime.timedelta(minutes=7), dtype=datetime.datetime)
+
+    vectorized = get_CassiniEphemeris(datetimes, metakernel=metakernel, progress=False, vectorized=True)
+    scalar = get_CassiniEphemeris(datetimes, metakernel=metakernel, progress=False, vectorized=False)
+
+    # The synthetic orbit covers a wide range of sub-spacecraft points
+    assert np.ptp(scalar['subLat']) > 90 and np.ptp(scalar['subLon']) > 300
+
+    np.testing.assert_allclose(vectorized[['x_ksm', 'y_ksm', 'z_ksm', 'R_ksm']], scalar[['x_ksm', 'y_ksm', 'z_ksm', 'R_ksm']])
+    np.testing.assert_allclose(vectorized['subLat'], scalar['subLat'], rtol=0, atol=1e-9)
+
+    # Longitudes and local times are compared on the circle
+    lon_diff = (vectorized['subLon'] - scalar['subLon'] + 180) % 360 - 180
+    np.testing.assert_allclose(lon_diff, 0, atol=1e-9)
+
+    # et2lst truncates to whole seconds
+    lst_diff = (vectorized['subLST'] - scalar['subLST'] + 12) % 24 - 12
+    assert np.all((lst_diff >= -1e-9) & (lst_diff < 1 / 3600 + 1e-9))